@@ -1,9 +1,29 @@
 # Animation writer script
 
-import bpy
-import re
+import os
+import sys
 from math import pi
-import random
+
+import numpy as np
+
+# Make the helper modules next to this script importable
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import profiler
+
+from config import read_config
+from culling import cull_keys, euler_matrices, property_values
+from effects import flash_envelopes, shake_signal
+from layout import lod_names, lod_prefix, lod_ratios, orb_colors, orb_layout, ring_spacing, torus_colors
+from onsets import OnsetIndex, load_tracks
+from tempo import TempoMap
+from timeline import Timeline, lod_property, reduce_keys, save_compiled
+
+# The keyframes are generated without Blender and only written to the scene when run inside it
+try:
+    import bpy
+except ImportError:
+    bpy = None
 
 ### Assume the following objects exist and are set up correctly:
 # Cameras:
@@ -23,14 +43,16 @@ import random
 #  east_wall
 #  north_wall
 #  south_wall
-# Tori: (with existing materials initialized to 1 emission)
+# Tori: (with existing materials initialized to 1 emission, made by ring_tunnel.py)
 #  Torus
-#  Torus1 - Torus[numtor]
-# Orbs: (with existing materials initialized to 0 emission)
+#  Torus1 - Torus[tunnel_pool], parented to Torus
+#  TorusLod1.1 - TorusLod1.[tunnel_pool] and so on, their lower levels of detail
+# Orbs: (with existing materials initialized to 0 emission, made by orbs.py)
 #  Glass
 #  Glass1-Glass[numorb]
 #  Orb
 #  Orb1 - Orb[numorb]
+#  OrbLod1.1 - OrbLod1.[numorb], GlassLod1.1 - GlassLod1.[numorb] and so on, their lower levels of detail
 # Eyeball:
 #  eye.brown
 # Drumsticks:
@@ -38,130 +60,160 @@ import random
 #  stick2
 # Spike
 
-# Assume mididump text files are in the directory with correct names and MIDI numbers
+# Assume onset files are listed in orbit.ini (see config.py) with correct MIDI numbers
+# Onset files can be standard MIDI files (.mid) or text files output by mididump.py
 
 ### Constants and functions
 
 tempo = 120
 framerate = 25
-
-numtor = 50
-numorb = 150
+# Onset file locations and render settings
+config = read_config()
+# Opt-in profiling of the timeline sections, helpers and keyframe writing, see [profile] in orbit.ini
+profile_trace = config.get('profile', 'trace')
+if profile_trace:
+    profiler.enable()
+# Standard MIDI file of the whole song to take tempo and time signature changes from
+# If None, the song is at a constant tempo in 4/4
+song_midi = config.onset_path('song_midi') if config.get('onsets', 'song_midi') else None
+
+numtor = config.getint('scene', 'numtor')
+# Ring objects ring_tunnel.py made for the numtor rings of the tunnel
+numpool = min(config.getint('scene', 'tunnel_pool'), numtor)
+numorb = config.getint('scene', 'numorb')
+# Instanced orbs and rings share one material, orbs flash and rings are colored through their object color
+instanced_orbs = config.getboolean('scene', 'instanced')
+# Levels of detail of orbs, glass shells and rings, and the camera distance beyond which each lower one shows
+numlod = len(lod_ratios(config)) + 1
+# The distances don't matter without lower levels, so emptying ratios alone turns levels of detail off
+lod_distances = [float(distance) for distance in config.get('lod', 'distances').split()] if numlod > 1 else []
+if len(lod_distances) != numlod - 1:
+    raise ValueError('[lod] needs a distance for each of its ratios')
+
+if song_midi is None:
+    tempo_map = TempoMap.constant(tempo, framerate)
+else:
+    tempo_map = TempoMap.from_midi(song_midi, framerate)
+
+# MIDI notes each onset track in [onsets] is filtered by
+# All tracks are read in parallel up front, the effects below then get them from memory
+onset_filters = {
+    'act1orbs': (), 'act1kick': [36], 'swells': (), 'act2bass': (), 'act2kick': [38],
+    'act2snare': [42], 'act2embellish': (), 'act3drums': [40], 'act4orbs': (),
+}
+load_tracks([(config.onset_path(name), notes) for name, notes in onset_filters.items()])
 
 def beat_to_frame(beat):
     # Note: supports float beat numbers, will output float frame numbers in this case
-    # Conversion: frame_num = (beat_num - 1) / beat/min * sec/min * frame/sec + 1
-    frame = ((beat - 1) / tempo) * 60 * framerate + 1
-    return frame
+    # Use tempo_map directly to convert whole arrays of beats
+    return tempo_map.beats_to_frames(beat)
 
 def bar_to_frame(bar):
-    # Assume 4/4 time signature
-    return beat_to_frame(((bar - 1) * 4) + 1)
-
-def note_onset_frames_from_file(filename, filter_midi_notes=[]):
-    # Assume file has been output by mididump.py from vishnubob's python-midi project
-    # python-midi last pull time: Thu Oct 9 13:58:37 2014
-    f = open(filename)
-    # We're going to search for strings of digits
-    p = '\d+'
-    ticks_elapsed = 0
-    onsets = []
-    for line in f:
-        # If we are reading the first line of master metadata, midi.Pattern
-        if 'Pattern' in line:
-            matches = re.findall(p, line)
-            # The resolution (ticks/beat) should be the second digit string
-            res = int(matches[1])
-        # If we are reading a note event
-        if 'midi.Note' in line:
-            matches = re.findall(p, line)
-            # The first digit string should be the number of ticks since the last note event
-            tick = int(matches[0])
-            ticks_elapsed += tick
-            # The third digit string should be the note number
-            note = int(matches[2])
-            # If we're filtering by note, check the note and continue if not a match
-            if len(filter_midi_notes) != 0 and not note in filter_midi_notes:
-                continue
-            # Only include on events, not off events
-            if 'OnEvent' in line:
-                frame = int(round(beat_to_frame((ticks_elapsed / res) + 1)))
-                onsets.append(frame)
-    return onsets
-
-# TODO: this is a temporary alternate function to add functionality, should be merged with the above
-def note_onsets_from_file(filename, filter_midi_notes=[]):
-        # Assume file has been output by mididump.py from vishnubob's python-midi project
-    # python-midi last pull time: Thu Oct 9 13:58:37 2014
-    f = open(filename)
-    # We're going to search for strings of digits
-    p = '\d+'
-    ticks_elapsed = 0
-    onsets = []
-    for line in f:
-        # If we are reading the first line of master metadata, midi.Pattern
-        if 'Pattern' in line:
-            matches = re.findall(p, line)
-            # The resolution (ticks/beat) should be the second digit string
-            res = int(matches[1])
-        # If we are reading a note event
-        if 'midi.Note' in line:
-            matches = re.findall(p, line)
-            # The first digit string should be the number of ticks since the last note event
-            tick = int(matches[0])
-            ticks_elapsed += tick
-            # The third digit string should be the note number
-            note = int(matches[2])
-            # If we're filtering by note, check the note and continue if not a match
-            if len(filter_midi_notes) != 0 and not note in filter_midi_notes:
-                continue
-            # Only include on events, not off events
-            if 'OnEvent' in line:
-                frame = int(round(beat_to_frame((ticks_elapsed / res) + 1)))
-                onsets.append((frame, note))
-    return onsets
+    return tempo_map.bars_to_frames(bar)
 
+@profiler.profiled('helpers')
 def make_appear(objnames, frame):
+    group = tl.find_group(objnames)
+    if group is not None:
+        # Whole groups are shown through their shared visibility channel
+        tl.step(tl.scene(), tl.group_path(group), frame, True, False)
+        return
     for name in objnames:
-        obj = bpy.data.objects[name]
+        obj = tl.object(name)
         # Don't render object or show in 3D view through previous frame
-        obj.hide_render = True
-        obj.keyframe_insert(data_path='hide_render', frame=frame-1)
-        obj.hide = True
-        obj.keyframe_insert(data_path='hide', frame=frame-1)
         # Render and show object starting at frame
-        obj.hide_render = False
-        obj.keyframe_insert(data_path='hide_render', frame=frame)
-        obj.hide = False
-        obj.keyframe_insert(data_path='hide', frame=frame)
+        tl.step(obj, 'hide_render', frame, True, False)
+        tl.step(obj, 'hide', frame, True, False)
         
+@profiler.profiled('helpers')
 def make_disappear(objnames, frame):
+    group = tl.find_group(objnames)
+    if group is not None:
+        tl.step(tl.scene(), tl.group_path(group), frame, False, True)
+        return
     for name in objnames:
-        obj = bpy.data.objects[name]
+        obj = tl.object(name)
         # Render and show object through previous frame
-        obj.hide_render = False
-        obj.keyframe_insert(data_path='hide_render', frame=frame-1)
-        obj.hide = False
-        obj.keyframe_insert(data_path='hide', frame=frame-1)
         # Don't render object or show in 3D view starting at frame
-        obj.hide_render = True
-        obj.keyframe_insert(data_path='hide_render', frame=frame)
-        obj.hide = True
-        obj.keyframe_insert(data_path='hide', frame=frame)
-
-def camera_shake(camera, start_frame, num_frames, max_disp):
+        tl.step(obj, 'hide_render', frame, False, True)
+        tl.step(obj, 'hide', frame, False, True)
+
+@profiler.profiled('helpers')
+def flash_orbs(flashes):
+    # Key orb flash envelopes from effects.flash_envelopes, given as emission
+    if instanced_orbs:
+        colors = orb_colors(numorb, seed=0)
+    for orb, (frames, values) in flashes.items():
+        if instanced_orbs:
+            # Brighten the orb's own color by the emission instead, at every level of detail
+            for name in ['Orb' + str(orb)] + [lod_prefix('Orb', level) + str(orb) for level in range(1, numlod)]:
+                orb_obj = tl.object(name)
+                for i in range(3):
+                    tl.keys(orb_obj, 'color', frames, colors[orb-1][i] * (1 + values), index=i)
+        else:
+            tl.keys(tl.material('OrbMat' + str(orb)), 'emit', frames, values)
+
+def flash_targets():
+    # What flash_orbs keys
+    if instanced_orbs:
+        return [tl.object(name) for name in orb_names]
+    return [tl.material('OrbMat' + str(orb)) for orb in range(1, numorb+1)]
+
+@profiler.profiled('helpers')
+def camera_shake(camera, onsets, num_frames, max_disp, seed=0):
+    # Shake the camera's rotation around its current value for num_frames frames after every onset frame
+    # Shakes from close onsets add up instead of overwriting each other
+    frames, disp = shake_signal(onsets, num_frames, max_disp, seed=seed)
     cur_rot = camera.rotation_euler.copy()
-    camera.keyframe_insert(data_path='rotation_euler', frame=start_frame)
-    random.seed(0)
-    for i in range(1, num_frames):
-        x_disp = random.uniform(-max_disp, max_disp)
-        y_disp = random.uniform(-max_disp, max_disp)
-        z_disp = random.uniform(-max_disp, max_disp)
-        camera.rotation_euler = (cur_rot.x + x_disp, cur_rot.y + y_disp, cur_rot.z + z_disp)
-        camera.keyframe_insert(data_path='rotation_euler', frame=start_frame+i)
-        
-    camera.rotation_euler = cur_rot
-    camera.keyframe_insert(data_path='rotation_euler', frame=start_frame+num_frames)
+    for i in range(3):
+        tl.keys(camera, 'rotation_euler', frames, cur_rot[i] + disp[:, i], index=i)
+
+@profiler.profiled('helpers')
+def tunnel_rings(torus, start, end, behind=2*ring_spacing):
+    # Ring k of the tunnel sits ring_spacing*k behind the torus, on ring object (k-1) % numpool + 1
+    # Once ring k is behind past the camera (at the origin) its object jumps ahead to become ring k + numpool,
+    # with that ring's color, so numpool objects show the whole tunnel
+    colors = torus_colors(numtor)
+    frames = np.arange(int(np.ceil(start)), int(end) + 1)
+    torus_z = tl.evaluate(torus, 'location', frames, index=2)
+    for i in range(1, numpool+1):
+        # The ring object and its lower levels of detail all move together
+        rings = [tl.object(name) for name in ['Torus' + str(i)] +
+                 [lod_prefix('Torus', level) + str(i) for level in range(1, numlod)]]
+        frame = start
+        for k in range(i, numtor+1, numpool):
+            if k > numpool:
+                passed = np.flatnonzero(torus_z - ring_spacing*(k - numpool) > behind)
+                if not len(passed):
+                    break
+                frame = frames[passed[0]]
+            for ring in rings:
+                ring.location = (0, 0, -ring_spacing*k)
+                tl.insert(ring, 'location', frame, interpolation='CONSTANT')
+                if instanced_orbs:
+                    ring.color = colors[k-1] + (1.,)
+                    tl.insert(ring, 'color', frame, interpolation='CONSTANT')
+            if not instanced_orbs:
+                material = tl.material('TorMat' + str(i))
+                material.diffuse_color = colors[k-1]
+                tl.insert(material, 'diffuse_color', frame, interpolation='CONSTANT')
+
+@profiler.profiled('helpers')
+def cull(prefixes, count, frames, camera_positions, camera_rotations, centers, radius, frustum):
+    # Hide objects from rendering on frames their bounding spheres are out of the camera's view (with frustum),
+    # and at every level of detail but the one for their distance from the camera
+    # Objects prefix1 - prefix[count] of all prefixes share centers, so the lod_property of the first prefix's
+    # object i covers all levels of them (see Timeline.lod); only group members follow it
+    keys = cull_keys(frames, camera_positions, camera_rotations, centers, radius + config.getfloat('cull', 'margin'),
+                     config.getfloat('cull', 'fov') if frustum else None, config.getfloat('cull', 'aspect'),
+                     config.getint('cull', 'margin_frames'), lod_distances, config.getfloat('lod', 'hysteresis'))
+    for i, object_keys in enumerate(keys, 1):
+        levels = [[(lod_prefix(prefix, level) if level else prefix) + str(i) for prefix in prefixes]
+                  for level in range(numlod)]
+        tl.lod(levels[0][0], levels)
+        if object_keys is not None:
+            tl.keys(tl.object(levels[0][0]), '["' + lod_property + '"]', object_keys[0], object_keys[1],
+                    interpolation='CONSTANT')
 
 ### Animation timeline, in bars
 
@@ -184,146 +236,142 @@ act4_end = 109
 
 ### Animation keyframes
 
-# Deselect everything
-for obj in bpy.data.objects:
-    obj.select = False
+# Keyframes are authored on the timeline and compiled into F-curves at the end
+# Sections group the keyframes of each part of the piece, so only the parts that changed are rewritten
+tl = Timeline()
 
 # Shared object references and name lists
-spin = bpy.data.objects['spin']
-camera = bpy.data.objects['Camera']
-eye = bpy.data.objects['eye.brown']
-blue_sun = bpy.data.lamps['world_sun']
-hemi = bpy.data.lamps['Hemi']
-under_light = bpy.data.lamps['Point.001']
-orb_names = ['Orb' + str(i) for i in range(1, numorb+1)]
-glass_names = ['Glass' + str(i) for i in range(1, numorb+1)]
-torus_names = ['Torus' + str(i) for i in range(1, numtor+1)]
+spin = tl.object('spin')
+camera = tl.object('Camera')
+eye = tl.object('eye.brown')
+blue_sun = tl.lamp('world_sun')
+hemi = tl.lamp('Hemi')
+under_light = tl.lamp('Point.001')
+# Every level of detail, they only differ in what is rendered
+orb_names = lod_names('Orb', numorb, numlod)
+glass_names = lod_names('Glass', numorb, numlod)
+torus_names = lod_names('Torus', numpool, numlod)
 wall_names = ['floor', 'west_wall', 'east_wall', 'south_wall', 'north_wall']
 light_names = ['Hemi', 'Point', 'Point.001', 'redhemi']
-
+# Groups share one visibility channel instead of hide F-curves on every member
+tl.group('orbs', orb_names)
+tl.group('glass', glass_names)
+tl.group('tori', torus_names)
+tl.group('walls', wall_names)
+tl.group('lights', light_names)
+
+tl.section('act1_start')
 # Initialize rotation and position of camera at start of act 1
 spin.rotation_euler = (0, 0, pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_start))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_start))
 spin.location = (0, 0, 0)
-spin.keyframe_insert(data_path='location', frame=bar_to_frame(act1_start))
+tl.insert(spin, 'location', bar_to_frame(act1_start))
 # Spin center should not move until act 2 snare
 # TODO: define all intervals like this
-spin.keyframe_insert(data_path='location', frame=bar_to_frame(act2_snare))
+tl.insert(spin, 'location', bar_to_frame(act2_snare))
 camera.rotation_euler = (pi/2, 0, pi)
-camera.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_start))
+tl.insert(camera, 'rotation_euler', bar_to_frame(act1_start))
 camera.location = (0, 75, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act1_start))
+tl.insert(camera, 'location', bar_to_frame(act1_start))
 
 # Initialize eye rotation
 eye.rotation_euler = (0, 0, 0)
-eye.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_start))
+tl.insert(eye, 'rotation_euler', bar_to_frame(act1_start))
 
 # Initialize blue sun
 blue_sun.energy = 0.9
-blue_sun.keyframe_insert('energy', frame=bar_to_frame(act1_start))
+tl.insert(blue_sun, 'energy', bar_to_frame(act1_start))
 # Initialize hemi
 hemi.color = (1, 1, 1)
 
 # Revolve camera once until embellishment appears, then stop
 spin.rotation_euler = (0, 0, 3*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_embellish)-1)
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_embellish)-1)
 
+tl.section('act1_embellish')
 # Make orbs appear at start of act 1 embellishment
 make_appear(orb_names, bar_to_frame(act1_embellish))
 make_appear(glass_names, bar_to_frame(act1_embellish))
 
 # Make random orbs flash for a few frames at each embellishment note onset
-act1_embellish_onsets = note_onset_frames_from_file('C:\\Users\\Shamik\\Documents\\blender\\act1orbs.txt')
-random.seed(0)
-for onset in act1_embellish_onsets:
-    numflash = 10
-    for flash in range(1, numflash):
-        orb_mat = bpy.data.materials['OrbMat' + str(random.randint(1, numorb))]
-        # 0 emission through previous frame
-        orb_mat.emit = 0
-        orb_mat.keyframe_insert(data_path='emit', frame=bar_to_frame(act1_embellish)+onset-1)
-        # 1 emission at onset frame
-        orb_mat.emit = 2
-        orb_mat.keyframe_insert(data_path='emit', frame=bar_to_frame(act1_embellish)+onset)
-        # 0 emission 10 frames later
-        orb_mat.emit = 0
-        orb_mat.keyframe_insert(data_path='emit', frame=bar_to_frame(act1_embellish)+onset+10)
+act1_embellish_onsets = OnsetIndex.from_file(config.onset_path('act1orbs'), onset_filters['act1orbs'], tempo_map=tempo_map, start_bar=act1_embellish)
+# 9 orbs per onset, 0 emission through previous frame, 2 emission at onset frame, 0 emission 10 frames later
+# Flashes that overlap on the same orb merge into one envelope
+tl.protect(act1_embellish_onsets.frames, flash_targets())
+act1_flashes = flash_envelopes(act1_embellish_onsets.frames, numorb, 9, 0, 2, 10, seed=0)
+flash_orbs(act1_flashes)
 
 # Cut to a new, closer angle four bars after embellishment appears and spin twice in the next four bars
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act1_embellish+4)-1)
+tl.insert(camera, 'location', bar_to_frame(act1_embellish+4)-1)
 camera.location = (0, 50, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act1_embellish+4))
+tl.insert(camera, 'location', bar_to_frame(act1_embellish+4))
 spin.rotation_euler = (0, 0, pi/2)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_embellish+4))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_embellish+4))
 spin.rotation_euler = (0, 0, pi/2 + 4*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_drums)-1)
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_drums)-1)
 
+tl.section('act1_drums')
 # Make blue sun flash with kick drum
-act1_kick_onsets = note_onset_frames_from_file('C:\\Users\\Shamik\\Documents\\blender\\act1kick.txt', [36])
-sun = bpy.data.lamps['Sun']
-for onset in act1_kick_onsets:
-    # Energy is 0 through the previous frame
-    sun.energy = 0
-    sun.keyframe_insert(data_path='energy', frame=bar_to_frame(act1_drums)+onset-1)
-    # Energy is 0.3 at onset frame
-    sun.energy = 0.3
-    sun.keyframe_insert(data_path='energy', frame=bar_to_frame(act1_drums)+onset)
-    # Energy is 0 10 frames later
-    sun.energy = 0
-    sun.keyframe_insert(data_path='energy', frame=bar_to_frame(act1_drums)+onset+10)
+act1_kick_onsets = OnsetIndex.from_file(config.onset_path('act1kick'), onset_filters['act1kick'], tempo_map=tempo_map, start_bar=act1_drums)
+sun = tl.lamp('Sun')
+# The camera shakes to them too
+tl.protect(act1_kick_onsets.frames, [sun, camera])
+for frame in act1_kick_onsets:
+    # Energy is 0 through the previous frame, 0.3 at onset frame and 0 10 frames later
+    tl.pulse(sun, 'energy', frame, 0, 0.3, 10)
 
 # Cut to a new angle and spin slowly for 4 bars, a little further
 spin.rotation_euler = (0, 0, pi/2)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_drums))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_drums))
 spin.rotation_euler = (0, 0, pi/2 + 3*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_drums+4)-1)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act1_drums)-1)
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_drums+4)-1)
+tl.insert(camera, 'location', bar_to_frame(act1_drums)-1)
 camera.location = (0, 60, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act1_drums))
+tl.insert(camera, 'location', bar_to_frame(act1_drums))
 
 # Cut to a higher angle and spin a little faster for 4 bars
 spin.rotation_euler = (pi/4, 0, pi/2 + 3*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_drums+4))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_drums+4))
 spin.rotation_euler = (pi/4, 0, pi/2 + 8*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_drums+8)-1)
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_drums+8)-1)
 
 # Cut to a close, low angle still shot with camera shaking to kick for 2 bars
 spin.rotation_euler = (-pi/16, 0, 3*pi/2)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_drums+8))
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act1_drums+8)-1)
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_drums+8))
+tl.insert(camera, 'location', bar_to_frame(act1_drums+8)-1)
 camera.location = (0, 20, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act1_drums+8))
-for onset in act1_kick_onsets:
-    # Ignore earlier kicks and kicks after cut changes
-    if bar_to_frame(act1_drums) + onset >= bar_to_frame(act1_drums+8):
-        camera_shake(camera, bar_to_frame(act1_drums) + onset, 5, pi/360)
+tl.insert(camera, 'location', bar_to_frame(act1_drums+8))
+# Ignore earlier kicks and kicks after cut changes
+camera_shake(camera, act1_kick_onsets.in_bars(act1_drums+8), 5, pi/360)
 
 # Start spinning after 2 bars, for 6 bars
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_drums+10))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_drums+10))
 spin.rotation_euler = (-pi/16, 0, 3*pi/2 - 4*pi)
 
+tl.section('act1_out')
 # Cut to new, flat angle, rotating, moving inwards at end of act 1
 # start turning down blue spotlight and blue sun
 # TODO: any lights that are turned down without being initialized are not actually in use
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_out)-1)
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_out)-1)
 spin.rotation_euler = (0, 0, pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act1_out))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act1_out))
 spin.rotation_euler = (0, 0, 5*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_start)-5)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act1_out)-1) 
+tl.insert(spin, 'rotation_euler', bar_to_frame(act2_start)-5)
+tl.insert(camera, 'location', bar_to_frame(act1_out)-1)
 camera.location = (0, 50, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act1_out))    
+tl.insert(camera, 'location', bar_to_frame(act1_out))
 camera.location = (0, 5, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act2_start))
-blue_spot = bpy.data.lamps['blue_spot']
+tl.insert(camera, 'location', bar_to_frame(act2_start))
+blue_spot = tl.lamp('blue_spot')
 blue_spot.energy = 1
-blue_spot.keyframe_insert(data_path='energy', frame=bar_to_frame(act1_out))
+tl.insert(blue_spot, 'energy', bar_to_frame(act1_out))
 blue_spot.energy = 0
-blue_spot.keyframe_insert(data_path='energy', frame=bar_to_frame(act2_start))
-blue_sun.keyframe_insert(data_path = 'energy', frame=bar_to_frame(act1_out))
+tl.insert(blue_spot, 'energy', bar_to_frame(act2_start))
+tl.insert(blue_sun, 'energy', bar_to_frame(act1_out))
 blue_sun.energy = 0
-blue_sun.keyframe_insert(data_path = 'energy', frame=bar_to_frame(act2_start))
+tl.insert(blue_sun, 'energy', bar_to_frame(act2_start))
 
+tl.section('act2_start')
 # Make orbs disappear before act 2
 make_disappear(orb_names, bar_to_frame(act2_start) - 50)
 make_disappear(glass_names, bar_to_frame(act2_start) - 50)
@@ -341,113 +389,89 @@ make_appear(wall_names, bar_to_frame(act2_start)- 25)
 make_appear(['Spot'], bar_to_frame(act2_start))
 
 # Make spot light flash with bass swells
-swell_onsets = note_onset_frames_from_file('C:\\Users\\Shamik\\Documents\\blender\\swells.txt')
-red_spot = bpy.data.lamps['Spot']
-for onset in swell_onsets:
-    # 0 energy through previous frame
-    red_spot.energy = 0
-    red_spot.keyframe_insert(data_path='energy', frame=bar_to_frame(act2_start)+onset-1)
-    # .5 energy at onset
-    red_spot.energy = .5
-    red_spot.keyframe_insert(data_path='energy', frame=bar_to_frame(act2_start)+onset)
-    # 0 energy 20 frames later
-    red_spot.energy = 0
-    red_spot.keyframe_insert(data_path='energy', frame=bar_to_frame(act2_start)+onset+20)
+swell_onsets = OnsetIndex.from_file(config.onset_path('swells'), onset_filters['swells'], tempo_map=tempo_map, start_bar=act2_start)
+red_spot = tl.lamp('Spot')
+tl.protect(swell_onsets.frames, [red_spot])
+for frame in swell_onsets:
+    # 0 energy through previous frame, .5 energy at onset, 0 energy 20 frames later
+    tl.pulse(red_spot, 'energy', frame, 0, .5, 20)
 
 # Cut to over the shoulder angle between first and second swells
-spin.keyframe_insert(data_path='rotation_euler', frame=2125)
+tl.insert(spin, 'rotation_euler', 2125)
 spin.rotation_euler = (0.331613, 0, 1.256637)
-spin.keyframe_insert(data_path='rotation_euler', frame=2126)
+tl.insert(spin, 'rotation_euler', 2126)
 
 # Cut to under shot between second and third swells
-spin.keyframe_insert(data_path='rotation_euler', frame=2204)
+tl.insert(spin, 'rotation_euler', 2204)
 spin.rotation_euler = (-0.593412, 0, 2.757620)
-spin.keyframe_insert(data_path='rotation_euler', frame=2205)
-camera.keyframe_insert(data_path='location', frame=2204)
+tl.insert(spin, 'rotation_euler', 2205)
+tl.insert(camera, 'location', 2204)
 camera.location = (0, 4, 0)
-camera.keyframe_insert(data_path='location', frame=2205)
+tl.insert(camera, 'location', 2205)
 
 # Cut to askew close up between third and fourth swells
-spin.keyframe_insert(data_path='rotation_euler', frame=2280)
+tl.insert(spin, 'rotation_euler', 2280)
 spin.rotation_euler = (0, 0, pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=2281)
-camera.keyframe_insert(data_path='location', frame=2280)
+tl.insert(spin, 'rotation_euler', 2281)
+tl.insert(camera, 'location', 2280)
 camera.location = (0, 3.5, 0)
-camera.keyframe_insert(data_path='location', frame=2281)
-camera.keyframe_insert(data_path='rotation_euler', frame=2280)
+tl.insert(camera, 'location', 2281)
+tl.insert(camera, 'rotation_euler', 2280)
 camera.rotation_euler = (pi/2, -0.349066, pi)
-camera.keyframe_insert(data_path='rotation_euler', frame=2281)
+tl.insert(camera, 'rotation_euler', 2281)
 
+tl.section('act2_bass')
 # Make lights appear at start of act 2 bass
 make_appear(light_names, bar_to_frame(act2_bass))
 
 # Make red hemi flash with bass
-bass_onsets = note_onset_frames_from_file('C:\\Users\\Shamik\\Documents\\blender\\act2bass.txt')
-red_hemi = bpy.data.lamps['redhemi']
-for onset in bass_onsets:
-    # 0 energy through previous frame
-    red_hemi.energy = 0
-    red_hemi.keyframe_insert(data_path='energy', frame=bar_to_frame(act2_bass)+onset-1)
-    # .5 energy at onset
-    red_hemi.energy = .5
-    red_hemi.keyframe_insert(data_path='energy', frame=bar_to_frame(act2_bass)+onset)
-    # 0 energy 3 frames later
-    red_hemi.energy = 0
-    red_hemi.keyframe_insert(data_path='energy', frame=bar_to_frame(act2_bass)+onset+3)
+bass_onsets = OnsetIndex.from_file(config.onset_path('act2bass'), onset_filters['act2bass'], tempo_map=tempo_map, start_bar=act2_bass)
+red_hemi = tl.lamp('redhemi')
+tl.protect(bass_onsets.frames, [red_hemi])
+for frame in bass_onsets:
+    # 0 energy through previous frame, .5 energy at onset, 0 energy 3 frames later
+    tl.pulse(red_hemi, 'energy', frame, 0, .5, 3)
 
 # Make camera tilt back to level and zoom out soon after bass enters
-camera.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_bass)+25)
+tl.insert(camera, 'rotation_euler', bar_to_frame(act2_bass)+25)
 camera.rotation_euler = (pi/2, 0, pi)
-camera.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_bass)+50)
+tl.insert(camera, 'rotation_euler', bar_to_frame(act2_bass)+50)
 # Camera does not rotate again until act 3
-camera.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act3_start)+25)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act2_bass)+50)
+tl.insert(camera, 'rotation_euler', bar_to_frame(act3_start)+25)
+tl.insert(camera, 'location', bar_to_frame(act2_bass)+50)
 camera.location = (0, 15, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act2_drums))
+tl.insert(camera, 'location', bar_to_frame(act2_drums))
 # Camera does not zoom again until act 3
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act3_start))
+tl.insert(camera, 'location', bar_to_frame(act3_start))
 
 # Insert close up frame on eyeball
+@profiler.profiled('helpers')
 def flash_cut(frame):
-    # TODO: is this frame / property restoration necessary? I'll comment it for now
-    # Save scene camera position and current frame
-    #cur_frame = bpy.context.scene.frame_current
-    #spin_loc = spin.location
-    #spin_rot = spin.rotation_euler
-    #cam_loc = camera.location
-    # Add keyframes in previous and next frames
-    bpy.context.scene.frame_set(frame - 1)
-    spin.keyframe_insert(data_path='location', frame=frame-1)
-    spin.keyframe_insert(data_path='rotation_euler', frame=frame-1)
-    camera.keyframe_insert(data_path='location', frame=frame-1)
-    bpy.context.scene.frame_set(frame + 1)
-    spin.keyframe_insert(data_path='location', frame=frame+1)
-    spin.keyframe_insert(data_path='rotation_euler', frame=frame+1)
-    camera.keyframe_insert(data_path='location', frame=frame+1)
+    tl.protect(frame, [spin, camera])
+    # Hold the current shot in the previous and next frames; a hold on a frame already keyed, e.g. by
+    # a cut two frames earlier, keeps that key (bench/check_holds.py checks this against keyframe_insert)
+    tl.hold(spin, 'location', frame-1)
+    tl.hold(spin, 'rotation_euler', frame-1)
+    tl.hold(camera, 'location', frame-1)
+    tl.hold(spin, 'location', frame+1)
+    tl.hold(spin, 'rotation_euler', frame+1)
+    tl.hold(camera, 'location', frame+1)
     # Add close up at frame
-    bpy.context.scene.frame_set(frame)
     spin.location = (0, 0, 0)
     spin.rotation_euler = (0, 0, pi)
     camera.location = (0, 5, 0)
-    spin.keyframe_insert(data_path='location', frame=frame)
-    spin.keyframe_insert(data_path='rotation_euler', frame=frame)
-    camera.keyframe_insert(data_path='location', frame=frame)
-    # Restore scene camera position and frame
-    #spin.location = spin_loc
-    #spin.rotation_euler = spin_rot
-    #camera.location = cam_loc
-    #bpy.context.scene.frame_set(cur_frame)
+    tl.insert(spin, 'location', frame)
+    tl.insert(spin, 'rotation_euler', frame)
+    tl.insert(camera, 'location', frame)
     
 
+tl.section('act2_drums')
 # Make camera spin 3 rotations until snare enters
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_drums))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act2_drums))
 spin.rotation_euler = (0, 0, 7*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_snare))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act2_snare))
 
-for fcu in spin.animation_data.action.fcurves:
-    if fcu.data_path == 'rotation_euler':
-        for kp in fcu.keyframe_points:
-            kp.interpolation = 'LINEAR'
+tl.set_interpolation(spin, 'rotation_euler', 'LINEAR')
 
 # Add flash cuts
 flash_cut(bar_to_frame(act2_bass)+250)
@@ -457,16 +481,18 @@ flash_cut(bar_to_frame(act2_bass)+300)
 make_appear(['Spike'], bar_to_frame(act2_drums))
 
 # Make spike threaten eyeball with kick
-spike = bpy.data.objects['Spike']
+spike = tl.object('Spike')
 spike.location.z = -14
-act2_kick_onsets = note_onset_frames_from_file('C:\\Users\\Shamik\\Documents\\blender\\act2kick.txt', [38])
-for onset in act2_kick_onsets:
-    spike.keyframe_insert(data_path='location', frame=bar_to_frame(act2_drums)+onset-1)
+act2_kick_onsets = OnsetIndex.from_file(config.onset_path('act2kick'), onset_filters['act2kick'], tempo_map=tempo_map, start_bar=act2_drums)
+tl.protect(act2_kick_onsets.frames, [spike])
+for frame in act2_kick_onsets:
+    tl.insert(spike, 'location', frame-1)
     spike.location.z = -7
-    spike.keyframe_insert(data_path='location', frame=bar_to_frame(act2_drums)+onset)
+    tl.insert(spike, 'location', frame)
     spike.location.z = -14
-    spike.keyframe_insert(data_path='location', frame=bar_to_frame(act2_drums)+onset+5)
+    tl.insert(spike, 'location', frame+5)
 
+tl.section('act2_snare')
 # Make drumsticks appear at start of act 2 snare
 make_appear(['stick', 'stick2'], bar_to_frame(act2_snare))
 
@@ -474,69 +500,71 @@ make_appear(['stick', 'stick2'], bar_to_frame(act2_snare))
 make_disappear(['Spike'], bar_to_frame(act2_snare))
 
 # Make drumsticks strike alternately to snare beat
-sticks = [bpy.data.objects['stick'], bpy.data.objects['stick2']]
+sticks = [tl.object('stick'), tl.object('stick2')]
 sticks[0].rotation_euler = (pi/2, 0, 0)
 sticks[1].rotation_euler = (pi/2, 0, 0)
-snare_onsets = note_onset_frames_from_file('C:\\Users\\Shamik\\Documents\\blender\\act2snare.txt', [42])
+snare_onsets = OnsetIndex.from_file(config.onset_path('act2snare'), onset_filters['act2snare'], tempo_map=tempo_map, start_bar=act2_snare)
+tl.protect(snare_onsets.frames, sticks)
 which_stick = 0
-snare_count = 0
-for onset in snare_onsets:
+for snare_count, frame in enumerate(snare_onsets):
     # 2 frame attack and release to each 90 degree rotational strike
     #sticks[which_stick].rotation_euler = (pi/2, 0, 0)
-    sticks[which_stick].keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_snare)+onset-2)
+    tl.insert(sticks[which_stick], 'rotation_euler', frame-2)
     sticks[which_stick].rotation_euler = (0, 0, 0)
-    sticks[which_stick].keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_snare)+onset)
-    if snare_count < len(snare_onsets) - 1 and snare_onsets[snare_count+1] - snare_onsets[snare_count] < 5:
+    tl.insert(sticks[which_stick], 'rotation_euler', frame)
+    # Half strikes when the next hit comes quickly
+    if snare_onsets.next_intervals[snare_count] < 5:
         angle = pi/4
     else:
         angle = pi/2
-    snare_count += 1
     sticks[which_stick].rotation_euler = (angle, 0, 0)
-    sticks[which_stick].keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_snare)+onset+2)
+    tl.insert(sticks[which_stick], 'rotation_euler', frame+2)
     # Toggle between 0 and 1
     which_stick = (which_stick + 1) % 2
 
 # Spin around sticks 2 times until arpeggiation comes in
 spin.location = (-4.22, 3.3, 0)
-spin.keyframe_insert(data_path='location', frame=bar_to_frame(act2_snare)+1)
-spin.keyframe_insert(data_path='location', frame=bar_to_frame(act2_embellish-1))
+tl.insert(spin, 'location', bar_to_frame(act2_snare)+1)
+tl.insert(spin, 'location', bar_to_frame(act2_embellish-1))
 spin.rotation_euler = (0, 0, pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_snare)+1)
+tl.insert(spin, 'rotation_euler', bar_to_frame(act2_snare)+1)
 spin.rotation_euler = (0, 0, -3*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_embellish)-1)
+tl.insert(spin, 'rotation_euler', bar_to_frame(act2_embellish)-1)
 
 # Add flash cut
 flash_cut(bar_to_frame(act2_snare)+100)
 
+tl.section('act2_embellish')
 # Make spike reappear with embellishment
 make_appear(['Spike'], bar_to_frame(act2_embellish))
 # Make melody ring appear with embellishment
 make_appear(['MelodyRing'], bar_to_frame(act2_embellish))
 
 # Make melody ring rise and fall with embellishment melody
-melody_ring = bpy.data.objects['MelodyRing']
-act2_embellish_onsets = note_onsets_from_file('C:\\Users\\Shamik\\Documents\\blender\\act2embellish.txt')
-for (onset, note) in act2_embellish_onsets:
-    melody_ring.keyframe_insert(data_path='location', frame=bar_to_frame(act2_embellish)+onset-1)
+melody_ring = tl.object('MelodyRing')
+act2_embellish_onsets = OnsetIndex.from_file(config.onset_path('act2embellish'), onset_filters['act2embellish'], tempo_map=tempo_map, start_bar=act2_embellish)
+tl.protect(act2_embellish_onsets.frames, [melody_ring])
+for frame, note in zip(act2_embellish_onsets.frames, act2_embellish_onsets.notes):
+    tl.insert(melody_ring, 'location', frame-1)
     melody_ring.location.z = (note - 90) / 4.
-    melody_ring.keyframe_insert(data_path='location', frame=bar_to_frame(act2_embellish)+onset)
+    tl.insert(melody_ring, 'location', frame)
     
 # Make melody ring float up and then disappear
 melody_ring.location.z = 10
-melody_ring.keyframe_insert(data_path='location', frame=bar_to_frame(act3_start))
+tl.insert(melody_ring, 'location', bar_to_frame(act3_start))
 make_disappear(['MelodyRing'], bar_to_frame(act3_start))
 
 # Spin less than twice around center point between eye and sticks
 spin.location = (-2.25, 2.18, 0)
-spin.keyframe_insert(data_path='location', frame=bar_to_frame(act2_embellish))
+tl.insert(spin, 'location', bar_to_frame(act2_embellish))
 spin.rotation_euler = (0, 0, pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act2_embellish))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act2_embellish))
 spin.rotation_euler = (0, 0, 7.033677+2*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act3_start))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act3_start))
 # Camera center doesn't move again until act 3 starts
-spin.keyframe_insert(data_path='location', frame=bar_to_frame(act3_start))
+tl.insert(spin, 'location', bar_to_frame(act3_start))
 # Camera doesn't spin again until after act 3 starts
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act3_start+4))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act3_start+4))
 
 # Add a bunch of flash cuts
 flash_cut(bar_to_frame(act2_embellish)+5)
@@ -545,6 +573,7 @@ flash_cut(bar_to_frame(act2_embellish)+9)
 flash_cut(bar_to_frame(act2_embellish)+11)
 flash_cut(bar_to_frame(act2_embellish)+13)
 
+tl.section('act3_start')
 # Make spike disappear
 make_disappear(['Spike'], bar_to_frame(act3_start))
 
@@ -552,108 +581,160 @@ make_disappear(['Spike'], bar_to_frame(act3_start))
 make_disappear(['stick', 'stick2'], bar_to_frame(act3_start))
 
 # Make under light change color
-hemi.keyframe_insert(data_path='color', frame=bar_to_frame(act3_start-1))
+tl.insert(hemi, 'color', bar_to_frame(act3_start-1))
 hemi.color = (.25, 1, .25)
-hemi.keyframe_insert(data_path='color', frame=bar_to_frame(act3_start))
+tl.insert(hemi, 'color', bar_to_frame(act3_start))
 
 # Make ring tunnel appear and fly past camera
 make_appear(torus_names, bar_to_frame(act3_start))
-torus = bpy.data.objects['Torus']
+torus = tl.object('Torus')
 torus.location = (0, 0, -100)
-torus.keyframe_insert(data_path='location', frame=bar_to_frame(act3_start))
+tl.insert(torus, 'location', bar_to_frame(act3_start))
 torus.location = (0, 0, 1000)
-torus.keyframe_insert(data_path='location', frame=bar_to_frame(act3_return))
+tl.insert(torus, 'location', bar_to_frame(act3_return))
+tunnel_rings(torus, bar_to_frame(act3_start), bar_to_frame(act3_return))
 
 # Make eyeball spin
-eye.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act3_start))
+tl.insert(eye, 'rotation_euler', bar_to_frame(act3_start))
 eye.rotation_euler = (0, 0, 20*pi)
-eye.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act3_return))
+tl.insert(eye, 'rotation_euler', bar_to_frame(act3_return))
 
 # Zoom camera in and recenter
 spin.location = (0, 0, 0)
-spin.keyframe_insert(data_path='location', frame=bar_to_frame(act3_start+4))
+tl.insert(spin, 'location', bar_to_frame(act3_start+4))
 # Camera center doesn't move again
-spin.keyframe_insert(data_path='location', frame=bar_to_frame(act4_end))
+tl.insert(spin, 'location', bar_to_frame(act4_end))
 camera.location = (0, 3, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act3_start+4))
+tl.insert(camera, 'location', bar_to_frame(act3_start+4))
 
 # Spin vertically around eyeball
 spin.rotation_euler = (4*pi, 0, 7.033677+2*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act3_return))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act3_return))
 
 # Zoom camera out a little
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act3_start+5))
+tl.insert(camera, 'location', bar_to_frame(act3_start+5))
 camera.location = (0, 6, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act3_start+7))
+tl.insert(camera, 'location', bar_to_frame(act3_start+7))
 # Camera doesn't move again until return from act 3
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act3_return))
+tl.insert(camera, 'location', bar_to_frame(act3_return))
 
 # Flash cut on hits
-act3_hits = note_onset_frames_from_file('C:\\Users\\Shamik\\Documents\\blender\\act3drums.txt', [40])
-for onset in act3_hits:
+act3_hits = OnsetIndex.from_file(config.onset_path('act3drums'), onset_filters['act3drums'], tempo_map=tempo_map, start_bar=act3_theme - .25)
+for frame in act3_hits:
     # TODO: onsets are a beat forward
-    flash_cut(bar_to_frame(act3_theme - .25) + onset)
+    flash_cut(frame)
 
+tl.section('act3_return')
 # Make walls disappear
 make_disappear(wall_names, bar_to_frame(act3_return))
 # Make drumsticks disappear
 make_disappear(['stick', 'stick2'], bar_to_frame(act3_return))
 # Make lights fade then disappear
-hemi.keyframe_insert(data_path='energy', frame=bar_to_frame(act3_return-1))
+tl.insert(hemi, 'energy', bar_to_frame(act3_return-1))
 hemi.energy = 0
-hemi.keyframe_insert(data_path='energy', frame=bar_to_frame(act3_return))
-under_light.keyframe_insert(data_path='energy', frame=bar_to_frame(act3_return-1))
+tl.insert(hemi, 'energy', bar_to_frame(act3_return))
+tl.insert(under_light, 'energy', bar_to_frame(act3_return-1))
 under_light.energy = 0
-under_light.keyframe_insert(data_path='energy', frame=bar_to_frame(act3_return))
+tl.insert(under_light, 'energy', bar_to_frame(act3_return))
 make_disappear(light_names, bar_to_frame(act3_return))
 # Make wood floor reappear
 make_appear(['world_floor'], bar_to_frame(act3_return))
 # Make blue sun reappear
-blue_sun.keyframe_insert(data_path = 'energy', frame=bar_to_frame(act3_return))
+tl.insert(blue_sun, 'energy', bar_to_frame(act3_return))
 blue_sun.energy = 0.9
-blue_sun.keyframe_insert(data_path = 'energy', frame=bar_to_frame(act3_end))
+tl.insert(blue_sun, 'energy', bar_to_frame(act3_end))
 
 # Make ring tunnel disappear after exiting
-tor_names = ['Torus' + str(i) for i in range(1, numtor+1)]
-make_disappear(tor_names, bar_to_frame(act3_return))
+make_disappear(torus_names, bar_to_frame(act3_return))
 
 # Make orbs reappear for last act
 make_appear(orb_names, bar_to_frame(act3_return))
 make_appear(glass_names, bar_to_frame(act3_return))
 
+tl.section('act4')
 # Make random orbs flash for a few frames at each embellishment note onset
-act4_embellish_onsets = note_onset_frames_from_file('C:\\Users\\Shamik\\Documents\\blender\\act4orbs.txt')
-random.seed(0)
-for onset in act4_embellish_onsets:
-    numflash = 10
-    for flash in range(1, numflash):
-        orb_mat = bpy.data.materials['OrbMat' + str(random.randint(1, numorb))]
-        # 0 emission through previous frame
-        orb_mat.emit = 0
-        orb_mat.keyframe_insert(data_path='emit', frame=bar_to_frame(act3_end)+onset-1)
-        # 1 emission at onset frame
-        orb_mat.emit = 2
-        orb_mat.keyframe_insert(data_path='emit', frame=bar_to_frame(act3_end)+onset)
-        # 0 emission 10 frames later
-        orb_mat.emit = 0
-        orb_mat.keyframe_insert(data_path='emit', frame=bar_to_frame(act3_end)+onset+10)
+act4_embellish_onsets = OnsetIndex.from_file(config.onset_path('act4orbs'), onset_filters['act4orbs'], tempo_map=tempo_map, start_bar=act3_end)
+# 9 orbs per onset, 0 emission through previous frame, 2 emission at onset frame, 0 emission 10 frames later
+# Flashes that overlap on the same orb merge into one envelope
+tl.protect(act4_embellish_onsets.frames, flash_targets())
+act4_flashes = flash_envelopes(act4_embellish_onsets.frames, numorb, 9, 0, 2, 10, seed=0)
+flash_orbs(act4_flashes)
 
 # Go back to eyeball
 camera.location = (0, 15, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act3_return)+75)
+tl.insert(camera, 'location', bar_to_frame(act3_return)+75)
 
 # Spin away into distance, 3 times
 camera.location = (0, 98, 0)
-camera.keyframe_insert(data_path='location', frame=bar_to_frame(act4_end))
+tl.insert(camera, 'location', bar_to_frame(act4_end))
 spin.rotation_euler = (4*pi, 0, 7.033677+6*pi)
-spin.keyframe_insert(data_path='rotation_euler', frame=bar_to_frame(act4_end))
+tl.insert(spin, 'rotation_euler', bar_to_frame(act4_end))
 
 # Fade out blue sun
-blue_sun.keyframe_insert(data_path = 'energy', frame=bar_to_frame(act4_fade))
+tl.insert(blue_sun, 'energy', bar_to_frame(act4_fade))
 blue_sun.energy = 0
-blue_sun.keyframe_insert(data_path = 'energy', frame=bar_to_frame(act4_fade+2))
-
-# TODO: constants frame values in keyframe_insert calls should be dependent on frame rate
+tl.insert(blue_sun, 'energy', bar_to_frame(act4_fade+2))
+
+tl.section('culling')
+cull_groups = config.get('cull', 'groups').split() if config.getboolean('cull', 'enabled') else []
+if cull_groups or numlod > 1:
+    cull_frames = np.arange(bar_to_frame(act1_start), bar_to_frame(act4_end) + 1)
+    # Camera is a child of spin, its tracking constraint only turns it towards spin, which it already faces
+    spin_rotations = euler_matrices(property_values(tl, spin, 'rotation_euler', cull_frames))
+    camera_positions = property_values(tl, spin, 'location', cull_frames) + np.einsum(
+        'fij,fj->fi', spin_rotations, property_values(tl, camera, 'location', cull_frames))
+    camera_rotations = np.matmul(spin_rotations,
+                                 euler_matrices(property_values(tl, camera, 'rotation_euler', cull_frames)))
+    if 'orbs' in cull_groups or 'glass' in cull_groups or numlod > 1:
+        # Orbs never move from where orbs.py put them; outside Blender, lay them out again the same way
+        if bpy is not None:
+            orb_positions = np.array([tuple(bpy.data.objects['Orb' + str(i)].location) for i in range(1, numorb+1)])
+        else:
+            orb_positions = np.array(orb_layout(numorb, config.getfloat('scene', 'orb_separation'), seed=0)[0])
+        orb_radius = config.getfloat('cull', 'orb_radius')
+        # Orbs and their glass share a state unless only one of them is culled
+        for frustum in (True, False):
+            prefixes = [prefix for prefix, group in (('Orb', 'orbs'), ('Glass', 'glass'))
+                        if (group in cull_groups) == frustum]
+            if prefixes and (frustum or numlod > 1):
+                cull(prefixes, numorb, cull_frames, camera_positions, camera_rotations, orb_positions, orb_radius,
+                     frustum)
+    if 'tori' in cull_groups or numlod > 1:
+        # Rings move with the unrotated Torus, ignoring its scale
+        torus_positions = property_values(tl, torus, 'location', cull_frames)
+        ring_positions = np.stack([torus_positions + property_values(tl, tl.object('Torus' + str(i)), 'location',
+                                                                     cull_frames) for i in range(1, numpool+1)], axis=1)
+        cull(['Torus'], numpool, cull_frames, camera_positions, camera_rotations, ring_positions,
+             config.getfloat('cull', 'torus_radius'), 'tori' in cull_groups)
+
+# Write the timeline into the scene, or just check it when run outside Blender
+profiler.end_section()
+print(tl.summary())
+compiled = tl.compile()
+if config.getboolean('reduce', 'enabled'):
+    # Drop keys that don't change the curves, never on the onset or cut frames a target follows
+    compiled = reduce_keys(compiled, tl.protected, config.getfloat('reduce', 'tolerance'),
+                           config.getfloat('reduce', 'simplify'))
+    print('Reduced to', sum(len(keys.frames) for keys in compiled.values()), 'keyframes')
+if config.get('export', 'compiled'):
+    # For load_animation.py, which writes it into a scene without running any of the above
+    save_compiled(config.path('export', 'compiled'), compiled, tl.groups, tl.lods)
+if bpy is not None:
+    from keyframes import apply_groups, apply_timeline
+    # Deselect everything
+    for obj in bpy.data.objects:
+        obj.select = False
+    apply_groups(tl.groups, tl.lods)
+    apply_timeline(compiled)
+else:
+    for channel, frame, old, new in tl.conflicts:
+        print('Conflicting keyframes on', channel, 'at frame', frame, ':', old, 'replaced by', new)
+
+if profile_trace:
+    print(profiler.report())
+    profiler.write_trace(config.path('profile', 'trace'))
+
+# TODO: constants frame values in tl.insert calls should be dependent on frame rate
 #       this also applies to calls to make_appear, make_disappear, flash_cut
 # TODO: make adjacent keyframes consistent: -1 and 0 or 0 and +1?
 #       probably should make intervals end at -1 and start at 0
@@ -666,4 +747,4 @@ blue_sun.keyframe_insert(data_path = 'energy', frame=bar_to_frame(act4_fade+2))
 # TODO: clarify light naming and other object naming, unify camelcase vs underscore
 # TODO: revisit lights that have been accidentally removed from scene by
 #       uninitialized animation
-# TODO: make rotations/positions relative instead of hardcoded?
\ No newline at end of file
+# TODO: make rotations/positions relative instead of hardcoded?
@@ -0,0 +1,167 @@
+# Onset detector for WAV audio
+#
+# Onsets are peaks of the spectral flux, the summed increase of the (log) magnitude spectrum from one analysis
+# frame to the next. Samples are read through a memory map in fixed-size blocks and the STFT of each block is
+# computed at once, so a long stem is never fully in memory; only the flux (one value per hop) is kept
+
+import mmap
+import struct
+
+from collections import namedtuple
+
+import numpy as np
+
+# Sample format of the data chunk; frames is the number of sample frames (one sample per channel each)
+WavInfo = namedtuple('WavInfo', ['rate', 'channels', 'bits', 'is_float', 'offset', 'frames'])
+
+# Analysis window and hop, in samples
+window_size = 2048
+hop_size = 512
+# Sample frames read from the file at a time, a multiple of hop_size
+block_frames = hop_size * 256
+# Magnitudes are compressed with log(1 + compression * magnitude) before differencing
+compression = 100.
+# Peak picking on the flux, normalized to mean 0 and standard deviation 1: a peak is the largest value
+# within peak_window seconds on both sides and at least threshold above the mean within mean_window seconds
+threshold = 0.5
+peak_window = 0.03
+mean_window = 0.1
+# Peaks must also rise above the median of the raw flux by this many median absolute deviations, so the
+# flux of a stem's noise floor, which fluctuates by up to about 7 of them, never counts however quiet the stem
+# is; onsets barely louder than the noise are dropped with it (see bench/check_onsets.py)
+floor_deviations = 10.
+# Onsets closer than this many seconds to the previous one are dropped
+min_gap = 0.05
+
+# WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT and WAVE_FORMAT_EXTENSIBLE
+format_pcm = 1
+format_float = 3
+format_extensible = 0xfffe
+
+def read_wav_info(mm):
+    # Sample format and position of the samples in a RIFF WAVE file
+    if mm[:4] != b'RIFF' or mm[8:12] != b'WAVE':
+        raise ValueError('not a RIFF WAVE file')
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(mm):
+        chunk_id = mm[pos:pos+4]
+        size = struct.unpack('<I', mm[pos+4:pos+8])[0]
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', mm[pos+8:pos+24])
+            if fmt[0] == format_extensible:
+                # The real format is the first two bytes of the subformat GUID
+                fmt = (struct.unpack('<H', mm[pos+32:pos+34])[0],) + fmt[1:]
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('data chunk before fmt chunk')
+            audio_format, channels, rate, byte_rate, block_align, bits = fmt
+            if audio_format not in (format_pcm, format_float) or bits not in (8, 16, 24, 32, 64):
+                raise ValueError('unsupported sample format ' + str(audio_format) + ' with ' + str(bits) + ' bits')
+            # Some writers leave the size at 0 or too large when streaming
+            size = min(size, len(mm) - pos - 8) if size else len(mm) - pos - 8
+            return WavInfo(rate, channels, bits, audio_format == format_float, pos + 8, size // block_align)
+        # Chunks are padded to an even size
+        pos += 8 + size + (size & 1)
+    raise ValueError('no data chunk')
+
+def to_float(raw, info):
+    # Samples in [-1, 1) from the raw bytes of whole sample frames
+    if info.is_float:
+        return np.frombuffer(raw, dtype='<f4' if info.bits == 32 else '<f8').astype(np.float64)
+    if info.bits == 8:
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float64) - 128) / 128
+    if info.bits == 24:
+        # Little-endian 3-byte samples, sign extended through the top byte of an int32
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        return ((b[:, 0] << 8 | b[:, 1] << 16 | b[:, 2] << 24) >> 8) / float(1 << 23)
+    return np.frombuffer(raw, dtype='<i' + str(info.bits // 8)) / float(1 << (info.bits - 1))
+
+def sample_blocks(mm, info):
+    # Mono mixdown of the samples, block_frames sample frames at a time
+    frame_bytes = info.channels * info.bits // 8
+    for start in range(0, info.frames, block_frames):
+        count = min(block_frames, info.frames - start)
+        begin = info.offset + start * frame_bytes
+        yield to_float(mm[begin:begin + count * frame_bytes], info).reshape(count, info.channels).mean(axis=1)
+
+def spectral_flux(blocks):
+    # Flux and the strongest frequency bin of each analysis frame, for frames starting every hop_size samples
+    # Frame k is samples k * hop_size up to k * hop_size + window_size; the signal isn't padded, as the step from
+    # zeros to even a faint noise floor would be the largest flux of a quiet stem
+    window = np.hanning(window_size)
+    carry = np.zeros(0)
+    previous = None
+    flux = []
+    peaks = []
+    for block in blocks:
+        samples = np.concatenate((carry, block))
+        count = (len(samples) - window_size) // hop_size + 1
+        if count <= 0:
+            carry = samples
+            continue
+        frames = np.lib.stride_tricks.sliding_window_view(samples, window_size)[::hop_size][:count]
+        magnitudes = np.abs(np.fft.rfft(frames * window, axis=1))
+        peaks.append(np.argmax(magnitudes[:, 1:], axis=1) + 1)
+        magnitudes = np.log1p(compression * magnitudes)
+        if previous is None:
+            # The first frame has nothing to grow from, so its flux is 0
+            previous = magnitudes[0]
+        increase = np.diff(np.vstack((previous, magnitudes)), axis=0)
+        flux.append(np.maximum(increase, 0).sum(axis=1))
+        previous = magnitudes[-1]
+        carry = samples[count * hop_size:]
+    if not flux:
+        return np.zeros(0), np.zeros(0, dtype=np.int64)
+    return np.concatenate(flux), np.concatenate(peaks)
+
+def moving_mean(values, radius):
+    # Mean of values within radius positions on each side, fewer at the ends
+    sums = np.concatenate(([0.], np.cumsum(values)))
+    i = np.arange(len(values))
+    lo = np.maximum(i - radius, 0)
+    hi = np.minimum(i + radius + 1, len(values))
+    return (sums[hi] - sums[lo]) / (hi - lo)
+
+def pick_peaks(flux, rate):
+    # Indices of the onset peaks in the flux
+    if len(flux) == 0:
+        return np.zeros(0, dtype=np.int64)
+    median = np.median(flux)
+    above_floor = flux > median + floor_deviations * np.median(np.abs(flux - median))
+    std = flux.std()
+    flux = (flux - flux.mean()) / (std if std > 0 else 1.)
+    hops_per_second = rate / float(hop_size)
+    radius = max(int(round(peak_window * hops_per_second)), 1)
+    padded = np.concatenate((np.full(radius, -np.inf), flux, np.full(radius, -np.inf)))
+    local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1).max(axis=1)
+    mean = moving_mean(flux, max(int(round(mean_window * hops_per_second)), 1))
+    return np.flatnonzero((flux == local_max) & (flux >= mean + threshold) & above_floor)
+
+def spaced(seconds):
+    # Indices of the onsets kept when dropping any closer than min_gap to the previous kept one
+    kept = []
+    for i, second in enumerate(seconds):
+        if not kept or second - seconds[kept[-1]] >= min_gap:
+            kept.append(i)
+    return np.array(kept, dtype=np.int64)
+
+def detect_onsets(filename):
+    # Returns (seconds, notes) of the onsets in a WAV file: onset times from the start of the file and the
+    # MIDI note nearest to the strongest frequency at each, a rough pitch that is only meaningful for
+    # melodic stems
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        try:
+            info = read_wav_info(mm)
+        except ValueError as e:
+            raise ValueError(filename + ': ' + str(e))
+        flux, peaks = spectral_flux(sample_blocks(mm, info))
+    onsets = pick_peaks(flux, info.rate)
+    # Time of the middle of the window where the flux peaked
+    seconds = (onsets * hop_size + window_size / 2.) / info.rate
+    kept = spaced(seconds)
+    onsets = onsets[kept]
+    seconds = seconds[kept]
+    frequencies = peaks[onsets] * info.rate / float(window_size)
+    notes = np.rint(69 + 12 * np.log2(frequencies / 440.)).astype(np.int32)
+    return seconds, notes
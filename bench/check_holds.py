@@ -0,0 +1,290 @@
+# Check of timeline holds against keyframe_insert and frame_set
+#
+# Authors flash cuts the way animation.py does, on a Timeline and on a reference that keys like Blender:
+# frame_set evaluates every F-curve into its property and keyframe_insert keys the property's current value,
+# replacing any key on that frame. Cuts are close together (one to four frames apart) so holds land on
+# frames that already have keys. Prints every frame where the compiled timeline differs from the reference
+# The reference evaluates F-curves with its own port of Blender 2.7x's calchandles_fcurve and
+# fcurve_eval_keyframes (blenkernel/intern/curve.c and fcurve.c), nothing from timeline.py
+#
+# Usage: python bench/check_holds.py [--seeds N]
+
+import argparse
+import math
+import os
+import sys
+
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+from timeline import Timeline, evaluate_frames
+
+# Differences below this are rounding; the port computes in double precision, Blender itself in single
+tolerance = 1e-6
+# Lower bound findzero accepts for roots, SMALL in fcurve.c
+small = -1e-10
+flt_epsilon = 1.1920929e-07
+
+def calc_handles(points):
+    # calchandles_fcurve with every handle auto clamped, as keyframe_insert makes them, and constant
+    # extrapolation: points are [left handle, key, right handle] of [x, y] each, in frame order
+    for a, (left, key, right) in enumerate(points):
+        prev = points[a-1][1] if a > 0 else None
+        next = points[a+1][1] if a < len(points) - 1 else None
+        # calchandleNurb_intern, 2D only
+        if prev is None:
+            p1 = [2 * key[0] - next[0], 2 * key[1] - next[1]]
+        else:
+            p1 = prev
+        if next is None:
+            p3 = [2 * key[0] - p1[0], 2 * key[1] - p1[1]]
+        else:
+            p3 = next
+        dvec_a = [key[0] - p1[0], key[1] - p1[1]]
+        dvec_b = [p3[0] - key[0], p3[1] - key[1]]
+        len_a = dvec_a[0] or 1.
+        len_b = dvec_b[0] or 1.
+        tvec = [dvec_b[0] / len_b + dvec_a[0] / len_a, dvec_b[1] / len_b + dvec_a[1] / len_a]
+        length = tvec[0] * 2.5614
+        if length != 0:
+            leftviolate = rightviolate = False
+            if len_a > 5 * len_b:
+                len_a = 5 * len_b
+            if len_b > 5 * len_a:
+                len_b = 5 * len_a
+            len_a /= length
+            left[:] = [key[0] - tvec[0] * len_a, key[1] - tvec[1] * len_a]
+            if next is not None and prev is not None:
+                ydiff1 = prev[1] - key[1]
+                ydiff2 = next[1] - key[1]
+                if (ydiff1 <= 0 and ydiff2 <= 0) or (ydiff1 >= 0 and ydiff2 >= 0):
+                    left[1] = key[1]
+                elif ydiff1 <= 0:
+                    if prev[1] > left[1]:
+                        left[1] = prev[1]
+                        leftviolate = True
+                elif prev[1] < left[1]:
+                    left[1] = prev[1]
+                    leftviolate = True
+            len_b /= length
+            right[:] = [key[0] + tvec[0] * len_b, key[1] + tvec[1] * len_b]
+            if next is not None and prev is not None:
+                ydiff1 = prev[1] - key[1]
+                ydiff2 = next[1] - key[1]
+                if (ydiff1 <= 0 and ydiff2 <= 0) or (ydiff1 >= 0 and ydiff2 >= 0):
+                    right[1] = key[1]
+                elif ydiff1 <= 0:
+                    if next[1] < right[1]:
+                        right[1] = next[1]
+                        rightviolate = True
+                elif next[1] > right[1]:
+                    right[1] = next[1]
+                    rightviolate = True
+            if leftviolate or rightviolate:
+                h1_x = left[0] - key[0]
+                h2_x = key[0] - right[0]
+                if leftviolate:
+                    right[1] = key[1] + ((key[1] - left[1]) / h1_x) * h2_x
+                else:
+                    left[1] = key[1] + ((key[1] - right[1]) / h2_x) * h1_x
+        # Automatic ease in and out on the first and last keys
+        if a == 0 or a == len(points) - 1:
+            left[1] = right[1] = key[1]
+
+def correct_bezpart(v1, v2, v3, v4):
+    # Shorten handles that overlap in time
+    h1 = [v1[0] - v2[0], v1[1] - v2[1]]
+    h2 = [v4[0] - v3[0], v4[1] - v3[1]]
+    length = v4[0] - v1[0]
+    len1 = abs(h1[0])
+    len2 = abs(h2[0])
+    if len1 + len2 == 0:
+        return
+    if len1 + len2 > length:
+        fac = length / (len1 + len2)
+        v2[:] = [v1[0] - fac * h1[0], v1[1] - fac * h1[1]]
+        v3[:] = [v4[0] - fac * h2[0], v4[1] - fac * h2[1]]
+
+def cube_root(d):
+    return math.copysign(abs(d) ** (1 / 3.), d)
+
+def findzero(x, q0, q1, q2, q3):
+    # Roots in [0, 1] of the cubic Bezier q0 - q3 minus x, by Cardano's formula
+    c0 = q0 - x
+    c1 = 3 * (q1 - q0)
+    c2 = 3 * (q0 - 2 * q1 + q2)
+    c3 = q3 - q0 + 3 * (q1 - q2)
+    if c3 != 0:
+        a = c2 / c3 / 3
+        b = c1 / c3
+        c = c0 / c3
+        p = b / 3 - a * a
+        q = (2 * a * a * a - a * b + c) / 2
+        d = q * q + p * p * p
+        if d > 0:
+            t = math.sqrt(d)
+            roots = [cube_root(-q + t) + cube_root(-q - t) - a]
+        elif d == 0:
+            t = cube_root(-q)
+            roots = [2 * t - a, -t - a]
+        else:
+            phi = math.acos(-q / math.sqrt(-(p * p * p)))
+            t = math.sqrt(-p)
+            p = math.cos(phi / 3)
+            q = math.sqrt(3 - 3 * p * p)
+            roots = [2 * t * p - a, -t * (p + q) - a, -t * (p - q) - a]
+    elif c2 != 0:
+        p = c1 * c1 - 4 * c2 * c0
+        if p > 0:
+            roots = [(-c1 - math.sqrt(p)) / (2 * c2), (-c1 + math.sqrt(p)) / (2 * c2)]
+        elif p == 0:
+            roots = [-c1 / (2 * c2)]
+        else:
+            roots = []
+    elif c1 != 0:
+        roots = [-c0 / c1]
+    else:
+        roots = [0.] if c0 == 0 else []
+    return [o for o in roots if small <= o <= 1.000001]
+
+def berekeny(f1, f2, f3, f4, t):
+    c0 = f1
+    c1 = 3 * (f2 - f1)
+    c2 = 3 * (f1 - 2 * f2 + f3)
+    c3 = f4 - f1 + 3 * (f2 - f3)
+    return c0 + t * c1 + t * t * c2 + t * t * t * c3
+
+def fcurve_values(keys, at):
+    # fcurve_eval_keyframes of {frame: [value, interpolation]} with auto clamped handles at every frame of at
+    frames = sorted(keys)
+    points = [[[f, keys[f][0]], [f, keys[f][0]], [f, keys[f][0]]] for f in frames]
+    if len(points) > 1:
+        calc_handles(points)
+    return [segment_value(frames, keys, points, frame) for frame in at]
+
+def segment_value(frames, keys, points, frame):
+    # fcurve_eval_keyframes at one frame, given the keys with their handles
+    if frame <= frames[0]:
+        return keys[frames[0]][0]
+    if frame >= frames[-1]:
+        return keys[frames[-1]][0]
+    a = max(i for i, f in enumerate(frames) if f <= frame)
+    if frames[a] == frame:
+        return keys[frame][0]
+    interpolation = keys[frames[a]][1]
+    v1, v2 = list(points[a][1]), list(points[a][2])
+    v3, v4 = list(points[a+1][0]), list(points[a+1][1])
+    if interpolation == 'CONSTANT':
+        return v1[1]
+    if interpolation == 'LINEAR':
+        return v1[1] + (v4[1] - v1[1]) * (frame - v1[0]) / (v4[0] - v1[0])
+    if abs(v1[1] - v4[1]) < flt_epsilon and abs(v2[1] - v3[1]) < flt_epsilon and abs(v3[1] - v4[1]) < flt_epsilon:
+        return v1[1]
+    correct_bezpart(v1, v2, v3, v4)
+    roots = findzero(frame, v1[0], v2[0], v3[0], v4[0])
+    if not roots:
+        raise ValueError('findzero failed at ' + str(frame))
+    return berekeny(v1[1], v2[1], v3[1], v4[1], roots[0])
+
+class Reference:
+    # Properties and F-curves of one object, keyed and evaluated like Blender does
+
+    def __init__(self):
+        self.values = {}
+        # (data_path, index) -> {frame: [value, interpolation]}
+        self.curves = {}
+
+    def insert(self, data_path, frame, interpolation=None):
+        for index in range(3):
+            keys = self.curves.setdefault((data_path, index), {})
+            value = self.values[(data_path, index)]
+            if frame in keys:
+                keys[frame][0] = value
+                if interpolation is not None:
+                    keys[frame][1] = interpolation
+            else:
+                keys[frame] = [value, interpolation or 'BEZIER']
+
+    def frame_set(self, frame):
+        for channel, keys in self.curves.items():
+            self.values[channel] = fcurve_values(keys, [frame])[0]
+
+class Piece:
+    # The same authoring calls on a Timeline and on the reference
+
+    def __init__(self):
+        self.tl = Timeline()
+        self.target = self.tl.object('spin')
+        self.reference = Reference()
+
+    def set(self, data_path, value):
+        setattr(self.target, data_path, value)
+        for index in range(3):
+            self.reference.values[(data_path, index)] = float(value[index])
+
+    def insert(self, data_path, frame, interpolation=None):
+        self.tl.insert(self.target, data_path, frame, interpolation=interpolation)
+        self.reference.insert(data_path, float(frame), interpolation)
+
+    def flash_cut(self, frame):
+        # animation.py flash_cut: hold the shot in the frames around a close-up
+        for hold_frame in (frame - 1, frame + 1):
+            self.reference.frame_set(float(hold_frame))
+            for data_path in ('location', 'rotation_euler'):
+                self.tl.hold(self.target, data_path, hold_frame)
+                self.reference.insert(data_path, float(hold_frame))
+        self.set('location', (0, 0, 0))
+        self.set('rotation_euler', (0, 0, 3.14159))
+        self.insert('location', frame)
+        self.insert('rotation_euler', frame)
+
+def build(seed):
+    # Moves with flash cuts in between, some of the moves keyed again after the cuts
+    rng = np.random.default_rng(seed)
+    piece = Piece()
+    move_frames = np.arange(1, 401, 40)
+    for frame in move_frames:
+        piece.set('location', tuple(rng.uniform(-5, 5, 3)))
+        piece.set('rotation_euler', tuple(rng.uniform(-3, 3, 3)))
+        piece.insert('location', frame)
+        piece.insert('rotation_euler', frame, 'LINEAR' if rng.random() < 0.5 else None)
+    frame = 3
+    while frame < 395:
+        piece.flash_cut(frame)
+        frame += int(rng.integers(1, 5)) if rng.random() < 0.7 else int(rng.integers(5, 30))
+    for frame in rng.choice(move_frames, 3, replace=False):
+        piece.set('location', tuple(rng.uniform(-5, 5, 3)))
+        piece.insert('location', frame)
+    return piece
+
+def check(seed):
+    # Frames where the compiled timeline and the reference differ, as (data_path, index, frame, timeline, reference)
+    piece = build(seed)
+    compiled = piece.tl.compile()
+    differences = []
+    at = np.arange(1, 401, 0.5)
+    for (data_path, index), keys in sorted(piece.reference.curves.items()):
+        expected = np.array(fcurve_values(keys, at))
+        actual = evaluate_frames(compiled[('objects', 'spin', data_path, index)], at)
+        # Holds left unresolved are NaN, which count as differences too
+        for i in np.flatnonzero(~(np.abs(actual - expected) <= tolerance)):
+            differences.append((data_path, index, at[i], actual[i], expected[i]))
+    return differences
+
+def main():
+    parser = argparse.ArgumentParser(description='Check timeline holds against keyframe_insert and frame_set')
+    parser.add_argument('--seeds', type=int, default=20, help='random pieces to check')
+    args = parser.parse_args()
+    failed = 0
+    for seed in range(args.seeds):
+        differences = check(seed)
+        if differences:
+            failed += 1
+            print('seed', seed, ':', len(differences), 'differing frames, first', differences[0])
+    print(args.seeds - failed, 'of', args.seeds, 'pieces match')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# Check of audio onset detection on synthetic WAV files
+#
+# Writes stems of a few sparse hits (decaying sines) over white noise floors from silence to 3e-3 and checks
+# that detect_onsets finds exactly those hits, each within tolerance seconds, and nothing in the noise
+# Louder noise hides these hits below audio.py's noise floor
+#
+# Usage: python bench/check_onsets.py
+
+import os
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+from audio import detect_onsets
+
+rate = 44100
+# Detected times are the middle of the analysis window where the flux peaked, which may be a hop before the hit
+tolerance = 0.03
+noise_floors = [0., 1e-4, 1e-3, 3e-3]
+# (length in seconds, hit times)
+stems = [
+    (5., [0.5, 1.3, 2.0, 2.9, 3.6, 4.4]),
+    (60., [3.1, 17.4, 25.0, 38.2, 46.9, 55.5]),
+    (300., [41.0, 122.7, 250.3]),
+]
+
+def write_wav(filename, samples):
+    # Mono 32-bit float WAV
+    data = samples.astype('<f4').tobytes()
+    fmt = struct.pack('<HHIIHH', 3, 1, rate, rate * 4, 4, 32)
+    body = b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt + b'data' + struct.pack('<I', len(data)) + data
+    with open(filename, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', len(body)) + body)
+
+def stem(length, hits, noise_floor, seed):
+    # Hits of random pitch and loudness that decay to nothing within 0.3 s, over white noise
+    rng = np.random.default_rng(seed)
+    samples = rng.standard_normal(int(length * rate)) * noise_floor
+    t = np.arange(int(0.3 * rate)) / float(rate)
+    for hit in hits:
+        start = int(hit * rate)
+        frequency = 440. * 2 ** (rng.integers(-12, 13) / 12.)
+        samples[start:start + len(t)] += rng.uniform(0.2, 0.5) * np.sin(2 * np.pi * frequency * t) * np.exp(-t / 0.02)
+    return samples
+
+def check(filename, hits):
+    # Problems with the onsets found in filename, as strings
+    seconds, notes = detect_onsets(filename)
+    problems = []
+    if len(seconds) != len(hits):
+        problems.append(str(len(seconds)) + ' onsets for ' + str(len(hits)) + ' hits: ' + str(np.round(seconds, 3)))
+    else:
+        off = np.abs(seconds - hits)
+        if off.max() > tolerance:
+            problems.append('onsets ' + str(np.round(seconds, 3)) + ' for hits ' + str(hits))
+    return problems
+
+def main():
+    failed = 0
+    total = 0
+    tmp_dir = tempfile.mkdtemp(prefix='check_onsets_')
+    for i, (length, hits) in enumerate(stems):
+        for noise_floor in noise_floors:
+            filename = os.path.join(tmp_dir, 'stem' + str(i) + '_' + str(noise_floor) + '.wav')
+            write_wav(filename, stem(length, hits, noise_floor, seed=i))
+            problems = check(filename, np.array(hits))
+            total += 1
+            if problems:
+                failed += 1
+                print(os.path.basename(filename), ':', '; '.join(problems))
+            os.remove(filename)
+    os.rmdir(tmp_dir)
+    print(total - failed, 'of', total, 'stems match their hits')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,409 @@
+# Stand-in for bpy and mathutils, enough to run the scripts outside Blender for benchmarking
+#
+# Datablocks are plain Python objects with the properties the scripts use, and every bpy call that
+# would cost something in Blender is counted in ops. It doesn't render or evaluate anything:
+# frame_set only counts, drivers and constraints are only stored
+
+import colorsys
+import sys
+import types
+
+from collections import Counter
+
+ops = Counter()
+
+class Vector(list):
+    # mathutils.Vector with the x/y/z accessors the scripts use
+
+    def copy(self):
+        return Vector(self)
+
+    x = property(lambda self: self[0], lambda self, value: self.__setitem__(0, value))
+    y = property(lambda self: self[1], lambda self, value: self.__setitem__(1, value))
+    z = property(lambda self: self[2], lambda self, value: self.__setitem__(2, value))
+
+class Matrix(list):
+    # mathutils.Matrix, rows only
+    pass
+
+class Color:
+
+    def __init__(self):
+        self.r = self.g = self.b = 0.
+
+    @property
+    def hsv(self):
+        return colorsys.rgb_to_hsv(self.r, self.g, self.b)
+
+    @hsv.setter
+    def hsv(self, hsv):
+        self.r, self.g, self.b = colorsys.hsv_to_rgb(*hsv)
+
+class ID:
+    # Datablock with custom properties and a user count
+
+    def __init__(self, name):
+        self.name = name
+        self.users = 0
+        self.props = {}
+        self.animation_data = None
+
+    def __getitem__(self, key):
+        return self.props[key]
+
+    def __setitem__(self, key, value):
+        self.props[key] = value
+
+    def __delitem__(self, key):
+        del self.props[key]
+
+    def __contains__(self, key):
+        return key in self.props
+
+    def get(self, key, default=None):
+        return self.props.get(key, default)
+
+    def animation_data_create(self):
+        ops['animation_data_create'] += 1
+        self.animation_data = AnimData()
+        return self.animation_data
+
+    def animation_data_clear(self):
+        ops['animation_data_clear'] += 1
+        self.animation_data = None
+
+    def path_resolve(self, data_path):
+        if data_path.startswith('["'):
+            return self.props[data_path[2:-2]]
+        return getattr(self, data_path)
+
+    def driver_add(self, data_path, index=-1):
+        ops['driver_add'] += 1
+        anim = self.animation_data or self.animation_data_create()
+        fcu = anim.drivers.new(data_path, max(index, 0))
+        fcu.driver = Driver()
+        # Driver F-curves start with a Generator that passes the driver value through
+        fcu.modifiers.append(types.SimpleNamespace(type='GENERATOR'))
+        return fcu
+
+    def driver_remove(self, data_path, index=-1):
+        ops['driver_remove'] += 1
+        drivers = self.animation_data.drivers
+        drivers[:] = [fcu for fcu in drivers if fcu.data_path != data_path or index not in (-1, fcu.array_index)]
+
+class Collection:
+    # bpy.data.objects and the like, keyed by unique name
+
+    def __init__(self, kind, factory):
+        self.kind = kind
+        self.factory = factory
+        self.items = {}
+
+    def new(self, name, *args):
+        ops[self.kind + '.new'] += 1
+        base = name
+        count = 0
+        while name in self.items:
+            count += 1
+            name = base + '.%03d' % count
+        block = self.factory(name, *args)
+        self.items[name] = block
+        return block
+
+    def remove(self, block, do_unlink=True):
+        ops[self.kind + '.remove'] += 1
+        if self.items.get(block.name) is block:
+            del self.items[block.name]
+        else:
+            # Renamed blocks are still filed under the name they were made with
+            del self.items[next(name for name, item in self.items.items() if item is block)]
+        block.release()
+
+    def __getitem__(self, name):
+        return self.items[name]
+
+    def get(self, name, default=None):
+        return self.items.get(name, default)
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+    def __len__(self):
+        return len(self.items)
+
+class Material(ID):
+
+    def __init__(self, name):
+        ID.__init__(self, name)
+        self.diffuse_color = Vector((0.8, 0.8, 0.8))
+        self.emit = 0.
+        self.use_object_color = False
+
+    def release(self):
+        pass
+
+class Mesh(ID):
+
+    def __init__(self, name):
+        ID.__init__(self, name)
+        self.materials = []
+
+    def copy(self):
+        ops['mesh.copy'] += 1
+        mesh = data.meshes.new(self.name)
+        for mat in self.materials:
+            mesh.materials.append(mat)
+            mat.users += 1
+        return mesh
+
+    def release(self):
+        for mat in self.materials:
+            mat.users -= 1
+
+class Lamp(ID):
+
+    def __init__(self, name):
+        ID.__init__(self, name)
+        self.energy = 1.
+        self.color = Vector((1., 1., 1.))
+
+    def release(self):
+        pass
+
+class MaterialSlot:
+
+    def __init__(self, material):
+        self.material = material
+        self.link = 'DATA'
+
+class Constraints(list):
+
+    def new(self, kind):
+        ops['constraints.new'] += 1
+        constraint = types.SimpleNamespace(type=kind, target=None)
+        self.append(constraint)
+        return constraint
+
+class Modifiers(list):
+
+    def new(self, name, kind):
+        ops['modifiers.new'] += 1
+        modifier = types.SimpleNamespace(name=name, type=kind)
+        self.append(modifier)
+        return modifier
+
+class Object(ID):
+
+    def __init__(self, name, object_data=None):
+        ID.__init__(self, name)
+        self._data = None
+        self.data = object_data
+        self.location = Vector((0., 0., 0.))
+        self.rotation_euler = Vector((0., 0., 0.))
+        self.scale = Vector((1., 1., 1.))
+        self.color = Vector((1., 1., 1., 1.))
+        self.select = False
+        self.hide = False
+        self.hide_render = False
+        self.constraints = Constraints()
+        self.modifiers = Modifiers()
+        self.parent = None
+        self.matrix_parent_inverse = None
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        if self._data is not None:
+            self._data.users -= 1
+        self._data = value
+        if value is not None:
+            value.users += 1
+
+    @property
+    def type(self):
+        if isinstance(self._data, Mesh):
+            return 'MESH'
+        if isinstance(self._data, Lamp):
+            return 'LAMP'
+        return 'EMPTY'
+
+    @property
+    def active_material(self):
+        return self._data.materials[0] if self._data is not None and self._data.materials else None
+
+    @active_material.setter
+    def active_material(self, mat):
+        # Material slots link to the mesh, as they do by default
+        materials = self._data.materials
+        if materials:
+            materials[0].users -= 1
+            materials[0] = mat
+        else:
+            materials.append(mat)
+        mat.users += 1
+
+    @property
+    def material_slots(self):
+        materials = self._data.materials if isinstance(self._data, Mesh) else []
+        return [MaterialSlot(mat) for mat in materials]
+
+    def to_mesh(self, scene, apply_modifiers, settings):
+        # New mesh with the modifiers applied; here just a copy
+        ops['object.to_mesh'] += 1
+        return self._data.copy()
+
+    def release(self):
+        self.data = None
+        for scene in data.scenes:
+            scene.objects.discard(self)
+
+class Keyframe:
+    __slots__ = ('co', 'interpolation')
+
+    def __init__(self):
+        self.co = [0., 0.]
+        self.interpolation = 'BEZIER'
+
+class KeyframePoints(list):
+
+    def add(self, count):
+        ops['keyframe_points.add'] += 1
+        self.extend(Keyframe() for _ in range(count))
+
+    def foreach_set(self, attr, seq):
+        ops['keyframe_points.foreach_set'] += 1
+        for i, point in enumerate(self):
+            point.co = [seq[2*i], seq[2*i+1]]
+
+    def foreach_get(self, attr, seq):
+        ops['keyframe_points.foreach_get'] += 1
+        for i, point in enumerate(self):
+            seq[2*i], seq[2*i+1] = point.co
+
+class FCurve:
+
+    def __init__(self, data_path, index):
+        self.data_path = data_path
+        self.array_index = index
+        self.keyframe_points = KeyframePoints()
+        self.modifiers = []
+        self.driver = None
+
+    def update(self):
+        ops['fcurve.update'] += 1
+
+class FCurves(list):
+
+    def find(self, data_path, index=0):
+        for fcu in self:
+            if fcu.data_path == data_path and fcu.array_index == index:
+                return fcu
+        return None
+
+    def new(self, data_path, index=0):
+        ops['fcurves.new'] += 1
+        fcu = FCurve(data_path, index)
+        self.append(fcu)
+        return fcu
+
+class Action(ID):
+
+    def __init__(self, name):
+        ID.__init__(self, name)
+        self.fcurves = FCurves()
+
+    def release(self):
+        pass
+
+class AnimData:
+
+    def __init__(self):
+        self.action = None
+        self.drivers = FCurves()
+
+class Variables(list):
+
+    def new(self):
+        var = types.SimpleNamespace(name='var', type='SINGLE_PROP', targets=[types.SimpleNamespace()])
+        self.append(var)
+        return var
+
+class Driver:
+
+    def __init__(self):
+        self.type = 'SCRIPTED'
+        self.variables = Variables()
+
+class SceneObjects(set):
+
+    def link(self, obj):
+        ops['scene.objects.link'] += 1
+        self.add(obj)
+        obj.users += 1
+
+class Scene(ID):
+
+    def __init__(self, name):
+        ID.__init__(self, name)
+        self.objects = SceneObjects()
+        self.frame_current = 1
+        self.render = types.SimpleNamespace(filepath='', use_overwrite=True)
+
+    def frame_set(self, frame, subframe=0.):
+        ops['scene.frame_set'] += 1
+        self.frame_current = frame
+
+    def release(self):
+        pass
+
+def object_delete():
+    # bpy.ops.object.delete on the selected objects, looking through the whole scene like the operator does
+    ops['ops.object.delete'] += 1
+    for obj in list(context.scene.objects):
+        if obj.select:
+            data.objects.remove(obj)
+
+data = None
+context = None
+
+def reset():
+    # Fresh, empty file with one scene called Scene
+    global data, context
+    data = types.SimpleNamespace(
+        objects=Collection('objects', Object),
+        meshes=Collection('meshes', Mesh),
+        materials=Collection('materials', Material),
+        lamps=Collection('lamps', Lamp),
+        actions=Collection('actions', Action),
+        scenes=Collection('scenes', Scene),
+    )
+    scene = data.scenes.new('Scene')
+    context = types.SimpleNamespace(
+        scene=scene,
+        user_preferences=types.SimpleNamespace(edit=types.SimpleNamespace(keyframe_new_interpolation_type='BEZIER')),
+    )
+    ops.clear()
+    bpy = sys.modules.get('bpy')
+    if bpy is not None:
+        bpy.data = data
+        bpy.context = context
+
+def install():
+    # Make import bpy and import mathutils give the stand-ins
+    reset()
+    bpy = types.ModuleType('bpy')
+    bpy.data = data
+    bpy.context = context
+    mathutils = types.ModuleType('mathutils')
+    mathutils.Vector = Vector
+    mathutils.Color = Color
+    mathutils.Matrix = Matrix
+    sys.modules['bpy'] = bpy
+    sys.modules['mathutils'] = mathutils
+    return bpy
@@ -0,0 +1,277 @@
+# Benchmarks for the pipeline, without Blender
+#
+# Times onset parsing, timeline generation per section, compiling, reducing, writing keyframes, object creation and
+# deletion and flash cuts at growing sizes, using synthetic onset files and the bpy stand-in in fake_bpy.py
+# Results are written as JSON and can be compared against an earlier run to catch regressions
+#
+# Usage: python bench/run.py [--full] [--repeat N] [--output results.json] [--baseline baseline.json]
+#                            [--tolerance 0.25]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import runpy
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, repo_dir)
+sys.path.insert(0, bench_dir)
+
+import fake_bpy
+
+fake_bpy.install()
+
+import profiler
+
+from keyframes import apply_groups, apply_timeline
+from onsets import parse_midi, parse_mididump, read_onsets
+from timeline import Timeline, reduce_keys
+
+# Sizes for a quick run and for --full
+quick_sizes = {'events': [10000], 'scene': [(150, 50)], 'cuts': [100]}
+full_sizes = {
+    'events': [10000, 100000, 1000000],
+    'scene': [(150, 50), (1000, 300), (10000, 3000), (100000, 30000)],
+    'cuts': [100, 1000, 10000],
+}
+
+# Onset files animation.py reads, with MIDI notes matching its filters
+onset_notes = {
+    'act1orbs': 80, 'act1kick': 36, 'swells': 40, 'act2bass': 40, 'act2kick': 38,
+    'act2snare': 42, 'act2embellish': 90, 'act3drums': 40, 'act4orbs': 80,
+}
+
+# Differences below this many seconds are noise, not regressions
+noise_floor = 0.01
+
+def best_time(func, repeat):
+    # Fastest of repeat runs in seconds and the last result
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def write_mididump(filename, events, note, seed=0, mean_ticks=110):
+    # mididump.py style text file with events note on/off pairs on one track
+    rng = np.random.default_rng(seed)
+    ticks = rng.integers(1, 2 * mean_ticks, size=events)
+    with open(filename, 'w') as f:
+        f.write('midi.Pattern(format=1, resolution=220, tracks=\\\n[midi.Track(\\\n')
+        for i in range(events):
+            kind = 'On' if i % 2 == 0 else 'Off'
+            velocity = 100 if i % 2 == 0 else 0
+            f.write('  midi.Note' + kind + 'Event(tick=' + str(ticks[i]) + ', channel=9, data=[' +
+                    str(note) + ', ' + str(velocity) + ']),\n')
+        f.write('  midi.EndOfTrackEvent(tick=0, data=[])])])\n')
+
+def write_midi(filename, events, note, seed=0, mean_ticks=110):
+    # Standard MIDI file with the same events as write_mididump, using running status
+    rng = np.random.default_rng(seed)
+    ticks = rng.integers(1, 2 * mean_ticks, size=events)
+    track = bytearray()
+    for i in range(events):
+        delta = int(ticks[i])
+        var = [delta & 0x7f]
+        delta >>= 7
+        while delta:
+            var.insert(0, 0x80 | (delta & 0x7f))
+            delta >>= 7
+        track += bytes(var)
+        if i == 0:
+            track.append(0x99)
+        track += bytes((note, 100 if i % 2 == 0 else 0))
+    track += b'\x00\xff\x2f\x00'
+    with open(filename, 'wb') as f:
+        f.write(b'MThd' + (6).to_bytes(4, 'big') + (0).to_bytes(2, 'big') + (1).to_bytes(2, 'big') +
+                (220).to_bytes(2, 'big'))
+        f.write(b'MTrk' + len(track).to_bytes(4, 'big') + bytes(track))
+
+def write_config(directory, numorb, numtor):
+    filename = os.path.join(directory, 'orbit.ini')
+    with open(filename, 'w') as f:
+        f.write('[onsets]\ndirectory = onsets\n')
+        for name in onset_notes:
+            f.write(name + ' = ' + name + '.txt\n')
+        f.write('[scene]\nnumorb = ' + str(numorb) + '\nnumtor = ' + str(numtor) + '\ninstanced = yes\n')
+    return filename
+
+def bench_parse(workdir, events, repeat, timings):
+    text = os.path.join(workdir, 'parse_' + str(events) + '.txt')
+    midi = os.path.join(workdir, 'parse_' + str(events) + '.mid')
+    write_mididump(text, events, 36)
+    write_midi(midi, events, 36)
+    timings['parse_mididump/' + str(events)] = best_time(lambda: parse_mididump(text), repeat)[0]
+    timings['parse_midi/' + str(events)] = best_time(lambda: parse_midi(midi), repeat)[0]
+    read_onsets(text)
+    timings['read_onsets_cached/' + str(events)] = best_time(lambda: read_onsets(text), repeat)[0]
+
+@contextlib.contextmanager
+def without_bpy():
+    # animation.py only builds the timeline when bpy can't be imported
+    bpy = sys.modules['bpy']
+    sys.modules['bpy'] = None
+    try:
+        yield
+    finally:
+        sys.modules['bpy'] = bpy
+
+def run_piece(config):
+    # Run animation.py, timing each timeline section; returns its globals and {section: seconds}
+    os.environ['ORBIT_CONFIG'] = config
+    profile = profiler.enable()
+    try:
+        with without_bpy(), contextlib.redirect_stdout(io.StringIO()):
+            piece = runpy.run_path(os.path.join(repo_dir, 'animation.py'), run_name='bench')
+    finally:
+        profiler.active = None
+    times = {}
+    for name, category, start, end, counts, thread in profile.spans:
+        if category == 'section':
+            times[name] = times.get(name, 0.) + end - start
+    return piece, times
+
+def make_targets(compiled, groups):
+    # Empty datablocks for everything the timeline animates
+    collections = {'objects': fake_bpy.data.objects, 'lamps': fake_bpy.data.lamps,
+                   'materials': fake_bpy.data.materials}
+    names = set((kind, name) for kind, name, data_path, index in compiled if kind != 'scenes')
+    names.update(('objects', name) for members in groups.values() for name in members)
+    for kind, name in names:
+        if name not in collections[kind]:
+            collections[kind].new(name)
+
+def bench_scene(workdir, numorb, numtor, repeat, timings, ops):
+    size = str(numorb) + 'x' + str(numtor)
+    config = write_config(workdir, numorb, numtor)
+    # Object creation and deletion
+    fake_bpy.reset()
+    for name in ('Orb', 'Glass', 'Torus'):
+        mesh = fake_bpy.data.meshes.new(name)
+        mesh.materials.append(fake_bpy.data.materials.new(name + 'Material'))
+        fake_bpy.data.scenes['Scene'].objects.link(fake_bpy.data.objects.new(name, mesh))
+    os.environ['ORBIT_CONFIG'] = config
+    for script in ('orbs', 'ring_tunnel', 'delete_orbs', 'delete_rings'):
+        start = time.perf_counter()
+        runpy.run_path(os.path.join(repo_dir, script + '.py'), run_name='bench')
+        timings[script + '/' + size] = time.perf_counter() - start
+    ops['objects/' + size] = dict(fake_bpy.ops)
+    # Timeline generation per section and compiling
+    elapsed, (piece, sections) = best_time(lambda: run_piece(config), repeat)
+    timings['animation/' + size] = elapsed
+    for name, seconds in sections.items():
+        timings['section/' + name + '/' + size] = seconds
+    tl = piece['tl']
+    timings['compile/' + size], compiled = best_time(tl.compile, repeat)
+    timings['reduce/' + size] = best_time(lambda: reduce_keys(compiled, tl.protected), repeat)[0]
+    # Writing keyframes, then writing them again when nothing changed
+    fake_bpy.reset()
+    make_targets(compiled, tl.groups)
+    fake_bpy.ops.clear()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        apply_groups(tl.groups, tl.lods)
+        apply_timeline(compiled)
+    timings['apply/' + size] = time.perf_counter() - start
+    ops['apply/' + size] = dict(fake_bpy.ops)
+    fake_bpy.ops.clear()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        apply_timeline(compiled)
+    timings['apply_unchanged/' + size] = time.perf_counter() - start
+
+def flash_cut_timeline(cuts, seed=0):
+    # Camera moves like the piece's, with flash cuts at random frames in between
+    rng = np.random.default_rng(seed)
+    tl = Timeline()
+    spin = tl.object('spin')
+    camera = tl.object('Camera')
+    length = cuts * 50
+    for frame in range(1, length + 1, 100):
+        spin.location = tuple(rng.uniform(-5, 5, 3))
+        spin.rotation_euler = tuple(rng.uniform(-3, 3, 3))
+        camera.location = (0, rng.uniform(3, 75), 0)
+        tl.insert(spin, 'location', frame)
+        tl.insert(spin, 'rotation_euler', frame)
+        tl.insert(camera, 'location', frame)
+    for frame in np.sort(rng.choice(np.arange(3, length - 1), cuts, replace=False)):
+        # Same keys as flash_cut in animation.py
+        for target, data_path in ((spin, 'location'), (spin, 'rotation_euler'), (camera, 'location')):
+            tl.hold(target, data_path, frame-1)
+            tl.hold(target, data_path, frame+1)
+        spin.location = (0, 0, 0)
+        spin.rotation_euler = (0, 0, 3.14159)
+        camera.location = (0, 5, 0)
+        tl.insert(spin, 'location', frame)
+        tl.insert(spin, 'rotation_euler', frame)
+        tl.insert(camera, 'location', frame)
+    return tl
+
+def bench_flash_cuts(cuts, repeat, timings):
+    timings['flash_cuts/' + str(cuts)], tl = best_time(lambda: flash_cut_timeline(cuts), repeat)
+    timings['flash_cuts_compile/' + str(cuts)] = best_time(tl.compile, repeat)[0]
+
+def compare(timings, baseline, tolerance):
+    # Print timings next to the baseline; returns the names that got slower by more than tolerance
+    regressions = []
+    for name in sorted(timings):
+        line = '%-48s %10.4f s' % (name, timings[name])
+        if name in baseline:
+            ratio = timings[name] / baseline[name] if baseline[name] > 0 else float('inf')
+            line += '   %6.2fx baseline' % ratio
+            if ratio > 1 + tolerance and timings[name] - baseline[name] > noise_floor:
+                regressions.append(name)
+                line += '   REGRESSION'
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline without Blender')
+    parser.add_argument('--full', action='store_true', help='run every size, up to 100k orbs and 1M events')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the fastest counts')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results from an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before it is a regression')
+    args = parser.parse_args()
+    sizes = full_sizes if args.full else quick_sizes
+    timings = {}
+    ops = {}
+    workdir = tempfile.mkdtemp(prefix='orbit_bench_')
+    onset_dir = os.path.join(workdir, 'onsets')
+    os.makedirs(onset_dir)
+    # Enough onsets to cover each part of the piece
+    for i, (name, note) in enumerate(sorted(onset_notes.items())):
+        write_mididump(os.path.join(onset_dir, name + '.txt'), 400, note, seed=i)
+    for events in sizes['events']:
+        bench_parse(workdir, events, args.repeat, timings)
+    for numorb, numtor in sizes['scene']:
+        bench_scene(workdir, numorb, numtor, args.repeat if numorb <= 1000 else 1, timings, ops)
+    for cuts in sizes['cuts']:
+        bench_flash_cuts(cuts, args.repeat, timings)
+    results = {'python': platform.python_version(), 'numpy': np.__version__, 'sizes': sizes,
+               'timings': timings, 'ops': ops}
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['timings']
+    regressions = compare(timings, baseline, args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if regressions:
+        print(len(regressions), 'regressions')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Creation and bulk removal of generated objects
+#
+# Generated objects are numbered copies of an original, e.g. Orb1 - Orb150 of Orb, and are found
+# by their name prefix instead of selecting them and going through bpy.ops.object.delete
+
+import bpy
+
+def duplicateObject(scene, name, copyobj):
+ 
+    # Create new mesh
+    mesh = bpy.data.meshes.new(name)
+ 
+    # Create new object associated with the mesh
+    ob_new = bpy.data.objects.new(name, mesh)
+ 
+    # Copy data block from the old object into the new object
+    ob_new.data = copyobj.data.copy()
+    ob_new.scale = copyobj.scale
+    ob_new.location = copyobj.location
+    
+    # Link new object to the given scene and select it
+    scene.objects.link(ob_new)
+    ob_new.select = True
+ 
+    return ob_new
+
+def instanceObject(name, copyobj):
+    # New object sharing the mesh of the old object, linked to a scene later
+    ob_new = bpy.data.objects.new(name, copyobj.data)
+    ob_new.scale = copyobj.scale
+    ob_new.location = copyobj.location
+    return ob_new
+
+def decimatedMesh(scene, obj, ratio, name):
+    # New mesh of the object as rendered, decimated to ratio of its faces, keeping its materials
+    mod = obj.modifiers.new('LOD', 'DECIMATE')
+    mod.ratio = ratio
+    mesh = obj.to_mesh(scene, True, 'RENDER')
+    obj.modifiers.remove(mod)
+    mesh.name = name
+    return mesh
+
+def lodObject(name, copyobj, mesh):
+    # New object in the place of the old object showing a lower level of detail mesh, linked to a scene later
+    ob_new = bpy.data.objects.new(name, mesh)
+    ob_new.scale = copyobj.scale
+    ob_new.location = copyobj.location
+    ob_new.color = copyobj.color
+    return ob_new
+
+def objectMaterial(obj, mat):
+    # Use mat on this object only, without touching its (shared) mesh
+    slot = obj.material_slots[0]
+    slot.link = 'OBJECT'
+    slot.material = mat
+
+def objectColorMaterial(name, emit):
+    # One material for all instances, its diffuse color comes from each object's color
+    mat = bpy.data.materials.get(name) or bpy.data.materials.new(name)
+    mat.use_object_color = True
+    mat.diffuse_color = 1., 1., 1.
+    mat.emit = emit
+    return mat
+
+def prefix_index(datablocks):
+    # {prefix: [datablocks]} for names that are a prefix followed by a number
+    index = {}
+    for block in datablocks:
+        prefix = block.name.rstrip('0123456789')
+        if prefix != block.name:
+            index.setdefault(prefix, []).append(block)
+    return index
+
+def remove_generated(prefixes, material_prefixes=()):
+    # Remove numbered copies of the given prefixes, along with their meshes and materials
+    # once nothing else uses them; the originals (without a number) are left alone
+    # Numbered materials of material_prefixes are removed whenever unused, which also clears
+    # the ones orphaned by earlier runs
+    # Returns the number of objects removed
+    objects = prefix_index(bpy.data.objects)
+    meshes = set()
+    materials = set()
+    count = 0
+    for prefix in prefixes:
+        for obj in objects.get(prefix, []):
+            if obj.type == 'MESH':
+                meshes.add(obj.data)
+            materials.update(slot.material for slot in obj.material_slots if slot.material is not None)
+            bpy.data.objects.remove(obj, do_unlink=True)
+            count += 1
+    # Instanced copies share the original's mesh and material, which still have users and stay
+    for mesh in meshes:
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+    numbered = prefix_index(bpy.data.materials)
+    for prefix in material_prefixes:
+        materials.update(numbered.get(prefix, []))
+    for mat in materials:
+        if mat.users == 0:
+            bpy.data.materials.remove(mat)
+    return count
@@ -0,0 +1,79 @@
+# Settings shared by animation.py and render.py
+#
+# Read from orbit.ini next to the scripts, or from the file named by the ORBIT_CONFIG environment variable.
+# Relative paths in the file are relative to the file itself
+
+import configparser
+import os
+
+default_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'orbit.ini')
+
+# Used for anything the file leaves out
+defaults = {
+    'onsets': {
+        'directory': '.',
+        'song_midi': '',
+    },
+    'scene': {
+        'numorb': '150',
+        'orb_separation': '2.5',
+        'numtor': '50',
+        'tunnel_pool': '16',
+        'instanced': 'no',
+    },
+    'render': {
+        'blender': 'blender',
+        'blend': 'def_orbit.blend',
+        'output': 'render/frame_',
+        'format': 'PNG',
+        'workers': '0',
+        'threads': '1',
+        'chunk_frames': '250',
+        'retries': '2',
+    },
+    'cull': {
+        'enabled': 'yes',
+        'groups': 'orbs glass tori',
+        'fov': '49.1343',
+        'aspect': '1.7778',
+        'orb_radius': '1.25',
+        'torus_radius': '15',
+        'margin': '2',
+        'margin_frames': '2',
+    },
+    'lod': {
+        'ratios': '0.3 0.08',
+        'distances': '30 60',
+        'hysteresis': '0.15',
+    },
+    'reduce': {
+        'enabled': 'no',
+        'tolerance': '0.00001',
+        'simplify': '0',
+    },
+    'export': {
+        'compiled': '',
+    },
+    'profile': {
+        'trace': '',
+    },
+}
+
+class Config(configparser.ConfigParser):
+
+    def __init__(self, filename):
+        configparser.ConfigParser.__init__(self, interpolation=None)
+        self.filename = os.path.abspath(filename)
+        self.read_dict(defaults)
+        if not self.read(self.filename):
+            raise IOError('config file ' + self.filename + ' not found')
+
+    def path(self, section, option):
+        return os.path.join(os.path.dirname(self.filename), os.path.expanduser(self.get(section, option)))
+
+    def onset_path(self, name):
+        # Onset file listed under name in [onsets], inside the onset directory
+        return os.path.join(self.path('onsets', 'directory'), self.get('onsets', name))
+
+def read_config(filename=None):
+    return Config(filename or os.environ.get('ORBIT_CONFIG') or default_filename)
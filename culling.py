@@ -0,0 +1,112 @@
+# Camera frustum culling and level of detail
+#
+# Works out on which frames objects are entirely outside the camera's view, from the keyframes of the timeline
+# instead of evaluating the scene, so they can be hidden from rendering there. Objects are bounding spheres,
+# tested against the side planes of the view for all frames and objects at once
+# Objects with lower levels of detail are separate objects per level, of which only the one for the object's
+# distance from the camera is rendered. Both come down to one state per object and frame: the level shown,
+# or the number of levels while culled
+
+import numpy as np
+
+# Objects tested at once are limited to about this many (frame, object) pairs
+chunk_size = 1 << 20
+
+def euler_matrices(angles):
+    # Rotation matrices of XYZ Euler angles (Blender's default order), (frames, 3) -> (frames, 3, 3)
+    cos = np.cos(angles)
+    sin = np.sin(angles)
+    cx, cy, cz = cos.T
+    sx, sy, sz = sin.T
+    return np.stack((
+        np.stack((cy*cz, sx*sy*cz - cx*sz, cx*sy*cz + sx*sz), axis=-1),
+        np.stack((cy*sz, sx*sy*sz + cx*cz, cx*sy*sz - sx*cz), axis=-1),
+        np.stack((-sy, sx*cy, cx*cy), axis=-1),
+    ), axis=-2)
+
+def property_values(tl, target, data_path, frames, rest=np.nan):
+    # (frames, 3) values of a vector property, rest for components that have no keys
+    values = np.full((len(frames), 3), rest, dtype=np.float64)
+    for i in range(3):
+        try:
+            values[:, i] = tl.evaluate(target, data_path, frames, index=i)
+        except KeyError:
+            pass
+    return values
+
+def view_tangents(fov, aspect):
+    # Tangents of half the horizontal and vertical field of view, fov in degrees across the wider side
+    tangent = np.tan(np.radians(fov) / 2)
+    if aspect >= 1:
+        return tangent, tangent / aspect
+    return tangent * aspect, tangent
+
+def outside_view(positions, rotations, centers, radii, tangents):
+    # (frames, objects) whether each bounding sphere is entirely behind the camera or outside a side plane
+    # of the view; the camera looks down its local -z axis with y up, as Blender cameras do
+    # centers are (objects, 3) for objects that don't move or (frames, objects, 3)
+    # Unknown (NaN) positions never count as outside
+    local = np.einsum('fji,fnj->fni', rotations, centers - positions[:, None, :])
+    depth = -local[..., 2]
+    outside = depth < -radii
+    for axis, tangent in enumerate(tangents):
+        # Distance from the plane through the camera at angle atan(tangent) from the view direction
+        outside |= np.abs(local[..., axis]) - tangent * depth > radii * np.sqrt(1 + tangent * tangent)
+    return outside
+
+def lod_levels(distances, thresholds, hysteresis):
+    # (frames, objects) level of detail from (frames, objects) camera distances: level k beyond thresholds[k-1]
+    # An object only goes back to a finer level once hysteresis (a fraction) closer than the threshold, so
+    # it doesn't flicker between levels while its distance hovers around one
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    levels = np.zeros(distances.shape, dtype=np.int64)
+    level = np.zeros(distances.shape[1], dtype=np.int64)
+    # NaN distances (unknown camera) count as close, at full detail
+    coarser = (distances[..., None] > thresholds).sum(axis=-1)
+    finer = (distances[..., None] > thresholds * (1 - hysteresis)).sum(axis=-1)
+    for i in range(len(distances)):
+        level = np.where(coarser[i] > level, coarser[i], np.minimum(level, finer[i]))
+        levels[i] = level
+    return levels
+
+def state_keys(frames, states):
+    # CONSTANT keys of every column of (frames, objects) states where it changes, as (frames, values) arrays,
+    # or None for objects that stay at state 0 (full detail, in view) throughout
+    changes = np.ones(states.shape, dtype=bool)
+    changes[1:] = states[1:] != states[:-1]
+    keys = []
+    for i in range(states.shape[1]):
+        if not states[:, i].any():
+            keys.append(None)
+            continue
+        at = np.flatnonzero(changes[:, i])
+        keys.append((frames[at], states[at, i].astype(np.float64)))
+    return keys
+
+def cull_keys(frames, positions, rotations, centers, radii, fov=None, aspect=1., margin_frames=0,
+              lod_distances=(), hysteresis=0.):
+    # Keys of the state of every object, see state_keys: the level of detail for the camera distance (with
+    # lod_distances of each coarser level), or len(lod_distances) + 1 while culled. Objects are culled while
+    # out of view, unless fov is None, and count as in view for margin_frames before and after any frame they
+    # are in view
+    frames = np.asarray(frames)
+    radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (centers.shape[-2],))
+    keys = []
+    step = max(chunk_size // len(frames), 1)
+    for start in range(0, len(radii), step):
+        chunk = slice(start, start + step)
+        states = np.zeros((len(frames), len(radii[chunk])), dtype=np.int64)
+        if len(lod_distances):
+            distances = np.linalg.norm(centers[..., chunk, :] - positions[:, None, :], axis=-1)
+            states = lod_levels(distances, lod_distances, hysteresis)
+        if fov is not None:
+            outside = outside_view(positions, rotations, centers[..., chunk, :], radii[chunk],
+                                   view_tangents(fov, aspect))
+            # Frames where no frame within margin_frames is in view
+            in_view = np.concatenate((np.zeros((1, outside.shape[1]), dtype=np.int64),
+                                      np.cumsum(~outside, axis=0)))
+            lo = np.maximum(np.arange(len(frames)) - margin_frames, 0)
+            hi = np.minimum(np.arange(len(frames)) + margin_frames + 1, len(frames))
+            states[in_view[hi] == in_view[lo]] = len(lod_distances) + 1
+        keys += state_keys(frames, states)
+    return keys
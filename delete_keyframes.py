@@ -1,7 +1,20 @@
 import bpy
+import os
+import sys
+
+# Make the helper modules next to this script importable
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from keyframes import manifest_property
 
 for obj in bpy.data.objects:
     obj.animation_data_clear()
     
 for lamp in bpy.data.lamps:
-    lamp.animation_data_clear()
\ No newline at end of file
+    lamp.animation_data_clear()
+
+# Clear group visibility and forget what animation.py last wrote so the next run rewrites everything
+for scene in bpy.data.scenes:
+    if manifest_property in scene:
+        del scene[manifest_property]
+    scene.animation_data_clear()
@@ -1,7 +1,12 @@
-import bpy
+import os
+import sys
 
-# delete all pre-existing orbs besides the original
-for obj in bpy.context.scene.objects:
-    obj.select = ( obj.name[:3] == "Orb" or obj.name[:5] == "Glass") and ( obj.name != "Orb" and obj.name != "Glass")
-    
-bpy.ops.object.delete()
\ No newline at end of file
+# Make the helper modules next to this script importable
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cleanup import remove_generated
+from layout import with_lods
+
+# delete all pre-existing orbs besides the original, with their meshes and materials
+# and lower levels of detail
+remove_generated(with_lods(['Orb', 'Glass']), ['OrbMat'])
@@ -1,7 +1,12 @@
-import bpy
+import os
+import sys
 
-# delete all pre-existing rings besides the original
-for obj in bpy.context.scene.objects:
-    obj.select = ( obj.name[:5] == "Torus" ) and ( obj.name != "Torus" )
+# Make the helper modules next to this script importable
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-bpy.ops.object.delete()
\ No newline at end of file
+from cleanup import remove_generated
+from layout import with_lods
+
+# delete all pre-existing rings besides the original, with their meshes and materials
+# and lower levels of detail
+remove_generated(with_lods(['Torus']), ['TorMat'])
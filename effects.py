@@ -0,0 +1,82 @@
+# Vectorized effect generators
+#
+# Effects are computed for all onsets at once as keyframe arrays, ready for Timeline.keys
+
+import numpy as np
+
+from timeline import default_interpolation, evaluate
+
+def decay_values(offsets, base, peak, release, attack):
+    # Values offsets frames after the peak of a lone flash, keyed with the default (Bezier) interpolation
+    flash_frames = [-float(attack), 0., float(release)]
+    flash_values = [float(base), float(peak), float(base)]
+    unique, inverse = np.unique(offsets, return_inverse=True)
+    values = np.array([evaluate(flash_frames, flash_values, [default_interpolation] * 3, offset)
+                       for offset in unique], dtype=np.float64)
+    return values[inverse]
+
+def flash_envelopes(onsets, num_targets, per_onset, base, peak, release, attack=1, seed=0):
+    # Flash per_onset random targets (numbered from 1) at every onset frame
+    # A flash rises from base attack frames before the onset to peak at the onset and falls back to base
+    # release frames later. Flashes on the same target that overlap merge into one envelope: a new flash
+    # starts its attack from wherever the previous one has decayed to instead of overwriting it
+    # Returns {target: (frames, values)} with frames sorted
+    onsets = np.asarray(onsets, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    targets = rng.integers(1, num_targets + 1, size=(len(onsets), per_onset)).ravel()
+    frames = np.repeat(onsets, per_onset)
+    # One flash per target and frame, sorted by target then frame
+    pairs = np.unique(np.column_stack((targets, frames)), axis=0)
+    if len(pairs) == 0:
+        return {}
+    targets = pairs[:, 0].astype(np.int64)
+    frames = pairs[:, 1]
+    same_next = np.zeros(len(frames), dtype=bool)
+    same_next[:-1] = targets[1:] == targets[:-1]
+    next_frames = np.append(frames[1:], np.inf)
+    # The next flash on the same target starts before this one has decayed
+    overlaps = same_next & (next_frames - attack <= frames + release)
+    starts = np.ones(len(frames), dtype=bool)
+    starts[1:] = ~overlaps[:-1]
+    # Where the decay is cut off by the next attack, at the value the flash's own decay has there
+    cut = overlaps & (next_frames - attack > frames)
+    cut_frames = next_frames[cut] - attack
+    cut_values = decay_values(cut_frames - frames[cut], base, peak, release, attack)
+    key_targets = np.concatenate((targets[starts], targets, targets[cut], targets[~overlaps]))
+    key_frames = np.concatenate((frames[starts] - attack, frames, cut_frames, frames[~overlaps] + release))
+    key_values = np.concatenate((np.full(starts.sum(), float(base)), np.full(len(frames), float(peak)),
+                                 cut_values, np.full((~overlaps).sum(), float(base))))
+    order = np.lexsort((key_frames, key_targets))
+    key_targets = key_targets[order]
+    key_frames = key_frames[order]
+    key_values = key_values[order]
+    bounds = np.flatnonzero(np.diff(key_targets)) + 1
+    envelopes = {}
+    for target, target_frames, target_values in zip(key_targets[np.append(0, bounds)],
+                                                   np.split(key_frames, bounds), np.split(key_values, bounds)):
+        envelopes[int(target)] = (target_frames, target_values)
+    return envelopes
+
+def shake_signal(onsets, num_frames, max_disp, components=3, seed=0):
+    # Random displacement of up to max_disp per component for num_frames frames after every onset frame
+    # Each shake is at full strength the frame after its onset and decays to nothing num_frames frames later;
+    # shakes that overlap add up, and the sum is kept within max_disp
+    # Returns (frames, displacements) with one row of components per frame, leaving out the frames inside
+    # runs without any shake
+    onsets = np.rint(np.asarray(onsets, dtype=np.float64)).astype(np.int64)
+    if len(onsets) == 0:
+        return np.zeros(0), np.zeros((0, components))
+    rng = np.random.default_rng(seed)
+    steps = np.arange(num_frames + 1)
+    envelope = np.clip((num_frames - steps) / float(max(num_frames - 1, 1)), 0, 1)
+    envelope[0] = 0
+    noise = rng.uniform(-max_disp, max_disp, size=(len(onsets), num_frames + 1, components)) * envelope[:, None]
+    start = onsets.min()
+    signal = np.zeros((onsets.max() - start + num_frames + 1, components))
+    np.add.at(signal, (onsets - start)[:, None] + steps, noise)
+    np.clip(signal, -max_disp, max_disp, out=signal)
+    moving = signal.any(axis=1)
+    keep = moving.copy()
+    keep[1:] |= moving[:-1]
+    keep[:-1] |= moving[1:]
+    return (np.flatnonzero(keep) + start).astype(np.float64), signal[keep]
@@ -0,0 +1,240 @@
+# Batched F-curve writer
+
+import json
+
+import bpy
+
+import profiler
+
+from timeline import channel_hash, group_properties, lod_property, section_hashes
+
+# Scene custom property recording what apply_timeline last wrote, as JSON:
+# content hashes per channel and section, and the rest value of every channel from before it was first keyed
+manifest_property = 'def_orbit_manifest'
+
+def write_fcurve(datablock, data_path, index, frames, values, interpolations):
+    # Write a whole F-curve in one pass, keeping existing keyframes that aren't overwritten
+    # The timeline already picked the interpolation of every key (see timeline.default_interpolation)
+    anim = datablock.animation_data or datablock.animation_data_create()
+    if anim.action is None:
+        anim.action = bpy.data.actions.new(datablock.name + 'Action')
+    fcurves = anim.action.fcurves
+    keys = {}
+    fcu = fcurves.find(data_path, index)
+    if fcu is not None:
+        points = fcu.keyframe_points
+        co = [0.] * (2 * len(points))
+        points.foreach_get('co', co)
+        for i, point in enumerate(points):
+            keys[co[2*i]] = (co[2*i+1], point.interpolation)
+        fcurves.remove(fcu)
+    for frame, value, interpolation in zip(frames, values, interpolations):
+        keys[float(frame)] = (float(value), interpolation)
+    frames = sorted(keys)
+    fcu = fcurves.new(data_path, index)
+    profiler.count('fcurves')
+    points = fcu.keyframe_points
+    points.add(len(frames))
+    co = []
+    for frame in frames:
+        co.append(frame)
+        co.append(keys[frame][0])
+    points.foreach_set('co', co)
+    # Interpolation is an enum, which foreach_set can't write, so only touch the points that differ
+    # from the default new points get
+    for point, frame in zip(points, frames):
+        interpolation = keys[frame][1]
+        if interpolation != 'BEZIER':
+            point.interpolation = interpolation
+    fcu.update()
+    return fcu
+
+def property_value(datablock, data_path, index):
+    value = datablock.path_resolve(data_path)
+    try:
+        return value[index]
+    except TypeError:
+        return value
+
+def set_property_value(datablock, data_path, index, value):
+    if data_path.startswith('["'):
+        datablock[data_path[2:-2]] = value
+        return
+    prop = getattr(datablock, data_path)
+    try:
+        prop[index] = value
+    except TypeError:
+        setattr(datablock, data_path, value)
+
+def channel_id(channel):
+    # Channels as manifest keys
+    return json.dumps(channel)
+
+def read_manifest(scene):
+    if manifest_property not in scene:
+        return {'channels': {}, 'sections': {}, 'rest': {}}
+    return json.loads(scene[manifest_property])
+
+def resolve(kind, name):
+    # Datablock of a channel; the scene target has no name and is the current scene
+    if kind == 'scenes' and name is None:
+        return bpy.context.scene
+    return getattr(bpy.data, kind).get(name)
+
+def add_driver_variable(driver, name, id_type, datablock, prop):
+    var = driver.variables.new()
+    var.name = name
+    var.type = 'SINGLE_PROP'
+    var.targets[0].id_type = id_type
+    var.targets[0].id = datablock
+    var.targets[0].data_path = '["' + prop + '"]'
+
+def set_driver(obj, data_path, driver_type, variables, lookup=()):
+    # Drive a property of obj with a driver_type driver of variables, (name, id_type, datablock, prop) each,
+    # mapped through lookup: CONSTANT keyframes at 0, 1, 2... in place of the default Generator modifier
+    # A driver that is already set up this way is left alone, any other one is replaced
+    anim = obj.animation_data or obj.animation_data_create()
+    fcu = anim.drivers.find(data_path)
+    if fcu is not None:
+        current = (fcu.driver.type, [(var.name, var.targets[0].id, var.targets[0].data_path)
+                                     for var in fcu.driver.variables], [point.co[1] for point in fcu.keyframe_points])
+        if current == (driver_type, [(name, datablock, '["' + prop + '"]')
+                                     for name, id_type, datablock, prop in variables], list(lookup)):
+            return
+        obj.driver_remove(data_path)
+    fcu = obj.driver_add(data_path)
+    profiler.count('drivers')
+    fcu.driver.type = driver_type
+    for variable in variables:
+        add_driver_variable(fcu.driver, *variable)
+    if lookup:
+        for modifier in list(fcu.modifiers):
+            fcu.modifiers.remove(modifier)
+        fcu.keyframe_points.add(len(lookup))
+        fcu.keyframe_points.foreach_set('co', [c for x, y in enumerate(lookup) for c in (x, y)])
+        for point in fcu.keyframe_points:
+            point.interpolation = 'CONSTANT'
+
+@profiler.profiled('apply')
+def apply_groups(groups, lods=None):
+    # Drive hide and hide_render of every group member from the group's scene property
+    # Members with levels of detail (see Timeline.lod) are also hidden from rendering unless the lod_property
+    # of their object holds their level: hide_render sums the group's 0 or 1 and twice the level, which the
+    # driver's keyframes map to 0 only for (0, their level), as drivers can't run Python expressions here
+    scene = bpy.context.scene
+    levels = {}
+    for name, names in (lods or {}).items():
+        obj = bpy.data.objects[name]
+        if lod_property not in obj:
+            obj[lod_property] = 0
+        for level, members in enumerate(names):
+            for member in members:
+                levels[member] = (obj, level, len(names))
+    for group, names in groups.items():
+        prop = 'hide_' + group
+        if prop not in scene:
+            scene[prop] = 0
+        hide = ('hide', 'SCENE', scene, prop)
+        for name in names:
+            obj = bpy.data.objects[name]
+            for data_path in group_properties:
+                if data_path != 'hide_render' or name not in levels:
+                    set_driver(obj, data_path, 'MAX', [hide])
+                    continue
+                owner, level, count = levels[name]
+                lod = ('lod', 'OBJECT', owner, lod_property)
+                # States up to count, which is culled
+                lookup = [0. if x == 2 * level else 1. for x in range(2 * count + 2)]
+                set_driver(obj, data_path, 'SUM', [hide, lod, ('lod_again',) + lod[1:]], lookup)
+
+def find_fcurve(datablock, data_path, index):
+    anim = datablock.animation_data
+    if anim is None or anim.action is None:
+        return None
+    return anim.action.fcurves.find(data_path, index)
+
+@profiler.profiled('apply')
+def apply_timeline(compiled, incremental=True):
+    # Write a compiled timeline (see timeline.Timeline.compile) into the scene
+    # NaN values take the property's value in the scene before the channel was first keyed
+    # Holds are normally resolved by the timeline; the ones that depend on a NaN value take the value the
+    # scene evaluates to with only the keyframes authored before them, so everything authored before a run
+    # of those is written first
+    # With incremental, channels whose keyframes match what the manifest says was last written are left
+    # alone; changed channels are rewritten whole and channels no longer in the timeline are removed, with
+    # their properties put back to the rest value
+    # Returns the number of channels written
+    scene = bpy.context.scene
+    manifest = read_manifest(scene) if incremental else {'channels': {}, 'sections': {}, 'rest': {}}
+    hashes = {channel_id(channel): channel_hash(keys) for channel, keys in compiled.items()}
+    sections = section_hashes(compiled)
+    rest_values = manifest['rest']
+    for cid in manifest['channels']:
+        if cid not in hashes:
+            kind, name, data_path, index = json.loads(cid)
+            datablock = resolve(kind, name)
+            fcu = datablock and find_fcurve(datablock, data_path, index)
+            if fcu is not None:
+                datablock.animation_data.action.fcurves.remove(fcu)
+            # Without its F-curve the property keeps the last value it was animated to
+            if datablock and cid in rest_values:
+                set_property_value(datablock, data_path, index, rest_values[cid])
+            rest_values.pop(cid, None)
+    datablocks = {}
+    rest = {}
+    for channel in compiled:
+        kind, name, data_path, index = channel
+        cid = channel_id(channel)
+        datablock = resolve(kind, name)
+        if datablock is None:
+            raise KeyError(kind + ' has no ' + repr(name))
+        fcu = find_fcurve(datablock, data_path, index)
+        if fcu is not None and manifest['channels'].get(cid) == hashes[cid]:
+            continue
+        if cid not in rest_values:
+            rest_values[cid] = property_value(datablock, data_path, index)
+        if fcu is not None:
+            datablock.animation_data.action.fcurves.remove(fcu)
+        datablocks[channel] = datablock
+        rest[channel] = rest_values[cid]
+    changed = [name for name in sections if manifest['sections'].get(name) != sections[name]]
+    print('Writing', len(datablocks), 'of', len(compiled), 'channels, changed sections:', ', '.join(changed) or 'none')
+    # Every key of the channels being written in the order it was authored
+    order = sorted((keys.seqs[i], channel, i) for channel, keys in compiled.items() if channel in datablocks
+                   for i in range(len(keys.frames)))
+    pending = {}
+
+    def add(channel, i, value):
+        frames, values, interpolations = pending.setdefault(channel, ([], [], []))
+        frames.append(compiled[channel].frames[i])
+        values.append(value)
+        interpolations.append(compiled[channel].interpolations[i])
+
+    def flush():
+        for channel, (frames, values, interpolations) in pending.items():
+            write_fcurve(datablocks[channel], channel[2], channel[3], frames, values, interpolations)
+        pending.clear()
+
+    pos = 0
+    while pos < len(order):
+        seq, channel, i = order[pos]
+        keys = compiled[channel]
+        if not keys.holds[i]:
+            value = keys.values[i]
+            add(channel, i, rest[channel] if value != value else value)
+            pos += 1
+            continue
+        flush()
+        run = []
+        while pos < len(order) and compiled[order[pos][1]].holds[order[pos][2]]:
+            run.append(order[pos])
+            pos += 1
+        for frame in sorted(set(compiled[channel].frames[i] for seq, channel, i in run)):
+            scene.frame_set(int(frame), subframe=frame - int(frame))
+            profiler.count('evaluations')
+            for seq, channel, i in run:
+                if compiled[channel].frames[i] == frame:
+                    add(channel, i, property_value(datablocks[channel], channel[2], channel[3]))
+    flush()
+    scene[manifest_property] = json.dumps({'channels': hashes, 'sections': sections, 'rest': rest_values})
+    return len(datablocks)
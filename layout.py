@@ -0,0 +1,162 @@
+# Placement and colors of the generated orbs and rings
+#
+# Shared by the generator scripts and animation.py, which needs the colors of instanced orbs to flash them
+# and the names of the objects showing each level of detail
+
+import colorsys
+import itertools
+import random
+
+import numpy as np
+
+# Box the orbs are placed in, (min corner, max corner)
+orb_bounds = ((-20., -20., 0.), (20., 20., 20.))
+
+# Candidates tried around each sample before it stops spawning new ones, and per round of the sampling
+poisson_tries = 30
+poisson_round_tries = 3
+# A fill places about poisson_density samples per separation ** 3 of the box; poisson_disk fills with about
+# poisson_spare times the points it needs
+poisson_density = 0.6
+poisson_spare = 2.
+
+def poisson_disk_fill(lo, hi, separation, rng, tries=poisson_tries, round_tries=poisson_round_tries):
+    # Bridson's Poisson-disk sampling of the box lo - hi, until no more points fit
+    # Every active sample tries a few candidates per round and keeps the first that fits, and retires once
+    # tries candidates in a row didn't, as in the sequential algorithm; candidates are checked against a
+    # grid of cells small enough to hold one sample each, all in NumPy, so the run time is linear in the
+    # samples
+    cell = separation / np.sqrt(3)
+    shape = np.maximum(np.ceil((hi - lo) / cell).astype(np.int64), 1)
+    # Two empty cells around the box on every side, so neighbour lookups never leave the grid
+    padded = shape + 4
+    strides = np.array([padded[1] * padded[2], padded[2], 1])
+    # Coordinates of the sample in each cell and whether there is one, and the coordinates (infinitely far
+    # away where there are none) and order of the new samples of the current round
+    grid = np.zeros((3, np.prod(padded)))
+    occupied = np.zeros(np.prod(padded), dtype=bool)
+    batch = np.full((3, np.prod(padded)), np.inf)
+    rank = np.zeros(np.prod(padded), dtype=np.int64)
+    # Neighbour cells that can hold a sample closer than separation, nearest first so most candidates
+    # are rejected early; a candidate's own cell is free
+    offsets = [o for o in itertools.product(range(-2, 3), repeat=3)
+               if o != (0, 0, 0) and sum(max(abs(d) - 1, 0) ** 2 for d in o) < 3]
+    offsets = np.dot(sorted(offsets, key=lambda o: sum(d * d for d in o)), strides)
+
+    def cell_of(points):
+        return np.dot(np.minimum(((points - lo) / cell).astype(np.int64), shape - 1) + 2, strides)
+
+    def near(table, cells, points):
+        # Whether the cells hold a point closer than separation to each of points
+        return ((table[0, cells] - points[0]) ** 2 + (table[1, cells] - points[1]) ** 2 +
+                (table[2, cells] - points[2]) ** 2) < separation ** 2
+
+    active = (lo + rng.random(3) * (hi - lo))[None]
+    misses = np.zeros(1, dtype=np.int64)
+    grid[:, cell_of(active)] = active.T
+    occupied[cell_of(active)] = True
+    samples = [active]
+    while len(active):
+        # Candidates in the shell between separation and twice that around every active sample
+        directions = rng.normal(size=(len(active) * round_tries, 3))
+        directions /= np.linalg.norm(directions, axis=1)[:, None]
+        radii = separation * (1 + rng.random(len(directions)))
+        parents = np.repeat(np.arange(len(active)), round_tries)
+        candidates = active[parents] + directions * radii[:, None]
+        inside = np.all((candidates >= lo) & (candidates < hi), axis=1)
+        candidates = candidates[inside].T
+        parents = parents[inside]
+        cells = cell_of(candidates.T)
+        # Against the samples so far
+        keep = np.flatnonzero(~occupied[cells])
+        for offset in offsets:
+            neighbours = cells[keep] + offset
+            hit = np.flatnonzero(occupied[neighbours])
+            hit = hit[near(grid, neighbours[hit], candidates[:, keep[hit]])]
+            if len(hit):
+                keep = np.delete(keep, hit)
+        # The first candidate that fits of each active sample, then only the first in each cell
+        keep = keep[np.unique(parents[keep], return_index=True)[1]]
+        keep = np.sort(keep[np.unique(cells[keep], return_index=True)[1]])
+        candidates = candidates[:, keep]
+        parents = parents[keep]
+        cells = cells[keep]
+        # Against the earlier ones of those
+        batch[:, cells] = candidates
+        rank[cells] = np.arange(len(cells))
+        fits = np.ones(len(cells), dtype=bool)
+        for offset in offsets:
+            hit = np.flatnonzero(near(batch, cells + offset, candidates))
+            fits[hit[rank[cells[hit] + offset] < hit]] = False
+        batch[:, cells] = np.inf
+        grid[:, cells[fits]] = candidates[:, fits]
+        occupied[cells[fits]] = True
+        samples.append(candidates[:, fits].T)
+        # Samples that found no room for tries candidates in a row are done
+        found = np.zeros(len(active), dtype=bool)
+        found[parents] = True
+        misses = np.where(found, 0, misses + round_tries)
+        stay = misses < tries
+        active = np.concatenate((active[stay], candidates[:, fits].T))
+        misses = np.concatenate((misses[stay], np.zeros(np.count_nonzero(fits), dtype=np.int64)))
+    return np.concatenate(samples)
+
+def poisson_disk(count, separation, bounds=orb_bounds, seed=0):
+    # count points at least separation apart, spread evenly over the box bounds
+    # A random subset of a Poisson-disk fill, deterministic for a seed. The fill is only as dense as count
+    # needs, so the cost grows with count rather than with the volume over separation ** 3; if count points
+    # don't fit at separation it is reduced until they do
+    lo, hi = np.array(bounds, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    spacing = max(separation, (poisson_density * np.prod(hi - lo) / (poisson_spare * count)) ** (1 / 3.))
+    while True:
+        points = poisson_disk_fill(lo, hi, spacing, rng)
+        if len(points) >= count:
+            return points[rng.choice(len(points), count, replace=False)]
+        reduced = spacing * 0.95 * (len(points) / float(count)) ** (1 / 3.)
+        if reduced < separation:
+            print('Only', len(points), 'orbs fit, reducing the separation to', reduced)
+        spacing = max(reduced, min(separation, spacing))
+
+def orb_colors(numorb, seed=0):
+    # Colors of Orb1 - Orb[numorb]
+    rand = random.Random(seed)
+    return [colorsys.hsv_to_rgb(rand.random(), 1.0, 0.735) for i in range(numorb)]
+
+def orb_layout(numorb, separation, seed=0):
+    # Positions and colors of Orb1 - Orb[numorb], at least separation apart so orbs and glass shells don't
+    # intersect
+    positions = [tuple(p) for p in poisson_disk(numorb, separation, orb_bounds, seed).tolist()]
+    return positions, orb_colors(numorb, seed)
+
+# Levels of detail of an object at most, including the object itself
+max_lod_levels = 3
+
+def lod_ratios(config):
+    # Decimate ratios of the lower levels of detail in [lod], finest first
+    ratios = [float(ratio) for ratio in config.get('lod', 'ratios').split()]
+    if len(ratios) >= max_lod_levels:
+        raise ValueError('at most ' + str(max_lod_levels - 1) + ' lower levels of detail')
+    return ratios
+
+def lod_prefix(prefix, level):
+    # Objects showing level of detail level of prefix1 - prefix[n] are named lod_prefix(prefix, level) + i
+    return prefix + 'Lod' + str(level) + '.'
+
+def with_lods(prefixes):
+    # Name prefixes of generated objects followed by those of all their lower levels of detail
+    return list(prefixes) + [lod_prefix(prefix, level) for level in range(1, max_lod_levels) for prefix in prefixes]
+
+def lod_names(prefix, count, levels=1):
+    # Names of prefix1 - prefix[count] followed by those of their lower levels of detail, level by level
+    names = [prefix + str(i) for i in range(1, count+1)]
+    for level in range(1, levels):
+        names += [lod_prefix(prefix, level) + str(i) for i in range(1, count+1)]
+    return names
+
+# Distance between consecutive rings of the tunnel
+ring_spacing = 20
+
+def torus_colors(numtor):
+    # Colors of Torus1 - Torus[numtor], once around the hue circle
+    return [colorsys.hsv_to_rgb(float(i) / float(numtor), 1.0, 0.735) for i in range(numtor)]
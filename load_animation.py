@@ -0,0 +1,30 @@
+# Animation loader script
+#
+# Writes a compiled animation saved by animation.py (see [export] in orbit.ini) into the scene, without
+# running any of the keyframe logic, so the scene can be animated on machines that never ran animation.py
+# Usage: blender def_orbit.blend --python load_animation.py [-- animation.npz]
+# Without a file name the one in [export] is loaded
+
+import os
+import sys
+
+import bpy
+
+# Make the helper modules next to this script importable
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import read_config
+from keyframes import apply_groups, apply_timeline
+from timeline import load_compiled
+
+args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+filename = args[0] if args else read_config().path('export', 'compiled')
+compiled, groups, lods = load_compiled(filename)
+print('Loaded', sum(len(keys.frames) for keys in compiled.values()), 'keyframes on', len(compiled),
+      'channels from', filename)
+
+# Deselect everything
+for obj in bpy.data.objects:
+    obj.select = False
+apply_groups(groups, lods)
+apply_timeline(compiled)
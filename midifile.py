@@ -0,0 +1,211 @@
+# Standard MIDI file reader
+
+import mmap
+
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+# Note columns are sorted by tick across all tracks
+# on is False for note off events and for note on events with zero velocity
+# tempos are in microseconds per beat, time signature denominators are note values (4 for x/4)
+MidiData = namedtuple('MidiData', [
+    'resolution',
+    'ticks', 'notes', 'velocities', 'channels', 'on',
+    'tempo_ticks', 'tempos',
+    'timesig_ticks', 'numerators', 'denominators',
+])
+
+# Initial number of bytes examined at a time for runs of note events
+run_window = 1024
+
+def decode_note_run(data, status):
+    # Decode the run of note on/off events at the start of data without a per-event loop
+    # Returns the decoded columns and the number of bytes they used; status is the running status before the run
+    # Every note event has exactly three bytes below 0x80: the last delta byte, the note and the velocity,
+    # so events can be split by position; high bytes before the last delta byte continue the delta,
+    # a high byte right after it is the status byte
+    low = np.flatnonzero(data < 0x80)
+    count = len(low) // 3
+    delta_end = low[0:3*count:3]
+    note_pos = low[1:3*count:3]
+    velocity_pos = low[2:3*count:3]
+    starts = np.zeros_like(delta_end)
+    starts[1:] = velocity_pos[:-1] + 1
+    status_bytes = data[np.minimum(delta_end + 1, len(data) - 1)]
+    has_status = note_pos - delta_end == 2
+    # The run ends at the first event that isn't a note event, e.g. a meta event or a controller change
+    valid = ((delta_end - starts <= 3) & (velocity_pos - note_pos == 1) &
+             ((note_pos - delta_end == 1) | (has_status & (status_bytes & 0xe0 == 0x80))))
+    if count and not has_status[0] and status & 0xe0 != 0x80:
+        valid[0] = False
+    invalid = np.flatnonzero(~valid)
+    if len(invalid):
+        count = invalid[0]
+    if count == 0:
+        return None
+    delta_end = delta_end[:count]
+    starts = starts[:count]
+    note_pos = note_pos[:count]
+    has_status = has_status[:count]
+    deltas = (data[delta_end] & 0x7f).astype(np.int64)
+    for j in range(1, 4):
+        more = delta_end - starts >= j
+        deltas[more] |= (data[delta_end[more] - j] & 0x7f).astype(np.int64) << (7 * j)
+    # Forward fill explicit status bytes to resolve running status
+    last_status = np.where(has_status, np.arange(count), -1)
+    np.maximum.accumulate(last_status, out=last_status)
+    statuses = np.where(last_status >= 0, status_bytes[:count][last_status], status).astype(np.int32)
+    return deltas, statuses, data[note_pos].astype(np.int32), data[note_pos + 1].astype(np.int32), int(note_pos[-1] + 2)
+
+def decode_track(track):
+    # Decode one MTrk chunk in a single pass
+    # Returns per-event delta ticks and, for the events we keep, their event index and payload
+    deltas = array('q')
+    note_events = array('q')
+    note_data = array('i')  # status, note, velocity per note event
+    tempo_events = array('q')
+    tempos = array('q')
+    timesig_events = array('q')
+    timesig_data = array('i')  # numerator, denominator per time signature event
+    track_data = np.frombuffer(track, dtype=np.uint8)
+    n = len(track)
+    i = 0
+    status = 0
+    event = 0
+    window = run_window
+    while i < n:
+        # Note events make up almost all of a typical file, decode runs of them in bulk
+        # The window grows while runs fill it and shrinks back when a run is interrupted
+        run = decode_note_run(track_data[i:i+window], status)
+        if run is not None:
+            run_deltas, run_statuses, run_notes, run_velocities, used = run
+            count = len(run_deltas)
+            deltas.frombytes(run_deltas.tobytes())
+            note_events.frombytes(np.arange(event, event + count, dtype=np.int64).tobytes())
+            note_data.frombytes(np.column_stack((run_statuses, run_notes, run_velocities)).tobytes())
+            status = int(run_statuses[-1])
+            event += count
+            i += used
+            window = window * 2 if used > window - 8 else run_window
+            continue
+        # Variable-length delta time
+        b = track[i]
+        i += 1
+        delta = b & 0x7f
+        while b & 0x80:
+            b = track[i]
+            i += 1
+            delta = (delta << 7) | (b & 0x7f)
+        deltas.append(delta)
+        b = track[i]
+        if b == 0xff:
+            # Meta event: type, length, data
+            meta_type = track[i+1]
+            i += 2
+            b = track[i]
+            i += 1
+            length = b & 0x7f
+            while b & 0x80:
+                b = track[i]
+                i += 1
+                length = (length << 7) | (b & 0x7f)
+            if meta_type == 0x51:
+                tempo_events.append(event)
+                tempos.append((track[i] << 16) | (track[i+1] << 8) | track[i+2])
+            elif meta_type == 0x58:
+                timesig_events.append(event)
+                timesig_data.append(track[i])
+                timesig_data.append(1 << track[i+1])
+            elif meta_type == 0x2f:
+                break
+            i += length
+        elif b == 0xf0 or b == 0xf7:
+            # Sysex event: length, data
+            i += 1
+            b = track[i]
+            i += 1
+            length = b & 0x7f
+            while b & 0x80:
+                b = track[i]
+                i += 1
+                length = (length << 7) | (b & 0x7f)
+            i += length
+        else:
+            # Channel event, possibly using running status
+            if b & 0x80:
+                status = b
+                i += 1
+            elif status == 0:
+                raise ValueError('data byte without running status at offset ' + str(i))
+            kind = status & 0xf0
+            if kind == 0x90 or kind == 0x80:
+                note_events.append(event)
+                note_data.append(status)
+                note_data.append(track[i])
+                note_data.append(track[i+1])
+                i += 2
+            elif kind == 0xc0 or kind == 0xd0:
+                i += 1
+            else:
+                i += 2
+        event += 1
+    return deltas, note_events, note_data, tempo_events, tempos, timesig_events, timesig_data
+
+def read_midi(filename):
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[0:4] != b'MThd':
+            raise ValueError(filename + ' is not a standard MIDI file')
+        header_len = int.from_bytes(mm[4:8], 'big')
+        ntracks = int.from_bytes(mm[10:12], 'big')
+        division = int.from_bytes(mm[12:14], 'big')
+        if division & 0x8000:
+            raise ValueError(filename + ' uses SMPTE time division, only ticks per beat is supported')
+        pos = 8 + header_len
+        columns = {name: [] for name in ('ticks', 'note_data', 'tempo_ticks', 'tempos',
+                                         'timesig_ticks', 'timesig_data')}
+        for track_num in range(ntracks):
+            # Skip any non-track chunks
+            while mm[pos:pos+4] != b'MTrk':
+                pos += 8 + int.from_bytes(mm[pos+4:pos+8], 'big')
+            length = int.from_bytes(mm[pos+4:pos+8], 'big')
+            (deltas, note_events, note_data, tempo_events, tempos,
+             timesig_events, timesig_data) = decode_track(mm[pos+8:pos+8+length])
+            pos += 8 + length
+            # Absolute ticks for every event in the track at once
+            ticks = np.cumsum(np.frombuffer(deltas, dtype=np.int64))
+            columns['ticks'].append(ticks[np.frombuffer(note_events, dtype=np.int64)])
+            columns['note_data'].append(np.frombuffer(note_data, dtype=np.int32).reshape(-1, 3))
+            columns['tempo_ticks'].append(ticks[np.frombuffer(tempo_events, dtype=np.int64)])
+            columns['tempos'].append(np.frombuffer(tempos, dtype=np.int64))
+            columns['timesig_ticks'].append(ticks[np.frombuffer(timesig_events, dtype=np.int64)])
+            columns['timesig_data'].append(np.frombuffer(timesig_data, dtype=np.int32).reshape(-1, 2))
+    if ntracks == 0:
+        return MidiData(division, *[np.zeros(0, dtype=np.int64)] * 10)
+    # Merge tracks, keeping track order for events on the same tick
+    ticks = np.concatenate(columns['ticks'])
+    order = np.argsort(ticks, kind='stable')
+    ticks = ticks[order]
+    note_data = np.concatenate(columns['note_data'])[order]
+    tempo_ticks = np.concatenate(columns['tempo_ticks'])
+    order = np.argsort(tempo_ticks, kind='stable')
+    tempo_ticks = tempo_ticks[order]
+    tempos = np.concatenate(columns['tempos'])[order]
+    timesig_ticks = np.concatenate(columns['timesig_ticks'])
+    order = np.argsort(timesig_ticks, kind='stable')
+    timesig_ticks = timesig_ticks[order]
+    timesig_data = np.concatenate(columns['timesig_data'])[order]
+    return MidiData(
+        resolution=division,
+        ticks=ticks,
+        notes=note_data[:, 1],
+        velocities=note_data[:, 2],
+        channels=note_data[:, 0] & 0x0f,
+        on=((note_data[:, 0] & 0xf0) == 0x90) & (note_data[:, 2] > 0),
+        tempo_ticks=tempo_ticks,
+        tempos=tempos,
+        timesig_ticks=timesig_ticks,
+        numerators=timesig_data[:, 0],
+        denominators=timesig_data[:, 1],
+    )
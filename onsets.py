@@ -0,0 +1,258 @@
+# Onset reader for standard MIDI files, mididump text files and WAV audio
+
+import hashlib
+import os
+import re
+import threading
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import audio
+import profiler
+
+from midifile import read_midi
+from tempo import TempoMap
+
+# Files are assumed to have been output by mididump.py from vishnubob's python-midi project
+# python-midi last pull time: Thu Oct 9 13:58:37 2014
+#  midi.Pattern(format=1, resolution=220, tracks=\
+#  midi.NoteOnEvent(tick=0, channel=9, data=[36, 100]),
+pattern_re = re.compile(r'midi\.Pattern\(.*?resolution=(\d+)')
+note_re = re.compile(r'midi\.Note(On|Off)Event\(tick=(\d+), channel=\d+, data=\[(\d+)')
+
+# Parsed files are cached next to the source files, keyed by path, mtime and note filter
+cache_dirname = '.onset_cache'
+# Bump when the cached layout or the detection changes so stale caches are ignored
+cache_version = 2
+
+# Tracks read so far in this session, see read_track
+memo = {}
+memo_lock = threading.Lock()
+
+# Used when no tempo map is given, same as the constant 120 bpm at 25 fps assumed by beat_to_frame
+default_tempo_map = TempoMap.constant(120, 25)
+
+@profiler.profiled('onsets')
+def parse_mididump(filename, filter_midi_notes=()):
+    # Returns (resolution, ticks, notes) for note on events, ticks counted from the start of the file
+    ticks = array('q')
+    notes = array('i')
+    res = None
+    ticks_elapsed = 0
+    with open(filename) as f:
+        for line in f:
+            match = note_re.search(line)
+            if match is None:
+                if res is None:
+                    match = pattern_re.search(line)
+                    if match is not None:
+                        res = int(match.group(1))
+                continue
+            # Off events and filtered notes still advance the tick count
+            ticks_elapsed += int(match.group(2))
+            note = int(match.group(3))
+            if filter_midi_notes and note not in filter_midi_notes:
+                continue
+            if match.group(1) == 'On':
+                ticks.append(ticks_elapsed)
+                notes.append(note)
+    if res is None:
+        raise ValueError('no midi.Pattern header in ' + filename)
+    return res, np.frombuffer(ticks, dtype=np.int64), np.frombuffer(notes, dtype=np.int32)
+
+@profiler.profiled('onsets')
+def parse_midi(filename, filter_midi_notes=()):
+    # Same result as parse_mididump, read directly from a .mid file
+    data = read_midi(filename)
+    keep = data.on
+    if filter_midi_notes:
+        keep = keep & np.isin(data.notes, list(filter_midi_notes))
+    return data.resolution, data.ticks[keep], data.notes[keep].astype(np.int32)
+
+def is_midi(filename):
+    return os.path.splitext(filename)[1].lower() in ('.mid', '.midi')
+
+def is_audio(filename):
+    return os.path.splitext(filename)[1].lower() in ('.wav', '.wave')
+
+def cache_path(filename, filter_midi_notes=(), settings=()):
+    # settings are anything else the cached result depends on
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    key = repr((cache_version, path, st.st_mtime_ns, st.st_size, sorted(filter_midi_notes), settings))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    cache_dir = os.path.join(os.path.dirname(path), cache_dirname)
+    return os.path.join(cache_dir, os.path.basename(path) + '.' + digest + '.npz')
+
+@profiler.profiled('onsets')
+def read_onsets(filename, filter_midi_notes=()):
+    # Cached parse_midi or parse_mididump, depending on the file extension
+    cached = cache_path(filename, filter_midi_notes)
+    if os.path.exists(cached):
+        with np.load(cached) as data:
+            return int(data['res']), data['ticks'], data['notes']
+    parse = parse_midi if is_midi(filename) else parse_mididump
+    res, ticks, notes = parse(filename, filter_midi_notes)
+    write_cache(cached, res=res, ticks=ticks, notes=notes)
+    return res, ticks, notes
+
+@profiler.profiled('onsets')
+def read_audio_onsets(filename):
+    # Cached audio.detect_onsets, (seconds, notes)
+    settings = (audio.window_size, audio.hop_size, audio.compression, audio.threshold, audio.peak_window,
+                audio.mean_window, audio.floor_deviations, audio.min_gap)
+    cached = cache_path(filename, settings=settings)
+    if os.path.exists(cached):
+        with np.load(cached) as data:
+            return data['seconds'], data['notes']
+    seconds, notes = audio.detect_onsets(filename)
+    write_cache(cached, seconds=seconds, notes=notes)
+    return seconds, notes
+
+def write_cache(cached, **arrays):
+    try:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        # Write to a temporary name first so an interrupted run can't leave a truncated cache
+        tmp = cached + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, cached)
+    except OSError:
+        # Read-only project folders just don't get a cache
+        pass
+
+def ticks_to_frames(ticks, res, tempo_map=None, start_bar=1):
+    # Onset frames counted from 1 at start_bar, rounded to whole frames
+    # With a constant tempo this is beat_to_frame((ticks / res) + 1) for any start_bar
+    if tempo_map is None:
+        tempo_map = default_tempo_map
+    if start_bar == 1 or tempo_map.is_constant():
+        return tempo_map.beats_to_frames(ticks / res + 1, snap=True)
+    start_beat = tempo_map.bars_to_beats(start_bar)
+    frames = tempo_map.beats_to_frames(start_beat + ticks / res) - tempo_map.bars_to_frames(start_bar) + 1
+    return np.rint(frames).astype(np.int64)
+
+def read_track(filename, filter_midi_notes=()):
+    # read_audio_onsets or read_onsets, memoized for the session by path, modification time and note filter,
+    # so a track used by several effects is read once and edited files are read again
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    audio_file = is_audio(path)
+    key = (path, st.st_mtime_ns, st.st_size, () if audio_file else tuple(sorted(filter_midi_notes)))
+    with memo_lock:
+        if key in memo:
+            return memo[key]
+    result = read_audio_onsets(path) if audio_file else read_onsets(path, filter_midi_notes)
+    with memo_lock:
+        memo[key] = result
+    return result
+
+def load_tracks(tracks, workers=None):
+    # Read a list of (filename, filter_midi_notes) tracks on a thread pool into the memo of read_track
+    # Reading mostly waits on the disk or releases the GIL in NumPy, so the total is about the time of the
+    # slowest file instead of the sum; threads also work inside Blender, where process pools don't
+    unique = {}
+    for filename, filter_midi_notes in tracks:
+        unique.setdefault((os.path.abspath(filename), tuple(sorted(filter_midi_notes))), (filename, filter_midi_notes))
+    if not unique:
+        return
+    with ThreadPoolExecutor(max_workers=workers or min(len(unique), 16)) as pool:
+        # Raises the first error, like reading the files one by one would
+        for result in pool.map(lambda track: read_track(*track), unique.values()):
+            pass
+
+def seconds_to_frames(seconds, tempo_map=None):
+    # Onset frames counted from 1 at the start of an audio file, rounded to whole frames
+    # Audio is in real time, so only the frame rate of tempo_map matters
+    if tempo_map is None:
+        tempo_map = default_tempo_map
+    return np.rint(np.asarray(seconds) * tempo_map.framerate).astype(np.int64) + 1
+
+def read_onset_frames(filename, filter_midi_notes=(), tempo_map=None, start_bar=1):
+    # (frames, notes) of a MIDI, mididump or WAV file
+    # Audio has no note numbers to filter by, so the filter is ignored and notes are estimated pitches
+    if is_audio(filename):
+        seconds, notes = read_track(filename)
+        return seconds_to_frames(seconds, tempo_map), notes
+    res, ticks, notes = read_track(filename, filter_midi_notes)
+    return ticks_to_frames(ticks, res, tempo_map, start_bar), notes
+
+def note_onset_frames_from_file(filename, filter_midi_notes=(), tempo_map=None, start_bar=1):
+    # Onset frames of note on events, optionally filtered by MIDI note number
+    # start_bar places the file's first tick on a bar of tempo_map so tempo changes in the song are followed;
+    # WAV files start at start_bar too
+    return read_onset_frames(filename, filter_midi_notes, tempo_map, start_bar)[0]
+
+def note_onsets_from_file(filename, filter_midi_notes=(), tempo_map=None, start_bar=1):
+    # Rows of (frame, note) for note on events, optionally filtered by MIDI note number
+    return np.column_stack(read_onset_frames(filename, filter_midi_notes, tempo_map, start_bar))
+
+class OnsetIndex:
+    # Sorted onset frames of one track on the song's timeline, for range and neighbour queries
+    # frames are the track's onset frames plus the frame of start_bar, like bar_to_frame(start_bar) + onset
+
+    def __init__(self, frames, notes=None, tempo_map=None):
+        frames = np.asarray(frames)
+        notes = np.zeros(len(frames), dtype=np.int32) if notes is None else np.asarray(notes)
+        order = np.argsort(frames, kind='stable')
+        self.frames = frames[order]
+        self.notes = notes[order]
+        self.tempo_map = tempo_map if tempo_map is not None else default_tempo_map
+        # Frames to the next onset, inf after the last one
+        self.next_intervals = np.append(np.diff(self.frames), np.inf)
+        # note -> positions of that note's onsets
+        self.postings = {}
+        for note in np.unique(self.notes):
+            self.postings[int(note)] = np.flatnonzero(self.notes == note)
+
+    @classmethod
+    def from_file(cls, filename, filter_midi_notes=(), tempo_map=None, start_bar=1):
+        if tempo_map is None:
+            tempo_map = default_tempo_map
+        frames, notes = read_onset_frames(filename, filter_midi_notes, tempo_map, start_bar)
+        return cls(tempo_map.bars_to_frames(start_bar) + frames, notes, tempo_map)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def span(self, start=None, end=None):
+        # Positions of the onsets from frame start up to but not including frame end, as a slice
+        lo = 0 if start is None else int(np.searchsorted(self.frames, start, side='left'))
+        hi = len(self.frames) if end is None else int(np.searchsorted(self.frames, end, side='left'))
+        return slice(lo, max(lo, hi))
+
+    def between(self, start=None, end=None):
+        # Onset frames from frame start up to but not including frame end
+        return self.frames[self.span(start, end)]
+
+    def in_beats(self, start=None, end=None):
+        to_frames = self.tempo_map.beats_to_frames
+        return self.between(None if start is None else to_frames(start), None if end is None else to_frames(end))
+
+    def in_bars(self, start=None, end=None):
+        to_frames = self.tempo_map.bars_to_frames
+        return self.between(None if start is None else to_frames(start), None if end is None else to_frames(end))
+
+    def nearest(self, frame):
+        # Position of the onset closest to frame, the earlier one on a tie; None without onsets
+        if not len(self.frames):
+            return None
+        i = int(np.searchsorted(self.frames, frame))
+        if i == len(self.frames) or (i > 0 and frame - self.frames[i-1] <= self.frames[i] - frame):
+            return i - 1
+        return i
+
+    def next_after(self, frame):
+        # Position of the first onset after frame, or None
+        i = int(np.searchsorted(self.frames, frame, side='right'))
+        return i if i < len(self.frames) else None
+
+    def note(self, note):
+        # Onsets of one MIDI note as an index of their own
+        positions = self.postings.get(note, np.zeros(0, dtype=np.int64))
+        return OnsetIndex(self.frames[positions], self.notes[positions], self.tempo_map)
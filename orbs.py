@@ -1,49 +1,72 @@
 import bpy
 from mathutils import Vector
-from mathutils import Color
+import os
+import sys
 import time
-import random
 
-def duplicateObject(scene, name, copyobj):
- 
-    # Create new mesh
-    mesh = bpy.data.meshes.new(name)
- 
-    # Create new object associated with the mesh
-    ob_new = bpy.data.objects.new(name, mesh)
- 
-    # Copy data block from the old object into the new object
-    ob_new.data = copyobj.data.copy()
-    ob_new.scale = copyobj.scale
-    ob_new.location = copyobj.location
-    
-    # Link new object to the given scene and select it
-    scene.objects.link(ob_new)
-    ob_new.select = True
- 
-    return ob_new
+# Make the helper modules next to this script importable
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# delete all pre-existing orbs besides the original
-for obj in bpy.context.scene.objects:
-    obj.select = ( obj.name[:3] == "Orb" or obj.name[:5] == "Glass") and ( obj.name != "Orb" and obj.name != "Glass")
-    bpy.ops.object.delete()
+from cleanup import (decimatedMesh, duplicateObject, instanceObject, lodObject, objectColorMaterial,
+                     objectMaterial, remove_generated)
+from config import read_config
+from layout import lod_prefix, lod_ratios, orb_layout, with_lods
+
+config = read_config()
+# Instanced orbs all link the original meshes and share one material colored by each orb's object color,
+# instead of copying the meshes and making a material per orb
+instanced = config.getboolean('scene', 'instanced')
+
+# delete all pre-existing orbs besides the original, with their meshes and materials, and their lower levels
+# of detail
+remove_generated(with_lods(['Orb', 'Glass']), ['OrbMat'])
 
 orb = bpy.data.objects['Orb']
 glass = bpy.data.objects['Glass']
 scene = bpy.data.scenes['Scene']
-c = Color()
-numorb = 150
-random.seed(0)
-for i in range(1, numorb+1):
-    name = 'Orb' + str(i)
-    glassname = 'Glass' + str(i)
-    neworb = duplicateObject(scene, name, orb)
-    neworb.location = Vector((-20+40*random.random(), -20+40*random.random(), 20*random.random()))
-    newglass = duplicateObject(scene, glassname, glass)
-    newglass.location = neworb.location
-    matname = 'OrbMat' + str(i)
-    newmat = bpy.data.materials.new(matname)
-    c.hsv = random.random(), 1.0, 0.735
-    newmat.diffuse_color = c.r, c.g, c.b
-    newmat.emit = 0.
-    neworb.active_material = newmat
+numorb = config.getint('scene', 'numorb')
+positions, colors = orb_layout(numorb, config.getfloat('scene', 'orb_separation'), seed=0)
+# Every orb and glass shell also gets an object per lower level of detail, all showing one decimated mesh
+# per level; animation.py only renders the one for the orb's distance from the camera
+ratios = lod_ratios(config)
+orb_lods = [decimatedMesh(scene, orb, ratio, 'OrbLod' + str(level)) for level, ratio in enumerate(ratios, 1)]
+glass_lods = [decimatedMesh(scene, glass, ratio, 'GlassLod' + str(level)) for level, ratio in enumerate(ratios, 1)]
+if instanced:
+    # The mesh is shared with the original Orb, so the copies get the material through their own slot
+    colormat = objectColorMaterial('OrbMat', 0.)
+    new_objects = []
+    for i in range(1, numorb+1):
+        neworb = instanceObject('Orb' + str(i), orb)
+        neworb.location = Vector(positions[i-1])
+        neworb.color = colors[i-1] + (1.,)
+        objectMaterial(neworb, colormat)
+        newglass = instanceObject('Glass' + str(i), glass)
+        newglass.location = neworb.location
+        new_objects.append(neworb)
+        new_objects.append(newglass)
+        for level in range(1, len(ratios)+1):
+            lodorb = lodObject(lod_prefix('Orb', level) + str(i), neworb, orb_lods[level-1])
+            objectMaterial(lodorb, colormat)
+            new_objects.append(lodorb)
+            new_objects.append(lodObject(lod_prefix('Glass', level) + str(i), newglass, glass_lods[level-1]))
+    # Link everything at once at the end, nothing needs selecting
+    for obj in new_objects:
+        scene.objects.link(obj)
+else:
+    for i in range(1, numorb+1):
+        name = 'Orb' + str(i)
+        glassname = 'Glass' + str(i)
+        neworb = duplicateObject(scene, name, orb)
+        neworb.location = Vector(positions[i-1])
+        newglass = duplicateObject(scene, glassname, glass)
+        newglass.location = neworb.location
+        matname = 'OrbMat' + str(i)
+        newmat = bpy.data.materials.new(matname)
+        newmat.diffuse_color = colors[i-1]
+        newmat.emit = 0.
+        neworb.active_material = newmat
+        for level in range(1, len(ratios)+1):
+            lodorb = lodObject(lod_prefix('Orb', level) + str(i), neworb, orb_lods[level-1])
+            objectMaterial(lodorb, newmat)
+            scene.objects.link(lodorb)
+            scene.objects.link(lodObject(lod_prefix('Glass', level) + str(i), newglass, glass_lods[level-1]))
@@ -0,0 +1,144 @@
+# Opt-in profiler for generating the piece
+#
+# Records wall time, keyframes authored per datablock and data path, F-curves created, drivers added and
+# scene evaluations (frame_set) for every timeline section and every profiled helper call. Reports go to
+# a summary table and to a Chrome trace-event file (open it in chrome://tracing or Perfetto)
+# Nothing is recorded until enable() is called, and the hooks cost one check each until then
+
+import functools
+import json
+import threading
+import time
+
+from collections import Counter
+
+# Totals every span reports, in this order
+counter_names = ('keyframes', 'fcurves', 'drivers', 'evaluations')
+
+# The running profile, or None
+active = None
+
+class Profile:
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        # (name, category, start, end, {counter: count}, thread) of finished spans, times in seconds from origin
+        # Threads are numbered from 1 in the order they first begin a span
+        self.spans = []
+        # Open spans per thread: [name, category, start, counters at start]
+        self.stacks = {}
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.section = None
+        self.counters = Counter()
+        # (datablock, data_path) -> keyframes authored
+        self.keyframes = Counter()
+
+    def now(self):
+        return time.perf_counter() - self.origin
+
+    def stack(self):
+        # Open spans of the calling thread
+        ident = threading.get_ident()
+        if ident not in self.stacks:
+            with self.lock:
+                self.threads[ident] = len(self.threads) + 1
+                self.stacks[ident] = []
+        return self.stacks[ident]
+
+    def begin(self, name, category):
+        span = [name, category, self.now(), dict((name, self.counters[name]) for name in counter_names)]
+        self.stack().append(span)
+        return span
+
+    def end(self, span):
+        # Spans end in reverse order of beginning; anything still open inside span ends with it
+        stack = self.stack()
+        thread = self.threads[threading.get_ident()]
+        while stack:
+            top = stack.pop()
+            counts = dict((name, self.counters[name] - top[3][name]) for name in counter_names)
+            self.spans.append((top[0], top[1], top[2], self.now(), counts, thread))
+            if top is span:
+                break
+
+    def begin_section(self, name):
+        self.end_section()
+        self.section = self.begin(name, 'section')
+
+    def end_section(self):
+        if self.section is not None and self.section in self.stack():
+            self.end(self.section)
+        self.section = None
+
+def enable():
+    global active
+    active = Profile()
+    return active
+
+def count(counter, n=1):
+    if active is not None:
+        active.counters[counter] += n
+
+def count_keyframe(datablock, data_path):
+    if active is not None:
+        active.counters['keyframes'] += 1
+        active.keyframes[(datablock, data_path)] += 1
+
+def section(name):
+    # Timeline sections, each runs until the next one starts or end_section is called
+    if active is not None:
+        active.begin_section(name)
+
+def end_section():
+    if active is not None:
+        active.end_section()
+
+def profiled(category):
+    # Decorator recording each call of a function as a span of category
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if active is None:
+                return func(*args, **kwargs)
+            span = active.begin(func.__name__, category)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                active.end(span)
+        return wrapper
+    return decorate
+
+def report(top=10):
+    # Summary table per section and helper (times include nested calls), then the most keyed properties
+    profile = active
+    profile.end_section()
+    rows = {}
+    for name, category, start, end, counts, thread in profile.spans:
+        row = rows.setdefault((category, name), [0, 0.] + [0] * len(counter_names))
+        row[0] += 1
+        row[1] += end - start
+        for i, counter in enumerate(counter_names):
+            row[2+i] += counts[counter]
+    header = '%-10s %-32s %7s %10s' % ('category', 'name', 'calls', 'time (ms)')
+    header += ''.join(' %11s' % counter for counter in counter_names)
+    lines = [header]
+    for (category, name), row in sorted(rows.items(), key=lambda item: -item[1][1]):
+        line = '%-10s %-32s %7d %10.1f' % (category, name, row[0], row[1] * 1000)
+        lines.append(line + ''.join(' %11d' % value for value in row[2:]))
+    lines.append('')
+    lines.append('%-60s %11s' % ('datablock / data_path', 'keyframes'))
+    for (datablock, data_path), keys in profile.keyframes.most_common(top):
+        lines.append('%-60s %11d' % (datablock + ' / ' + data_path, keys))
+    return '\n'.join(lines)
+
+def write_trace(filename):
+    # Chrome trace-event JSON with one complete event per span, on one track per thread
+    profile = active
+    profile.end_section()
+    events = []
+    for name, category, start, end, counts, thread in sorted(profile.spans, key=lambda span: (span[2], -span[3])):
+        events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': 1, 'tid': thread,
+                       'ts': start * 1e6, 'dur': (end - start) * 1e6, 'args': counts})
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
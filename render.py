@@ -0,0 +1,158 @@
+# Headless parallel render driver
+#
+# Generates the animation here without Blender and saves it compiled, writes that into a copy of the scene
+# once with load_animation.py in blender --background, then renders the frame range in chunks on a pool of
+# local Blender processes. Chunks never cross an act boundary, failed chunks are rerun for their missing
+# frames and frames already on disk are skipped, so rerunning after an interruption resumes the render
+# Frames whose animated state is identical to an earlier frame, e.g. held shots, are rendered once and
+# hard linked (or copied) for the rest; only what the timeline animates is compared, so anything else
+# that changes over time in the scene needs --no-dedupe
+#
+# Usage: python render.py [--config orbit.ini] [--workers N] [--no-dedupe] [--dry-run]
+
+import argparse
+import os
+import re
+import runpy
+import shutil
+import subprocess
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import read_config
+from timeline import frame_sources, save_compiled
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# File extensions Blender gives each output format
+extensions = {'PNG': '.png', 'JPEG': '.jpg', 'BMP': '.bmp', 'TIFF': '.tif', 'OPEN_EXR': '.exr', 'TARGA': '.tga'}
+
+# Renders a list of frames in Blender, each to the output name followed by the frame number
+render_script = '''import bpy
+scene = bpy.context.scene
+for frame in %r:
+    scene.frame_set(frame)
+    scene.render.filepath = %r + '%%05d' %% frame
+    bpy.ops.render.render(write_still=True)
+'''
+
+def load_piece():
+    # Globals of animation.py, which only builds its timeline when run without Blender, so this is quick
+    return runpy.run_path(os.path.join(script_dir, 'animation.py'), run_name='render')
+
+def act_frames(piece):
+    # Frames of every bar named in the animation timeline, sorted
+    bars = set(value for name, value in piece.items()
+               if re.match(r'act\d+_', name) and isinstance(value, (int, float)) and not isinstance(value, bool))
+    return sorted(set(int(round(piece['bar_to_frame'](bar))) for bar in bars))
+
+def chunks(boundaries, chunk_frames):
+    # (start, end) frame ranges, inclusive, between consecutive boundaries and at most chunk_frames long
+    # The last boundary is the last frame
+    ranges = []
+    for i in range(len(boundaries) - 1):
+        start = boundaries[i]
+        end = boundaries[i+1] - 1 if i < len(boundaries) - 2 else boundaries[i+1]
+        while start <= end:
+            ranges.append((start, min(start + chunk_frames - 1, end)))
+            start += chunk_frames
+    return ranges
+
+def frame_path(config, frame):
+    return config.path('render', 'output') + '%05d' % frame + extensions[config.get('render', 'format')]
+
+def prepare(config, piece, prepared):
+    # Write the keyframes into a copy of the scene for the workers to render
+    # The animation was already generated by load_piece, so Blender only loads the compiled keyframes
+    animation = os.path.splitext(prepared)[0] + '_animation.npz'
+    save_compiled(animation, piece['compiled'], piece['tl'].groups, piece['tl'].lods)
+    save = 'import bpy; bpy.ops.wm.save_as_mainfile(filepath=' + repr(prepared) + ', copy=True)'
+    subprocess.check_call([config.get('render', 'blender'), '--background', config.path('render', 'blend'),
+                           '--python', os.path.join(script_dir, 'load_animation.py'), '--python-expr', save,
+                           '--', animation])
+
+def unrendered(config, frames):
+    return [frame for frame in frames if not os.path.exists(frame_path(config, frame))]
+
+def render_frames(config, prepared, frames):
+    # Render the missing ones of frames in one Blender process, retrying failed runs
+    # Returns the frames still missing afterwards
+    for attempt in range(config.getint('render', 'retries') + 1):
+        missing = unrendered(config, frames)
+        if not missing:
+            break
+        command = [config.get('render', 'blender'), '--background', prepared,
+                   '--render-format', config.get('render', 'format'),
+                   '--threads', config.get('render', 'threads'),
+                   '--python-expr', render_script % (missing, config.path('render', 'output'))]
+        with open(os.devnull, 'w') as devnull:
+            returncode = subprocess.call(command, stdout=devnull)
+        if returncode != 0:
+            print('Frames', missing[0], '-', missing[-1], 'failed with exit code', returncode,
+                  '(attempt ' + str(attempt + 1) + ')')
+    return unrendered(config, frames)
+
+def link_duplicates(config, frames, sources):
+    # Give every duplicate frame its source frame's image, hard linked where the file system allows
+    for frame, source in zip(frames, sources):
+        path = frame_path(config, frame)
+        if frame == source or os.path.exists(path) or not os.path.exists(frame_path(config, source)):
+            continue
+        try:
+            os.link(frame_path(config, source), path)
+        except (OSError, AttributeError):
+            shutil.copyfile(frame_path(config, source), path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the piece on parallel local Blender processes')
+    parser.add_argument('--config', help='settings file, orbit.ini next to this script by default')
+    parser.add_argument('--workers', type=int, help='parallel Blender processes, overrides the config')
+    parser.add_argument('--no-dedupe', action='store_true', help='render every frame, even duplicates')
+    parser.add_argument('--dry-run', action='store_true', help='only list the chunks still to render')
+    args = parser.parse_args()
+    config = read_config(args.config)
+    # animation.py reads the same settings, here and in Blender
+    os.environ['ORBIT_CONFIG'] = config.filename
+    workers = args.workers if args.workers is not None else config.getint('render', 'workers')
+    workers = workers or os.cpu_count() or 1
+    piece = load_piece()
+    boundaries = act_frames(piece)
+    frames = np.arange(boundaries[0], boundaries[-1] + 1)
+    if args.no_dedupe:
+        sources = frames
+    else:
+        sources = frame_sources(piece['tl'].compile(), frames)
+        print(len(np.unique(sources)), 'of', len(frames), 'frames have a unique animated state')
+    todo = []
+    for start, end in chunks(boundaries, config.getint('render', 'chunk_frames')):
+        chunk = frames[start - frames[0]:end - frames[0] + 1]
+        unique = unrendered(config, chunk[sources[chunk - frames[0]] == chunk].tolist())
+        if unique:
+            todo.append(unique)
+            print('Chunk', start, '-', str(end) + ':', len(unique), 'frames to render')
+    if args.dry_run:
+        return 0
+    output_dir = os.path.dirname(config.path('render', 'output'))
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    prepared = os.path.splitext(config.path('render', 'blend'))[0] + '_render.blend'
+    if todo:
+        prepare(config, piece, prepared)
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = [pool.submit(render_frames, config, prepared, chunk) for chunk in todo]
+        for chunk, result in zip(todo, results):
+            missing = result.result()
+            if missing:
+                failed += len(missing)
+                print('Chunk', chunk[0], '-', chunk[-1], 'is missing', len(missing), 'frames')
+            else:
+                print('Chunk', chunk[0], '-', chunk[-1], 'done')
+    link_duplicates(config, frames.tolist(), sources.tolist())
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,44 +1,76 @@
 import bpy
-from mathutils import Vector
-from mathutils import Color
+from mathutils import Matrix, Vector
+import os
+import sys
 import time
 
-def duplicateObject(scene, name, copyobj):
- 
-    # Create new mesh
-    mesh = bpy.data.meshes.new(name)
- 
-    # Create new object associated with the mesh
-    ob_new = bpy.data.objects.new(name, mesh)
- 
-    # Copy data block from the old object into the new object
-    ob_new.data = copyobj.data.copy()
-    ob_new.scale = copyobj.scale
-    ob_new.location = copyobj.location
-    
-    # Link new object to the given scene and select it
-    scene.objects.link(ob_new)
-    ob_new.select = True
- 
-    return ob_new
+# Make the helper modules next to this script importable
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from cleanup import (decimatedMesh, duplicateObject, instanceObject, lodObject, objectColorMaterial,
+                     objectMaterial, remove_generated)
+from config import read_config
+from layout import lod_prefix, lod_ratios, ring_spacing, torus_colors, with_lods
+
+config = read_config()
+# Instanced rings all link the original mesh and share one material colored by each ring's object color,
+# instead of copying the mesh and making a material per ring
+instanced = config.getboolean('scene', 'instanced')
+
+def followTorus(newtorus, torus):
+    # Plain parenting instead of a CHILD_OF constraint per ring, still ignoring the scale of the torus
+    newtorus.parent = torus
+    scale = torus.scale
+    newtorus.matrix_parent_inverse = Matrix(((1 / scale.x, 0, 0, 0), (0, 1 / scale.y, 0, 0),
+                                             (0, 0, 1 / scale.z, 0), (0, 0, 0, 1)))
+
+# delete all pre-existing rings besides the original, with their meshes and materials, and their lower levels
+# of detail
+remove_generated(with_lods(['Torus']), ['TorMat'])
 
 torus = bpy.data.objects['Torus']
 scene = bpy.data.scenes['Scene']
-c = Color()
-numtor = 50
-for i in range(1,numtor+1):
-    name = 'Torus' + str(i)
-    newtorus = duplicateObject(scene, name, torus)
-    newtorus.location = Vector((0, 0, -20*i))
-    matname = 'TorMat' + str(i)
-    newmat = bpy.data.materials.new(matname)
-    c.hsv = float(i-1) / float(numtor), 1.0, 0.735
-    newmat.diffuse_color = c.r, c.g, c.b
-    newmat.emit = 1.
-    newtorus.active_material = newmat
-    newconstraint = newtorus.constraints.new('CHILD_OF')
-    newconstraint.target = torus
-    newconstraint.use_scale_x = False
-    newconstraint.use_scale_y = False
-    newconstraint.use_scale_z = False
+numtor = config.getint('scene', 'numtor')
+colors = torus_colors(numtor)
+# Only a pool of rings is made, animation.py moves each ring to the far end of the tunnel once the camera
+# has passed it, so the tunnel can have any number of rings; they start out as the first rings of the tunnel
+numpool = min(config.getint('scene', 'tunnel_pool'), numtor)
+# Every ring also gets an object per lower level of detail, all showing one decimated mesh per level;
+# animation.py moves them along and only renders the one for the ring's distance from the camera
+ratios = lod_ratios(config)
+torus_lods = [decimatedMesh(scene, torus, ratio, 'TorusLod' + str(level)) for level, ratio in enumerate(ratios, 1)]
+if instanced:
+    # The mesh is shared with the original Torus, so the copies get the material through their own slot
+    colormat = objectColorMaterial('TorMat', 1.)
+    new_objects = []
+    for i in range(1,numpool+1):
+        newtorus = instanceObject('Torus' + str(i), torus)
+        newtorus.location = Vector((0, 0, -ring_spacing*i))
+        newtorus.color = colors[i-1] + (1.,)
+        objectMaterial(newtorus, colormat)
+        followTorus(newtorus, torus)
+        new_objects.append(newtorus)
+        for level in range(1, len(ratios)+1):
+            lodtorus = lodObject(lod_prefix('Torus', level) + str(i), newtorus, torus_lods[level-1])
+            objectMaterial(lodtorus, colormat)
+            followTorus(lodtorus, torus)
+            new_objects.append(lodtorus)
+    # Link everything at once at the end, nothing needs selecting
+    for obj in new_objects:
+        scene.objects.link(obj)
+else:
+    for i in range(1,numpool+1):
+        name = 'Torus' + str(i)
+        newtorus = duplicateObject(scene, name, torus)
+        newtorus.location = Vector((0, 0, -ring_spacing*i))
+        matname = 'TorMat' + str(i)
+        newmat = bpy.data.materials.new(matname)
+        newmat.diffuse_color = colors[i-1]
+        newmat.emit = 1.
+        newtorus.active_material = newmat
+        followTorus(newtorus, torus)
+        for level in range(1, len(ratios)+1):
+            lodtorus = lodObject(lod_prefix('Torus', level) + str(i), newtorus, torus_lods[level-1])
+            objectMaterial(lodtorus, newmat)
+            followTorus(lodtorus, torus)
+            scene.objects.link(lodtorus)
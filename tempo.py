@@ -0,0 +1,74 @@
+# Tempo and time signature map for converting musical time to frames
+
+import numpy as np
+
+from midifile import read_midi
+
+class TempoMap:
+    # Beats are quarter notes and bars follow the time signature, both counted from 1 like beat_to_frame/bar_to_frame
+    # Frames are counted from 1 at the first beat
+    # All conversions accept scalars or arrays; scalars give back a Python number
+    # With snap=True frames are rounded to whole frames
+
+    def __init__(self, resolution, tempo_ticks, tempos, timesig_ticks, numerators, denominators, framerate=25):
+        self.resolution = resolution
+        self.framerate = framerate
+        # Tempo segments: start beat (from 0), beats per minute and seconds elapsed at the start
+        # 120 bpm until the first tempo event
+        tempo_beats = np.asarray(tempo_ticks, dtype=np.float64) / resolution
+        bpm = 60e6 / np.asarray(tempos, dtype=np.float64)
+        if len(tempo_beats) == 0 or tempo_beats[0] > 0:
+            tempo_beats = np.concatenate(([0.], tempo_beats))
+            bpm = np.concatenate(([120.], bpm))
+        self.tempo_beats = tempo_beats
+        self.bpm = bpm
+        self.tempo_seconds = np.concatenate(([0.], np.cumsum(np.diff(tempo_beats) / bpm[:-1] * 60)))
+        # Time signature segments: start beat (from 0), bar number at the start and beats per bar
+        # 4/4 until the first time signature event, and assume changes fall on bar lines
+        timesig_beats = np.asarray(timesig_ticks, dtype=np.float64) / resolution
+        bar_beats = np.asarray(numerators, dtype=np.float64) * 4 / np.asarray(denominators, dtype=np.float64)
+        if len(timesig_beats) == 0 or timesig_beats[0] > 0:
+            timesig_beats = np.concatenate(([0.], timesig_beats))
+            bar_beats = np.concatenate(([4.], bar_beats))
+        self.timesig_beats = timesig_beats
+        self.bar_beats = bar_beats
+        self.timesig_bars = np.concatenate(([1.], 1 + np.cumsum(np.diff(timesig_beats) / bar_beats[:-1])))
+
+    @classmethod
+    def constant(cls, tempo=120, framerate=25, numerator=4, denominator=4, resolution=480):
+        return cls(resolution, [0], [60e6 / tempo], [0], [numerator], [denominator], framerate)
+
+    @classmethod
+    def from_midi(cls, filename, framerate=25):
+        data = read_midi(filename)
+        return cls(data.resolution, data.tempo_ticks, data.tempos,
+                   data.timesig_ticks, data.numerators, data.denominators, framerate)
+
+    def is_constant(self):
+        return len(self.bpm) == 1
+
+    def beats_to_frames(self, beats, snap=False):
+        # Conversion: frame_num = (beat_num - 1) / beat/min * sec/min * frame/sec + 1, per tempo segment
+        beats = np.asarray(beats, dtype=np.float64) - 1
+        seg = np.maximum(np.searchsorted(self.tempo_beats, beats, side='right') - 1, 0)
+        seconds = self.tempo_seconds[seg] + ((beats - self.tempo_beats[seg]) / self.bpm[seg]) * 60
+        return self.finish(seconds * self.framerate + 1, snap)
+
+    def ticks_to_frames(self, ticks, snap=False):
+        return self.beats_to_frames(np.asarray(ticks) / self.resolution + 1, snap)
+
+    def bars_to_beats(self, bars):
+        bars = np.asarray(bars, dtype=np.float64)
+        seg = np.maximum(np.searchsorted(self.timesig_bars, bars, side='right') - 1, 0)
+        return self.finish(self.timesig_beats[seg] + (bars - self.timesig_bars[seg]) * self.bar_beats[seg] + 1, False)
+
+    def bars_to_frames(self, bars, snap=False):
+        return self.beats_to_frames(self.bars_to_beats(bars), snap)
+
+    def finish(self, values, snap):
+        values = np.asarray(values)
+        if snap:
+            values = np.rint(values).astype(np.int64)
+        if values.ndim == 0:
+            return values.item()
+        return values
@@ -0,0 +1,748 @@
+# Declarative keyframe timeline
+#
+# The piece is authored against a Timeline of channels instead of the Blender scene, then compiled into
+# sorted, deduplicated and conflict-checked keyframe arrays. Nothing here needs bpy, so the whole piece
+# can be generated and checked in plain Python; keyframes.apply_timeline writes the result into Blender.
+
+import bisect
+import hashlib
+import json
+import os
+
+from collections import namedtuple
+
+import numpy as np
+
+import profiler
+
+# Array properties are keyed per component, everything else is a single value
+array_sizes = {'location': 3, 'rotation_euler': 3, 'scale': 3, 'color': 3, 'diffuse_color': 3}
+# Objects have an RGBA color, lamps and materials RGB
+kind_array_sizes = {('objects', 'color'): 4}
+
+# Groups of objects are shown and hidden through one custom property of the scene each,
+# which drives hide and hide_render of every member
+group_properties = ('hide', 'hide_render')
+# Objects with levels of detail are rendered at the level this custom property of theirs holds, or not at all
+# when it holds the number of levels (culled), see culling.py and Timeline.lod
+lod_property = 'lod'
+
+# Single precision epsilon, below which Blender treats Bezier segments as flat
+flt_epsilon = 1.1920929e-07
+
+# Blender's default interpolation for new keyframes; booleans always hold their value
+# Bezier keyframes get Blender's default auto clamped handles
+default_interpolation = 'BEZIER'
+
+# Version of the file layout written by save_compiled
+compiled_format_version = 2
+
+# A channel is (kind, name, data_path, index), where kind is the bpy.data collection, e.g. 'objects' or 'lamps'
+# Keyframe arrays of one channel, sorted by frame
+# Values are NaN where the key takes the property's value in the scene (a value never set in the script)
+# holds take whatever the channel evaluates to when the hold was authored, and are resolved when compiling
+# unless that depends on a NaN value, in which case they are NaN and still marked in holds
+# seqs gives the order keys were authored in, sections the section each key was authored in
+ChannelKeys = namedtuple('ChannelKeys', ['frames', 'values', 'interpolations', 'seqs', 'holds', 'sections'])
+
+class Key:
+    # seq is when the frame was first keyed; a key replaced on the same frame also keeps every
+    # (seq, value, hold) it had in versions, since holds authored in between see the earlier values
+    __slots__ = ('value', 'interpolation', 'seq', 'hold', 'section', 'versions')
+
+    def __init__(self, value, interpolation, seq, hold, section):
+        self.value = value
+        self.interpolation = interpolation
+        self.seq = seq
+        self.hold = hold
+        self.section = section
+        self.versions = None
+
+class Vec:
+    # Stand-in for mathutils vectors, writes go through to the target's current value
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __setitem__(self, i, value):
+        self.values[i] = value
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __repr__(self):
+        return 'Vec(' + repr(self.values) + ')'
+
+    def copy(self):
+        return Vec(list(self.values))
+
+    x = property(lambda self: self.values[0], lambda self, value: self.__setitem__(0, value))
+    y = property(lambda self: self.values[1], lambda self, value: self.__setitem__(1, value))
+    z = property(lambda self: self.values[2], lambda self, value: self.__setitem__(2, value))
+
+class Target:
+    # Stand-in for a datablock: properties hold the current value in the script, as on a bpy object
+    # Properties that were never set are None and key the value the scene already has
+
+    def __init__(self, timeline, kind, name):
+        object.__setattr__(self, 'timeline', timeline)
+        object.__setattr__(self, 'kind', kind)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'values', {})
+
+    def __getattr__(self, data_path):
+        values = self.current(data_path)
+        if isinstance(values, list):
+            return Vec(values)
+        return values
+
+    def __setattr__(self, data_path, value):
+        if self.timeline.array_size(self.kind, data_path):
+            self.current(data_path)[:] = list(value)
+        else:
+            self.values[data_path] = value
+
+    def __repr__(self):
+        return 'Target(' + repr(self.kind) + ', ' + repr(self.name) + ')'
+
+    def current(self, data_path):
+        # Current value: a list for array properties, shared with any Vec handed out
+        if data_path not in self.values:
+            size = self.timeline.array_size(self.kind, data_path)
+            self.values[data_path] = [None] * size if size else None
+        return self.values[data_path]
+
+class Timeline:
+
+    def __init__(self):
+        self.targets = {}
+        # channel -> {frame: Key}
+        self.channels = {}
+        self.seq = 0
+        # (channel, frame, old value, new value) for keys replaced by a different value
+        self.conflicts = []
+        self.current_section = 'setup'
+        self.sections = ['setup']
+        profiler.section('setup')
+        # group name -> member object names
+        self.groups = {}
+        # object name -> names of the group members rendered at each level of detail of the object
+        self.lods = {}
+        # (kind, name) -> frames keys of the target's channels are never removed from when reducing, e.g. the
+        # onsets and cuts they follow
+        self.protected = {}
+
+    def target(self, kind, name):
+        if (kind, name) not in self.targets:
+            self.targets[(kind, name)] = Target(self, kind, name)
+        return self.targets[(kind, name)]
+
+    def object(self, name):
+        return self.target('objects', name)
+
+    def lamp(self, name):
+        return self.target('lamps', name)
+
+    def material(self, name):
+        return self.target('materials', name)
+
+    def scene(self):
+        # The scene the timeline is applied to, whatever its name
+        return self.target('scenes', None)
+
+    def group(self, name, object_names):
+        self.groups[name] = list(object_names)
+
+    def find_group(self, object_names):
+        # Name of the group with exactly these members, or None
+        object_names = list(object_names)
+        for name, members in self.groups.items():
+            if members == object_names:
+                return name
+        return None
+
+    def lod(self, name, levels):
+        # Render only the objects of levels[k] while object name's lod_property is k; levels may include
+        # objects that share its position, so one property covers all of them
+        self.lods[name] = [list(names) for names in levels]
+
+    def group_path(self, name):
+        # Data path of the scene property a group's visibility is keyed on
+        return '["hide_' + name + '"]'
+
+    def protect(self, frames, targets):
+        # Keep keys on these frames through reduce_keys, on the channels of the targets
+        frames = [float(frame) for frame in np.atleast_1d(frames)]
+        for target in targets:
+            self.protected.setdefault((target.kind, target.name), set()).update(frames)
+
+    def section(self, name):
+        # Keys authored from here on belong to section name, until the next section starts
+        self.current_section = name
+        if name not in self.sections:
+            self.sections.append(name)
+        profiler.section(name)
+
+    def array_size(self, kind, data_path):
+        return kind_array_sizes.get((kind, data_path), array_sizes.get(data_path, 0))
+
+    def key(self, target, data_path, index, frame, value, interpolation=None, hold=False):
+        # Add one keyframe on one channel; a later key on the same frame replaces the earlier one
+        channel = (target.kind, target.name, data_path, index)
+        profiler.count_keyframe(target.kind + '/' + str(target.name), data_path)
+        keys = self.channels.setdefault(channel, {})
+        frame = float(frame)
+        self.seq += 1
+        key = keys.get(frame)
+        if key is None:
+            if interpolation is None:
+                interpolation = 'CONSTANT' if isinstance(value, bool) else default_interpolation
+            keys[frame] = Key(value, interpolation, self.seq, hold, self.current_section)
+            return
+        if hold:
+            # keyframe_insert after frame_set on a keyed frame writes back the value already there
+            return
+        if key.hold or key.value != value:
+            self.conflicts.append((channel, frame, None if key.hold else key.value, value))
+        if key.versions is None:
+            key.versions = [(key.seq, key.value, key.hold)]
+        key.versions.append((self.seq, value, hold))
+        # Replacing a keyframe keeps its interpolation, as keyframe_insert does
+        key.value = value
+        key.hold = hold
+        key.section = self.current_section
+        if interpolation is not None:
+            key.interpolation = interpolation
+
+    def indices(self, target, data_path, index):
+        size = self.array_size(target.kind, data_path)
+        if not size:
+            return [0]
+        return range(size) if index == -1 else [index]
+
+    def insert(self, target, data_path, frame, index=-1, interpolation=None):
+        # Key the target's current value, like keyframe_insert
+        value = target.current(data_path)
+        for i in self.indices(target, data_path, index):
+            self.key(target, data_path, i, frame, value[i] if isinstance(value, list) else value, interpolation)
+
+    def keys(self, target, data_path, frames, values, index=0, interpolation=None):
+        # Key arrays of frames and values on one component of a property, e.g. from effects
+        for frame, value in zip(frames, values):
+            self.key(target, data_path, index, frame, float(value), interpolation)
+
+    def hold(self, target, data_path, frame, index=-1):
+        # Key whatever the channel evaluates to at frame, given the keys authored so far
+        for i in self.indices(target, data_path, index):
+            self.key(target, data_path, i, frame, None, hold=True)
+
+    def step(self, target, data_path, frame, before, after):
+        # Hold before through the previous frame and switch to after at frame
+        setattr(target, data_path, before)
+        self.insert(target, data_path, frame-1)
+        setattr(target, data_path, after)
+        self.insert(target, data_path, frame)
+
+    def pulse(self, target, data_path, frame, base, peak, release, attack=1):
+        # Rise from base to peak at frame and fall back to base release frames later
+        setattr(target, data_path, base)
+        self.insert(target, data_path, frame-attack)
+        setattr(target, data_path, peak)
+        self.insert(target, data_path, frame)
+        setattr(target, data_path, base)
+        self.insert(target, data_path, frame+release)
+
+    def interval(self, target, data_path, start, end, value=None):
+        # Hold value (the current value if None) from start through end
+        if value is not None:
+            setattr(target, data_path, value)
+        self.insert(target, data_path, start)
+        self.insert(target, data_path, end)
+
+    def set_interpolation(self, target, data_path, interpolation):
+        # Set the interpolation of every keyframe authored so far on a property
+        for (kind, name, path, index), keys in self.channels.items():
+            if kind == target.kind and name == target.name and path == data_path:
+                for key in keys.values():
+                    key.interpolation = interpolation
+
+    @profiler.profiled('compile')
+    def compile(self, strict=False):
+        # Sorted keyframe arrays per channel
+        # With strict, replaced keys with different values are an error instead of later-wins
+        if strict and self.conflicts:
+            raise ValueError(str(len(self.conflicts)) + ' conflicting keyframes, first: ' + repr(self.conflicts[0]))
+        return {channel: self.compile_channel(channel) for channel in self.channels}
+
+    def compile_channel(self, channel):
+        keys = self.channels[channel]
+        frames = sorted(keys)
+        values = np.array([np.nan if keys[f].value is None else float(keys[f].value) for f in frames],
+                          dtype=np.float64)
+        interpolations = tuple(keys[f].interpolation for f in frames)
+        seqs = np.array([keys[f].seq for f in frames], dtype=np.int64)
+        holds = np.array([keys[f].hold for f in frames], dtype=bool)
+        if holds.any() or any(keys[f].versions for f in frames):
+            versions = dict((i, keys[f].versions) for i, f in enumerate(frames) if keys[f].versions)
+            values, holds = resolve_holds(frames, values, interpolations, seqs, holds, versions)
+        return ChannelKeys(
+            frames=np.array(frames, dtype=np.float64),
+            values=values,
+            interpolations=interpolations,
+            seqs=seqs,
+            holds=holds,
+            sections=tuple(keys[f].section for f in frames),
+        )
+
+    def evaluate(self, target, data_path, frames, index=0):
+        # Values one component of a property takes at an array of frames, given the keys authored so far
+        channel = (target.kind, target.name, data_path, index)
+        if channel not in self.channels:
+            raise KeyError('no keys on ' + repr(channel))
+        return evaluate_frames(self.compile_channel(channel), frames)
+
+    def summary(self):
+        nkeys = sum(len(keys) for keys in self.channels.values())
+        return (str(len(self.channels)) + ' channels, ' + str(nkeys) + ' keyframes, ' +
+                str(len(self.conflicts)) + ' conflicts')
+
+def channel_hash(keys):
+    # Content hash of one compiled channel
+    # Holds depend on the keys authored before them, so the authoring order within the channel counts too
+    # Frames and values count as float32, as Blender and save_compiled store them, so a channel loaded from a
+    # compiled file hashes the same as the one it was saved from
+    h = hashlib.sha1()
+    h.update(keys.frames.astype(np.float32).tobytes())
+    h.update(keys.values.astype(np.float32).tobytes())
+    h.update(keys.holds.tobytes())
+    h.update(np.argsort(keys.seqs, kind='stable').tobytes())
+    h.update(repr(keys.interpolations).encode('utf-8'))
+    return h.hexdigest()
+
+def section_hashes(compiled):
+    # Content hash of the keys authored in each section, {section: hash}, with float32 keys like channel_hash
+    hashes = {}
+    for channel in sorted(compiled):
+        keys = compiled[channel]
+        frames = keys.frames.astype(np.float32)
+        values = keys.values.astype(np.float32)
+        for i, section in enumerate(keys.sections):
+            key = (channel, float(frames[i]), float(values[i]), keys.interpolations[i], bool(keys.holds[i]))
+            hashes.setdefault(section, hashlib.sha1()).update(repr(key).encode('utf-8'))
+    return {section: h.hexdigest() for section, h in hashes.items()}
+
+def bezier_handles(frames, values, i):
+    # Left and right handles ((x, y), (x, y)) of keyframe i with auto clamped handles, as Blender computes them
+    n = len(frames)
+    x, y = frames[i], values[i]
+    if n == 1:
+        return (x, y), (x, y)
+    # The missing neighbour of the first and last keyframes is mirrored
+    px, py = (frames[i-1], values[i-1]) if i > 0 else (2*x - frames[i+1], 2*y - values[i+1])
+    nx, ny = (frames[i+1], values[i+1]) if i < n - 1 else (2*x - frames[i-1], 2*y - values[i-1])
+    len_a = (x - px) or 1.
+    len_b = (nx - x) or 1.
+    tx = (nx - x) / len_b + (x - px) / len_a
+    ty = (ny - y) / len_b + (y - py) / len_a
+    length = tx * 2.5614
+    if length == 0:
+        return (x, y), (x, y)
+    len_a = min(len_a, 5 * len_b)
+    len_b = min(len_b, 5 * len_a)
+    left = [x - tx * len_a / length, y - ty * len_a / length]
+    right = [x + tx * len_b / length, y + ty * len_b / length]
+    if 0 < i < n - 1:
+        if (py <= y and ny <= y) or (py >= y and ny >= y):
+            # Keep extremes flat
+            left[1] = right[1] = y
+        else:
+            # Handles don't overshoot the neighbouring keyframes, and stay in line when clamped
+            if (py <= y and py > left[1]) or (py > y and py < left[1]):
+                left[1] = py
+                right[1] = y + (y - left[1]) / (x - left[0]) * (right[0] - x)
+            elif (py <= y and ny < right[1]) or (py > y and ny > right[1]):
+                right[1] = ny
+                left[1] = y - (right[1] - y) / (right[0] - x) * (x - left[0])
+    else:
+        # The first and last keyframes are flat
+        left[1] = right[1] = y
+    return tuple(left), tuple(right)
+
+def bezier_handles_array(frames, values):
+    # bezier_handles for every keyframe at once, as arrays (left x, left y, right x, right y)
+    x = np.asarray(frames, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    n = len(x)
+    if n < 2:
+        return x.copy(), y.copy(), x.copy(), y.copy()
+    px = np.concatenate(([2*x[0] - x[1]], x[:-1]))
+    py = np.concatenate(([2*y[0] - y[1]], y[:-1]))
+    nx = np.concatenate((x[1:], [2*x[-1] - x[-2]]))
+    ny = np.concatenate((y[1:], [2*y[-1] - y[-2]]))
+    len_a = np.where(x - px != 0, x - px, 1.)
+    len_b = np.where(nx - x != 0, nx - x, 1.)
+    tx = (nx - x) / len_b + (x - px) / len_a
+    ty = (ny - y) / len_b + (y - py) / len_a
+    length = tx * 2.5614
+    flat = length == 0
+    length = np.where(flat, 1., length)
+    len_a = np.minimum(len_a, 5 * len_b)
+    len_b = np.minimum(len_b, 5 * len_a)
+    lx = x - tx * len_a / length
+    ly = y - ty * len_a / length
+    rx = x + tx * len_b / length
+    ry = y + ty * len_b / length
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Keep extremes flat, otherwise handles don't overshoot the neighbouring keyframes
+        extreme = ((py <= y) & (ny <= y)) | ((py >= y) & (ny >= y))
+        clamp_left = ~extreme & (((py <= y) & (py > ly)) | ((py > y) & (py < ly)))
+        clamp_right = ~extreme & ~clamp_left & (((py <= y) & (ny < ry)) | ((py > y) & (ny > ry)))
+        ly = np.where(clamp_left, py, ly)
+        ry = np.where(clamp_left, y + (y - ly) / (x - lx) * (rx - x), ry)
+        ry = np.where(clamp_right, ny, ry)
+        ly = np.where(clamp_right, y - (ry - y) / (rx - x) * (x - lx), ly)
+    # The first and last keyframes are flat
+    extreme[[0, -1]] = True
+    ly = np.where(extreme, y, ly)
+    ry = np.where(extreme, y, ry)
+    return (np.where(flat, x, lx), np.where(flat, y, ly), np.where(flat, x, rx), np.where(flat, y, ry))
+
+def bezier_value(p0, p1, p2, p3, frame):
+    # Value of one Bezier segment at frame, with handles shortened to fit the segment like Blender does
+    x0, y0 = p0
+    x1, y1 = p1
+    x2, y2 = p2
+    x3, y3 = p3
+    # Flat segments are exactly flat, as in Blender
+    if abs(y0 - y3) < flt_epsilon and abs(y1 - y2) < flt_epsilon and abs(y2 - y3) < flt_epsilon:
+        return y0
+    h1 = x0 - x1
+    h2 = x3 - x2
+    total = abs(h1) + abs(h2)
+    if total > x3 - x0:
+        fac = (x3 - x0) / total
+        x1, y1 = x0 - fac * h1, y0 - fac * (y0 - y1)
+        x2, y2 = x3 - fac * h2, y3 - fac * (y3 - y2)
+    # x(t) is increasing, so bisect for t
+    lo, hi = 0., 1.
+    for _ in range(60):
+        t = (lo + hi) / 2
+        u = 1 - t
+        if u*u*u*x0 + 3*u*u*t*x1 + 3*u*t*t*x2 + t*t*t*x3 < frame:
+            lo = t
+        else:
+            hi = t
+    t = (lo + hi) / 2
+    u = 1 - t
+    return u*u*u*y0 + 3*u*u*t*y1 + 3*u*t*t*y2 + t*t*t*y3
+
+def bezier_values(p0, p1, p2, p3, frames):
+    # bezier_value for arrays of segments and frames at once
+    x0, y0 = p0
+    x1, y1 = p1
+    x2, y2 = p2
+    x3, y3 = p3
+    # Flat segments are exactly flat, as in Blender
+    flat = (abs(y0 - y3) < flt_epsilon) & (abs(y1 - y2) < flt_epsilon) & (abs(y2 - y3) < flt_epsilon)
+    h1 = x0 - x1
+    h2 = x3 - x2
+    total = abs(h1) + abs(h2)
+    fac = np.where(total > x3 - x0, (x3 - x0) / np.where(total > 0, total, 1.), 1.)
+    x1, y1 = x0 - fac * h1, y0 - fac * (y0 - y1)
+    x2, y2 = x3 - fac * h2, y3 - fac * (y3 - y2)
+    # x(t) is increasing, so bisect for t, on the polynomial coefficients of x(t) - frames
+    ax = x3 - x0 + 3 * (x1 - x2)
+    bx = 3 * (x0 - 2 * x1 + x2)
+    cx = 3 * (x1 - x0)
+    dx = x0 - frames
+    t = np.full(np.shape(frames), 0.5)
+    step = 0.25
+    # Down to the last bit of t in [0, 1], like the 60 halvings of bezier_value
+    for _ in range(53):
+        t += np.where(((ax * t + bx) * t + cx) * t + dx < 0, step, -step)
+        step /= 2
+    ay = y3 - y0 + 3 * (y1 - y2)
+    by = 3 * (y0 - 2 * y1 + y2)
+    cy = 3 * (y1 - y0)
+    return np.where(flat, y0, ((ay * t + by) * t + cy) * t + y0)
+
+def evaluate(frames, values, interpolations, frame):
+    # Value of an F-curve with keyframes at sorted frames at frame, with constant extrapolation
+    if not frames:
+        return None
+    if frame <= frames[0]:
+        return values[0]
+    if frame >= frames[-1]:
+        return values[-1]
+    i = bisect.bisect_right(frames, frame) - 1
+    if frames[i] == frame:
+        return values[i]
+    interpolation = interpolations[i]
+    if interpolation == 'CONSTANT':
+        return values[i]
+    if interpolation == 'LINEAR':
+        return values[i] + (values[i+1] - values[i]) * (frame - frames[i]) / (frames[i+1] - frames[i])
+    p1 = bezier_handles(frames, values, i)[1]
+    p2 = bezier_handles(frames, values, i+1)[0]
+    return bezier_value((frames[i], values[i]), p1, p2, (frames[i+1], values[i+1]), frame)
+
+def evaluate_frames(keys, at):
+    # Values of a compiled channel (ChannelKeys) at an array of frames, same as evaluate for each
+    frames = keys.frames
+    values = keys.values
+    at = np.asarray(at, dtype=np.float64)
+    i = np.clip(np.searchsorted(frames, at, side='right') - 1, 0, len(frames) - 1)
+    out = values[i].copy()
+    between = (at > frames[0]) & (at < frames[-1]) & (at != frames[i])
+    interpolations = np.array(keys.interpolations)
+    linear = between & (interpolations == 'LINEAR')[i]
+    j = i[linear]
+    out[linear] = values[j] + (values[j+1] - values[j]) * (at[linear] - frames[j]) / (frames[j+1] - frames[j])
+    bezier = between & (interpolations == 'BEZIER')[i]
+    if bezier.any():
+        j = i[bezier]
+        # Right handles of the keyframes before and left handles of those after, as (x, y) rows
+        lx, ly, rx, ry = bezier_handles_array(frames, values)
+        right = np.array((rx[j], ry[j]))
+        left = np.array((lx[j + 1], ly[j + 1]))
+        # Holds between equal keys are common and need no solving
+        curved = ~((abs(values[j] - values[j+1]) < flt_epsilon) & (abs(right[1] - left[1]) < flt_epsilon) &
+                   (abs(left[1] - values[j+1]) < flt_epsilon))
+        j = j[curved]
+        bezier[bezier] = curved
+        out[bezier] = bezier_values((frames[j], values[j]), right[:, curved], left[:, curved],
+                                   (frames[j+1], values[j+1]), at[bezier])
+    return out
+
+def frame_sources(compiled, frames):
+    # For each of frames, the first of frames where every channel evaluates to the same values
+    # Frames with the same source show the same animated state, as far as the timeline knows
+    frames = np.asarray(frames, dtype=np.int64)
+    states = np.zeros((len(frames), 0))
+    if compiled:
+        # Rounded so evaluation noise doesn't tell identical states apart
+        states = np.column_stack([np.round(evaluate_frames(compiled[channel], frames), 6)
+                                  for channel in sorted(compiled)])
+    first = {}
+    sources = np.empty(len(frames), dtype=np.int64)
+    for i in range(len(frames)):
+        sources[i] = frames[first.setdefault(states[i].tobytes(), i)]
+    return sources
+
+def channel_subset(keys, mask):
+    # The keys of a compiled channel where mask is True
+    return ChannelKeys(
+        frames=keys.frames[mask],
+        values=keys.values[mask],
+        interpolations=tuple(np.array(keys.interpolations)[mask]),
+        seqs=keys.seqs[mask],
+        holds=keys.holds[mask],
+        sections=tuple(np.array(keys.sections, dtype=object)[mask]),
+    )
+
+def simplify_keep(frames, values, fixed, epsilon):
+    # Ramer-Douglas-Peucker between consecutive fixed keys: which keys to keep so that every key is within
+    # epsilon of the line between the kept keys around it (measured along the value axis)
+    keep = fixed.copy()
+    anchors = np.flatnonzero(fixed)
+    stack = list(zip(anchors[:-1], anchors[1:]))
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        line = values[a] + (values[b] - values[a]) * (frames[a+1:b] - frames[a]) / (frames[b] - frames[a])
+        deviation = abs(values[a+1:b] - line)
+        k = int(np.argmax(deviation))
+        if not deviation[k] <= epsilon:
+            m = a + 1 + k
+            keep[m] = True
+            stack.append((a, m))
+            stack.append((m, b))
+    return keep
+
+def reduce_channel(keys, protected, tolerance, simplify=0.):
+    # Compiled channel without keys that don't change the curve by more than tolerance (simplify if larger)
+    # at any whole frame or at any of its keys
+    # Drops keys inside runs of equal values, keys on the straight line between linear neighbours and, with
+    # simplify, whatever Ramer-Douglas-Peucker drops for that error; keys are never moved, and the first
+    # and last key, keys on protected frames and keys with NaN values are always kept
+    n = len(keys.frames)
+    if n < 3 or keys.holds.any():
+        # Unresolved holds are evaluated in the scene from the keys authored before them, keep those as is
+        return keys
+    frames = keys.frames
+    values = keys.values
+    interpolations = np.array(keys.interpolations)
+    fixed = np.isnan(values)
+    if len(protected):
+        # protected is sorted
+        fixed |= protected[np.minimum(np.searchsorted(protected, frames), len(protected) - 1)] == frames
+    fixed[0] = fixed[-1] = True
+    if (interpolations == 'CONSTANT').all():
+        # Steps, e.g. visibility and cull keys, have nothing to fit: only repeats of the previous value go,
+        # which can't change the curve at all
+        drop = np.zeros(n, dtype=bool)
+        drop[1:] = values[1:] == values[:-1]
+        drop &= ~fixed
+        return channel_subset(keys, ~drop) if drop.any() else keys
+    drop = np.zeros(n, dtype=bool)
+    # Equal to both neighbours, or to the previous key when both keys hold their value
+    same_prev = abs(values[1:-1] - values[:-2]) <= tolerance
+    same_next = abs(values[2:] - values[1:-1]) <= tolerance
+    held = (interpolations[:-2] == 'CONSTANT') & (interpolations[1:-1] == 'CONSTANT')
+    drop[1:-1] = same_prev & (same_next | held)
+    # On the line through both neighbours, with linear segments on both sides
+    linear = (interpolations[:-2] == 'LINEAR') & (interpolations[1:-1] == 'LINEAR')
+    line = values[:-2] + (values[2:] - values[:-2]) * (frames[1:-1] - frames[:-2]) / (frames[2:] - frames[:-2])
+    drop[1:-1] |= linear & (abs(values[1:-1] - line) <= tolerance)
+    limit = tolerance
+    if simplify > tolerance:
+        drop |= ~simplify_keep(frames, values, fixed, simplify)
+        limit = simplify
+    drop &= ~fixed
+    if not drop.any():
+        return keys
+    # Check the reduced curve against the original and put back the dropped key nearest to the worst frame
+    # between each pair of kept keys, until no frame moved too far; Bezier handles depend on the
+    # neighbouring keys, so dropping keys that are fine on their own can still bend the curve around them
+    at = np.union1d(np.arange(np.ceil(frames[0]), np.floor(frames[-1]) + 1), frames)
+    # Only frames within two kept keys of a dropped one can change
+    kept = np.flatnonzero(~drop)
+    pos = np.searchsorted(kept, np.flatnonzero(drop))
+    changed = np.zeros(n, dtype=np.int64)
+    np.add.at(changed, kept[np.maximum(pos - 2, 0)], 1)
+    np.add.at(changed, kept[np.minimum(pos + 1, len(kept) - 1)], -1)
+    changed = np.cumsum(changed) > 0
+    at = at[changed[np.searchsorted(frames, at, side='right') - 1]]
+    original = evaluate_frames(keys, at)
+    while drop.any():
+        reduced = evaluate_frames(channel_subset(keys, ~drop), at)
+        # Frames where either curve takes a scene value only match when both do
+        bad = ~(abs(reduced - original) <= limit) & ~(np.isnan(reduced) & np.isnan(original))
+        if not bad.any():
+            break
+        error = np.where(np.isnan(reduced) | np.isnan(original), np.inf, abs(reduced - original))
+        segments = np.searchsorted(frames[~drop], at, side='right')
+        dropped = np.flatnonzero(drop)
+        for segment in np.unique(segments[bad]):
+            worst = np.flatnonzero(bad & (segments == segment))
+            worst = worst[np.argmax(error[worst])]
+            nearest = dropped[np.argmin(abs(frames[dropped] - at[worst]))]
+            drop[nearest] = False
+    return channel_subset(keys, ~drop)
+
+@profiler.profiled('compile')
+def reduce_keys(compiled, protected=None, tolerance=1e-5, simplify=0.):
+    # reduce_channel for every channel of a compiled timeline, with protected frames per target as
+    # Timeline.protected, so a channel only changes when its own keys or protected frames do
+    protected = dict((target, np.array(sorted(frames), dtype=np.float64))
+                     for target, frames in (protected or {}).items())
+    unprotected = np.zeros(0)
+    return {channel: reduce_channel(keys, protected.get(channel[:2], unprotected), tolerance, simplify)
+            for channel, keys in compiled.items()}
+
+def save_compiled(filename, compiled, groups=None, lods=None):
+    # Write a compiled timeline, its groups and levels of detail to an .npz file for load_compiled
+    # All channels share flat arrays: (frame, value) pairs as float32, as Blender stores keyframes, plus the
+    # interpolation, section, authoring order and hold flag of every key; offsets[i] is where channel i starts
+    channels = sorted(compiled, key=repr)
+    interpolation_names = sorted(set(i for channel in channels for i in compiled[channel].interpolations))
+    section_names = sorted(set(s for channel in channels for s in compiled[channel].sections))
+    header = {
+        'version': compiled_format_version,
+        'channels': [list(channel) for channel in channels],
+        'interpolations': interpolation_names,
+        'sections': section_names,
+        'groups': groups or {},
+        'lods': lods or {},
+    }
+    keys = [compiled[channel] for channel in channels]
+    offsets = np.cumsum([0] + [len(k.frames) for k in keys])
+    arrays = {
+        'header': np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8),
+        'offsets': offsets.astype(np.int64),
+        'keys': np.zeros((0, 2), dtype=np.float32),
+        'interpolations': np.zeros(0, dtype=np.uint8),
+        'sections': np.zeros(0, dtype=np.uint16),
+        'seqs': np.zeros(0, dtype=np.int64),
+        'holds': np.zeros(0, dtype=bool),
+    }
+    if keys:
+        interpolation_codes = dict((name, i) for i, name in enumerate(interpolation_names))
+        section_codes = dict((name, i) for i, name in enumerate(section_names))
+        arrays['keys'] = np.column_stack((np.concatenate([k.frames for k in keys]),
+                                          np.concatenate([k.values for k in keys]))).astype(np.float32)
+        arrays['interpolations'] = np.array([interpolation_codes[i] for k in keys for i in k.interpolations],
+                                            dtype=np.uint8)
+        arrays['sections'] = np.array([section_codes[s] for k in keys for s in k.sections], dtype=np.uint16)
+        arrays['seqs'] = np.concatenate([k.seqs for k in keys]).astype(np.int64)
+        arrays['holds'] = np.concatenate([k.holds for k in keys])
+    # Write to a temporary name first so readers never see a partial file
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, filename)
+
+def load_compiled(filename):
+    # (compiled, groups, lods) saved by save_compiled
+    with np.load(filename) as data:
+        header = json.loads(data['header'].tobytes().decode('utf-8'))
+        if header['version'] != compiled_format_version:
+            raise ValueError(filename + ' has compiled format version ' + str(header['version']) +
+                             ', expected ' + str(compiled_format_version))
+        offsets = data['offsets']
+        keys = data['keys'].astype(np.float64)
+        interpolations = np.array(header['interpolations'], dtype=object)[data['interpolations']]
+        sections = np.array(header['sections'], dtype=object)[data['sections']]
+        seqs = data['seqs']
+        holds = data['holds']
+    compiled = {}
+    for i, channel in enumerate(header['channels']):
+        lo, hi = offsets[i], offsets[i+1]
+        compiled[tuple(channel)] = ChannelKeys(
+            frames=keys[lo:hi, 0].copy(),
+            values=keys[lo:hi, 1].copy(),
+            interpolations=tuple(interpolations[lo:hi]),
+            seqs=seqs[lo:hi],
+            holds=holds[lo:hi],
+            sections=tuple(sections[lo:hi]),
+        )
+    return compiled, header['groups'], header['lods']
+
+def resolve_holds(frames, values, interpolations, seqs, holds, versions=None):
+    # Values of holds from the keys authored before them, in the order they were authored, the way
+    # keyframe_insert after frame_set would key them
+    # versions gives every (seq, value, hold) of keys replaced on the same frame, by index
+    # Returns new values and holds, with holds that depend on a NaN value left as they are
+    values = values.copy()
+    holds = holds.copy()
+    versions = versions or {}
+    events = []
+    for i in range(len(frames)):
+        for seq, value, hold in versions.get(i, [(seqs[i], values[i], holds[i])]):
+            events.append((seq, i, np.nan if value is None else float(value), hold))
+    events.sort(key=lambda event: event[0])
+    so_far_frames = []
+    so_far_values = []
+    so_far_interpolations = []
+    for seq, i, value, hold in events:
+        if hold:
+            resolved = evaluate(so_far_frames, so_far_values, so_far_interpolations, frames[i])
+            if resolved is not None and resolved == resolved:
+                value = resolved
+                hold = False
+        values[i] = value
+        holds[i] = hold
+        pos = bisect.bisect_left(so_far_frames, frames[i])
+        if pos < len(so_far_frames) and so_far_frames[pos] == frames[i]:
+            so_far_values[pos] = value
+            continue
+        so_far_frames.insert(pos, frames[i])
+        so_far_values.insert(pos, value)
+        so_far_interpolations.insert(pos, interpolations[i])
+    return values, holds